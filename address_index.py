@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+
+import requests
+
+import log
+from delta_sync import DeltaBuilder, DeltaSource
+from erp_client import erp
+from snapshot import UNCHANGED, SnapshotStore
+
+
+ADDRESS_REFRESH_INTERVAL = int(os.environ.get('ADDRESS_REFRESH_INTERVAL', 60))
+ADDRESS_FULL_INTERVAL = int(os.environ.get('ADDRESS_FULL_INTERVAL', 6 * 3600))
+ADDRESS_SNAPSHOT = 'customer_address'
+
+logger = log.get('address_index')
+
+
+class AddressSync(DeltaBuilder):
+    # customer -> newest Address linked to it (the first one in the ERP's default order).
+    # Changed addresses arrive oldest first, so each one simply replaces an older pick.
+
+    def __init__(self, full_interval=ADDRESS_FULL_INTERVAL):
+        super().__init__(full_interval)
+        self.source = DeltaSource('Address', ['name', 'links.link_name'])
+        self.by_customer = {}
+        self._picked = {}
+
+    def full(self):
+        by_customer = {}
+        picked = {}
+        for row in self.source.pull_all():
+            customer = row.get('link_name')
+            if customer and customer not in by_customer:
+                by_customer[customer] = row.get('name')
+                picked[customer] = (row.get('modified') or '', row.get('name') or '')
+        self.by_customer = by_customer
+        self._picked = picked
+        self.source.commit()
+        return by_customer
+
+    def delta(self):
+        changed = 0
+        for row in list(self.source.pull_changes()):
+            customer = row.get('link_name')
+            if not customer:
+                continue
+            stamp = (row.get('modified') or '', row.get('name') or '')
+            if customer in self._picked and stamp < self._picked[customer]:
+                continue
+            self._picked[customer] = stamp
+            if self.by_customer.get(customer) != row.get('name'):
+                self.by_customer[customer] = row.get('name')
+                changed += 1
+        self.source.commit()
+        return self.by_customer if changed else UNCHANGED
+
+
+class AddressIndex:
+    # customer -> first Address linked to it, in the ERP's default (modified desc) order.
+    # The table is kept current by AddressSync in the background and swapped in as a whole;
+    # customers missing from it are resolved with a targeted query and remembered until
+    # the table next changes.
+
+    def __init__(self, refresh_interval=ADDRESS_REFRESH_INTERVAL, use_snapshot=True):
+        self.refresh_interval = refresh_interval
+        self.sync = AddressSync()
+        self.store = SnapshotStore(ADDRESS_SNAPSHOT, self.sync, refresh_interval) if use_snapshot else None
+        self.loaded_at = None
+        self._by_customer = {}
+        self._extra = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def load(self):
+        by_customer = self.store.load() if self.store else self.sync()
+        if by_customer is None:
+            return False
+        if by_customer is self._by_customer or by_customer is UNCHANGED:
+            return True
+
+        with self._lock:
+            # A snapshot that was only re-stamped has the same contents
+            if getattr(by_customer, 'version', None) != getattr(self._by_customer, 'version', None):
+                self._extra = {}
+            self._by_customer = by_customer
+            self.loaded_at = time.time()
+        return True
+
+    def fetch_one(self, customer):
+        response = erp.get_list(
+            'Address', '["name", "links.link_name"]',
+            filters=f'[["Dynamic Link", "link_name", "=", "{customer}"]]',
+            limit_page_length=1,
+        )
+        response.raise_for_status()
+        data = response.json().get('data', [])
+        return data[0].get('name') if data else None
+
+    def peek(self, customer):
+        # (known, address) without going to the ERP
+        address = self._by_customer.get(customer)
+        if address is not None:
+            return True, address
+        with self._lock:
+            if customer in self._extra:
+                return True, self._extra[customer]
+        return False, None
+
+    def get(self, customer):
+        if not customer:
+            return None
+        address = self._by_customer.get(customer)
+        if address is not None:
+            return address
+
+        with self._lock:
+            if customer in self._extra:
+                return self._extra[customer]
+        try:
+            address = self.fetch_one(customer)
+        except requests.RequestException as e:
+            # Don't remember transient failures as "no address"
+            logger.warning('address_lookup_failed', customer=customer, error=e)
+            return None
+        with self._lock:
+            self._extra[customer] = address
+        return address
+
+    def get_many(self, customers):
+        # Like get() for a batch: the customers the index doesn't know are looked up
+        # together in one query. Customers whose lookup failed are left out.
+        found = {}
+        missing = []
+        for customer in dict.fromkeys(c for c in customers if c):
+            known, address = self.peek(customer)
+            if known:
+                found[customer] = address
+            else:
+                missing.append(customer)
+        if not missing:
+            return found
+
+        try:
+            fetched = self.fetch_many(missing)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning('address_lookup_failed', customers=len(missing), error=e)
+            return found
+        with self._lock:
+            self._extra.update(fetched)
+        found.update(fetched)
+        return found
+
+    def fetch_many(self, customers):
+        rows = erp.iter_list(
+            'Address', '["name", "links.link_name"]',
+            filters=json.dumps([["Dynamic Link", "link_name", "in", list(customers)]]),
+            # Almost always a single page; don't prefetch ones that will come back empty
+            in_flight=1, background=False,
+        )
+        # Rows come newest first, so the first one per customer is what fetch_one returns
+        fetched = dict.fromkeys(customers)
+        for row in rows:
+            customer = row.get('link_name')
+            if customer in fetched and fetched[customer] is None:
+                fetched[customer] = row.get('name')
+        return fetched
+
+    def start(self):
+        # An existing snapshot makes the index usable straight away; the ERP is only
+        # consulted from the background thread.
+        if self.store is not None and self.loaded_at is None:
+            data = self.store.open()
+            if data is not None:
+                self._by_customer = data
+                self.loaded_at = data.created_at
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='address-index', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.load()
+            except Exception as e:
+                logger.exception('address_index_refresh_failed')
+            time.sleep(self.refresh_interval)
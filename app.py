@@ -1,13 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session,send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, g, abort, make_response
 import requests
-import pandas as pd
+import atexit
+import html
+import json
+import os
 import random
 import re
+import time
 from datetime import datetime
 from flask_cors import CORS
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+
+from werkzeug.datastructures import MultiDict
+
+from address_index import AddressIndex
+from assets import REVALIDATE, PageCache, StaticAssets
+import bulk_import
+from bulk_import import BULK_IMPORT_MAX_BYTES, BadUpload
+from cache import TTLCache
+import log
+import metrics
+from erp_client import ERPBusy, erp
+from mailer import MailQueue
+from otp import INVALID, EXPIRED, LOCKED, VERIFIED, OTP_VERIFIED_TTL, OTPStore, OTPUnavailable
+from outbox import Outbox
+from ratelimit import RateLimiter, make_backend
+from refresh import RefreshingValue
+from serial_index import SerialIndex, SerialRecord
+from snapshot import SnapshotStore
+import zonal_map
+from zonal_map import (
+    ZonalMapSync, ZONAL_MAP_REFRESH_INTERVAL, ZONAL_MAP_RETRY_INTERVAL, ZONAL_MAP_SNAPSHOT
+)
 
 
 def is_valid_email(email):
@@ -16,126 +39,162 @@ def is_valid_email(email):
     return re.match(regex, email) is not None
 
 
-# Generate a random secret key for session management
+SERIAL_CACHE_SIZE = int(os.environ.get('SERIAL_CACHE_SIZE', 4096))
+SERIAL_CACHE_TTL = int(os.environ.get('SERIAL_CACHE_TTL', 300))
+SERIAL_BATCH_MAX = int(os.environ.get('SERIAL_BATCH_MAX', 100))
+# Refuse submissions whose contact email hasn't been verified with a one-time code
+OTP_REQUIRED = os.environ.get('OTP_REQUIRED', '') not in ('', '0', 'false')
+
+logger = log.get('app')
+access_log = log.get('http')
+
+# Generate a random secret key for session management. Behind several workers, set
+# SECRET_KEY to the same value in each, or a session (flashed messages, verified email
+# addresses) only holds on the worker that started it.
 random_number = random.randint(14364546454654654654651465654, 9168468484867187618761871687171)
-app = Flask(__name__)
-app.secret_key = str(random_number)
+# static/ is served from memory by static_file below, under fingerprinted names
+app = Flask(__name__, static_folder=None)
+app.secret_key = os.environ.get('SECRET_KEY') or str(random_number)
 CORS(app)
 
-@app.route('/elec-image')
-def serve_image():
-    return send_from_directory('static', 'ELEC.png')
+OUTBOX_SECONDS = metrics.histogram('outbox_enqueue_seconds', 'Journalling a submitted form before the redirect.',
+                                   ['doctype'])
 
-def load_and_preprocess_data():
-    base_url = 'https://erpv14.electrolabgroup.com/'
-    headers = {'Authorization': 'token 3ee8d03949516d0:6baa361266cf807'}
 
-    # Fetch Service Person data
-    endpoint_sp = 'api/resource/Service Person'
-    url_sp = base_url + endpoint_sp
-    params_sp = {
-        'fields': '["name","employee","territory"]',
-        'limit_start': 0,
-        'limit_page_length': 100000000000,
-    }
-    response_sp = requests.get(url_sp, params=params_sp, headers=headers)
-    if response_sp.status_code == 200:
-        ser_per_df = pd.DataFrame(response_sp.json()['data'])
-    else:
-        print(f"Failed to fetch Service Person data. Status code: {response_sp.status_code}")
-        return None
+@app.before_request
+def start_timer():
+    g.metrics_started = time.perf_counter()
+    g.metrics_token = metrics.begin_request()
+    g.request_id, g.log_token = log.begin_request(
+        request.headers.get('X-Request-ID'), request.url_rule.rule if request.url_rule else 'unmatched'
+    )
 
-    # Fetch Employee data
-    endpoint_emp = 'api/resource/Employee'
-    url_emp = base_url + endpoint_emp
-    params_emp = {
-        'fields': '["name","employee_name"]',
-        'limit_start': 0,
-        'limit_page_length': 100000000000,
-        'filters': '[["designation", "=", "Area Service Manager"],["status","=","Active"]]'
-    }
-    response_emp = requests.get(url_emp, params=params_emp, headers=headers)
-    if response_emp.status_code == 200:
-        emp_df = pd.DataFrame(response_emp.json()['data'])
-    else:
-        print(f"Failed to fetch Employee data. Status code: {response_emp.status_code}")
-        return None
 
-    emp_df.rename(columns={'name': 'employee'}, inplace=True)
+@app.after_request
+def record_timing(response):
+    # Every response says where its time went: `Server-Timing: erp;dur=…, total;dur=…`
+    started = g.get('metrics_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_SECONDS.observe(elapsed, request.method, route, str(response.status_code))
+        response.headers['Server-Timing'] = metrics.server_timing(elapsed)
+        response.headers['X-Request-ID'] = g.request_id
+        access_log.info('request', method=request.method, route=route, status=response.status_code,
+                        ms=round(elapsed * 1000, 1))
+    return response
 
-    # Merge Employee & Service Person Data
-    result_df_1 = pd.merge(emp_df, ser_per_df, on='employee', how='left')
-    result_df_1.rename(columns={'territory': 'parent_territory', 'name': 'zonal_manager'}, inplace=True)
 
-    # Add Manual Data
-    sample_data = pd.DataFrame({
-        "employee": ["EL1700001", "001100001"],
-        "employee_name": ["Shivam Kumar", "Anuraj T. R"],
-        "zonal_manager": ["Shivam Kumar", "Anuraj T. R"],
-        "parent_territory": ["East", "South 3"]
-    })
-    result_df_1 = pd.concat([result_df_1, sample_data], ignore_index=True)
-    result_df_1['zonal_manager'] = result_df_1['zonal_manager'].replace('Anuraj T. R', 'Anuraj T')
-    result_df_1['zonal_manager'] = result_df_1['zonal_manager'].replace('Subrahmanyam Somagani', 'S.Somagani')
-    result_df_1['zonal_manager'] = result_df_1['zonal_manager'].replace('Vivek Singh Chauhan', 'Vivek Chauhan')
-    result_df_1['zonal_manager'] = result_df_1['zonal_manager'].replace('Tousif Rauf Baig Mirza', 'Tausif Mirza')
-
-    # Fetch Customer data
-    endpoint_cust = 'api/resource/Customer'
-    url_cust = base_url + endpoint_cust
-    params_cust = {
-        'fields': '["name","territory"]',
-        'limit_start': 0,
-        'limit_page_length': 100000000000,
-    }
-    response_cust = requests.get(url_cust, params=params_cust, headers=headers)
-    if response_cust.status_code == 200:
-        customer_df = pd.DataFrame(response_cust.json()['data'])
-    else:
-        print(f"Failed to fetch Customer data. Status code: {response_cust.status_code}")
-        return None
+@app.teardown_request
+def stop_timer(exc):
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        metrics.end_request(token)
+    token = g.pop('log_token', None)
+    if token is not None:
+        log.end_request(token)
 
-    # Fetch Territory data
-    endpoint_terr = 'api/resource/Territory'
-    url_terr = base_url + endpoint_terr
-    params_terr = {
-        'fields': '["territory_name","parent_territory"]',
-        'limit_start': 0,
-        'limit_page_length': 100000000000,
-    }
-    response_terr = requests.get(url_terr, params=params_terr, headers=headers)
-    if response_terr.status_code == 200:
-        territory_df = pd.DataFrame(response_terr.json()['data'])
-        territory_df.rename(columns={'territory_name': 'territory'}, inplace=True)
-    else:
-        print(f"Failed to fetch Territory data. Status code: {response_terr.status_code}")
-        return None
 
-    result_df_2 = pd.merge(customer_df, territory_df, on='territory', how='left')
-    result_df = pd.merge(result_df_1, result_df_2, on='parent_territory', how='right')
+# Per-client token buckets on the routes that can reach the ERP, so one client's burst
+# can't turn into a burst against the ERP (RATE_LIMITS in ratelimit.py)
+rate_limiter = RateLimiter(make_backend())
+
+
+def client_address(remote_addr, headers):
+    return rate_limiter.client(remote_addr, headers.get('X-Forwarded-For'))
+
+
+def too_many_requests(retry_after):
+    return {'error': 'Too many requests, please slow down'}, {'Retry-After': str(retry_after)}
+
+
+def erp_busy(error):
+    return {'error': 'The ERP is busy, please try again shortly'}, {'Retry-After': str(error.retry_after)}
+
+
+@app.before_request
+def limit_rate():
+    route = request.url_rule.rule if request.url_rule else None
+    retry_after = rate_limiter.check(route, client_address(request.remote_addr, request.headers))
+    if retry_after is not None:
+        body, headers = too_many_requests(retry_after)
+        return jsonify(body), 429, headers
+
+
+@app.errorhandler(ERPBusy)
+def handle_erp_busy(error):
+    body, headers = erp_busy(error)
+    return jsonify(body), 503, headers
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+assets = StaticAssets()
+pages = PageCache()
 
-    def fill_zonal_managers(df_input):
-        result = df_input.copy()
-        result['zonal_manager'] = result.groupby('parent_territory')['zonal_manager'].transform(
-            lambda x: x.fillna(x.dropna().iloc[0] if not x.dropna().empty else x)
-        )
-        mask = result['zonal_manager'].isna()
-        if mask.any():
-            territory_zm_dict = {}
-            for terr in result.loc[mask, 'parent_territory'].unique():
-                zm_values = result[(result['territory'] == terr) & (result['zonal_manager'].notna())]['zonal_manager']
-                if not zm_values.empty:
-                    territory_zm_dict[terr] = zm_values.iloc[0]
-            result.loc[mask, 'zonal_manager'] = result.loc[mask, 'parent_territory'].map(territory_zm_dict)
-        return result
 
-    result_df = fill_zonal_managers(result_df)
-    result_df = result_df[["name", "zonal_manager"]]
-    result_df.rename(columns={'name': 'customer'}, inplace=True)
-    return result_df.set_index('customer')['zonal_manager'].to_dict()
+def encoded_response(encoded, cache_control):
+    status, headers, body = encoded.respond(
+        request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'), cache_control
+    )
+    return app.response_class(body, status, headers)
 
 
-customer_zonal_manager_map = load_and_preprocess_data()
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    # url_for('static', filename='script.js') -> /static/script.<hash>.js
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = assets.url(values['filename'])
+
+
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    found = assets.lookup(filename)
+    if found is None:
+        abort(404)
+    return encoded_response(*found)
+
+
+def static_page(template, **context):
+    # The pages only vary with flashed messages; with none pending, serve the copy
+    # rendered on first use
+    if session.get('_flashes'):
+        response = make_response(render_template(template, **context))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    return encoded_response(pages.get(template, lambda: render_template(template, **context)), REVALIDATE)
+
+
+@app.route('/elec-image')
+def serve_image():
+    return encoded_response(*assets.lookup('ELEC.png'))
+
+
+# Customer -> zonal manager, kept current in the background; requests keep using the last
+# good version while a sync runs or fails. The map lives in an on-disk snapshot that one
+# process maintains with incremental syncs and every worker memory-maps, so startup is a
+# local file read.
+zonal_sync = ZonalMapSync()
+zonal_snapshot = SnapshotStore(ZONAL_MAP_SNAPSHOT, zonal_sync, ZONAL_MAP_REFRESH_INTERVAL)
+zonal_manager_map = RefreshingValue(
+    'customer_zonal_manager_map', zonal_snapshot.load,
+    ZONAL_MAP_REFRESH_INTERVAL, ZONAL_MAP_RETRY_INTERVAL
+)
+zonal_manager_map.publish(zonal_snapshot.open())
+zonal_manager_map.start()
+
+address_index = AddressIndex()
+address_index.start()
+
+# Typeahead and issue-table searches are answered from this index once it has loaded;
+# until then they fall back to the ERP `like` query.
+serial_index = SerialIndex()
+serial_index.start()
+
+serial_cache = TTLCache(SERIAL_CACHE_SIZE, SERIAL_CACHE_TTL)
 
 
 # -----------------------------
@@ -144,113 +203,113 @@ customer_zonal_manager_map = load_and_preprocess_data()
 @app.route('/get_zonal_manager', methods=['GET'])
 def get_zonal_manager():
     customer_name = request.args.get('customer')
-    if customer_name and customer_zonal_manager_map:
-        zonal_manager = customer_zonal_manager_map.get(customer_name)
-        if zonal_manager:
-            return jsonify({'zonal_manager': zonal_manager})
-        else:
-            return jsonify({'zonal_manager': 'Not Found'})
+    version = zonal_manager_map.current
+    if customer_name and version:
+        zonal_manager = version.data.get(customer_name)
+        return jsonify({
+            'zonal_manager': zonal_manager or 'Not Found',
+            'map_version': version.number,
+            'map_age': round(version.age, 3),
+        })
     else:
         return jsonify({'error': 'Customer not provided or data not loaded'}), 400
 
 
-@app.route('/get_issue_table', methods=['GET'])
-def get_issue_table():
-    base_url = 'https://erpv14.electrolabgroup.com/'
-    endpoint = 'api/resource/Serial No'
-    url = base_url + endpoint
-    search_term = request.args.get('search', '')
+def issue_table_rows(records):
+    # Rows with any empty field are left out, as before
+    rows = (record.as_dict() for record in records)
+    return [row for row in rows if None not in row.values()]
+
+
+def issue_table_params(search_term):
     filters = f'[["name", "like", "%{search_term}%"]]'
-    params = {
+    return {
         'fields': '["name", "item_name", "item_code", "customer_instrument_id", "customer", "custom_amc_type_name"]',
         'limit_start': 0,
         'limit_page_length': 20,
         'filters': filters
     }
-    headers = {'Authorization': 'token 3ee8d03949516d0:6baa361266cf807'}
-    response = requests.get(url, params=params, headers=headers)
+
+
+@app.route('/get_issue_table', methods=['GET'])
+def get_issue_table():
+    search_term = request.args.get('search', '')
+    if serial_index.ready:
+        return jsonify(issue_table_rows(serial_index.search_records(search_term, 20)))
+
+    try:
+        response = erp.request('GET', 'Serial No', params=issue_table_params(search_term))
+    except requests.RequestException as e:
+        logger.warning('erp_request_failed', route='/get_issue_table', error=e)
+        return jsonify({"error": "Failed to fetch data from API"}), 500
     if response.status_code == 200:
         data = response.json()
-        df = pd.DataFrame(data['data'])
-        if df.empty:
-            return jsonify([])
-        if 'name' in df.columns:
-            df.rename(columns={'name': 'serial_no'}, inplace=True)
-        if 'custom_amc_type_name' in df.columns:
-            df.rename(columns={'custom_amc_type_name': 'amc_type'}, inplace=True)
-        expected_columns = ['serial_no', 'item_name', 'item_code', 'customer_instrument_id', 'customer', 'amc_type']
-        missing = [col for col in expected_columns if col not in df.columns]
-        if missing:
-            return jsonify([])
-        result_data = df[expected_columns].dropna().to_dict(orient='records')
-        return jsonify(result_data)
+        return jsonify(issue_table_rows(SerialRecord(row) for row in data['data']))
     else:
         return jsonify({"error": "Failed to fetch data from API"}), 500
 
 
-@app.route('/get_serial_details', methods=['GET'])
-def get_serial_details():
-    serial_no = request.args.get('serial_no', '')
-    if not serial_no:
-        return jsonify({'error': 'Serial number is required'}), 400
+SERIAL_DETAIL_FIELDS = '["name", "warranty_expiry_date", "customer", "item_name", "custom_amc_type_name"]'
 
-    def fetch_data():
-        base_url = 'https://erpv14.electrolabgroup.com/'
-        headers = {'Authorization': 'token 3ee8d03949516d0:6baa361266cf807'}
-
-        serial_response = requests.get(
-            f'{base_url}api/resource/Serial No',
-            params={
-                'fields': '["name", "warranty_expiry_date", "customer", "item_name", "custom_amc_type_name"]',
-                'filters': f'[["name", "=", "{serial_no}"]]',
-                'limit_start': 0,
-                'limit_page_length': 1,
-            },
-            headers=headers
-        )
 
-        if serial_response.status_code != 200:
-            return None
+def serial_detail_query(serial_no):
+    return {
+        'fields': SERIAL_DETAIL_FIELDS,
+        'filters': f'[["name", "=", "{serial_no}"]]',
+        'limit_page_length': 1,
+    }
 
-        data = serial_response.json().get('data', [])
-        if not data:
-            print("No serial number found in ERP!")
-            return None
 
-        ser_per_df = pd.DataFrame(data)
+def serial_detail_row(serial_response, serial_no):
+    if serial_response.status_code != 200:
+        return None
 
-        address_response = requests.get(
-            f'{base_url}api/resource/Address',
-            params={
-                'fields': '["name", "links.link_name"]',
-                'limit_start': 0,
-                'limit_page_length': 100000000000,
-            },
-            headers=headers
-        )
+    data = serial_response.json().get('data', [])
+    if not data:
+        logger.info('serial_not_in_erp', serial_no=serial_no)
+        return None
 
-        if address_response.status_code != 200:
-            return None
+    # The ERP's `=` filter ignores case; only an exact match counts here
+    row = data[0]
+    if row.get('name') != serial_no:
+        return None
+    return row
 
-        address_df = pd.DataFrame(address_response.json()['data'])
-        address_df.rename(columns={'name': 'customer_address', 'link_name': 'customer'}, inplace=True)
-        address_df = address_df.drop_duplicates(subset='customer', keep='first')
 
-        return pd.merge(address_df, ser_per_df, on='customer', how='inner')
+def serial_details(row, customer_address):
+    if customer_address is None:
+        return None
+    return {
+        'customer': row.get('customer'),
+        'customer_address': customer_address,
+        'warranty_expiry_date': row.get('warranty_expiry_date'),
+        'item_name': row.get('item_name', ''),
+        'amc_type': row.get('custom_amc_type_name', ''),
+    }
 
-    df = fetch_data()
 
-    if df is None or df.empty:
-        print("Serial number not found in fetched data.")
-        return jsonify({'error': 'Serial number not found'}), 404
+def fetch_serial_details(serial_no):
+    try:
+        serial_response = erp.get_list('Serial No', **serial_detail_query(serial_no))
+    except requests.RequestException as e:
+        logger.warning('erp_request_failed', route='/get_serial_details', serial_no=serial_no, error=e)
+        return None
 
-    row = df[df['name'] == serial_no]
-    if row.empty:
-        return jsonify({'error': 'Serial number not found'}), 404
+    row = serial_detail_row(serial_response, serial_no)
+    if row is None:
+        return None
+    # Only this serial's customer is needed, so look it up in the address index
+    # instead of downloading the whole Address table.
+    return serial_details(row, address_index.get(row.get('customer')))
 
-    customer_val = row['customer'].iloc[0]
-    zonal_manager = customer_zonal_manager_map.get(customer_val, '')
-    warranty_expiry_date = row['warranty_expiry_date'].iloc[0]
+
+def serial_result(details):
+    # The ERP part of the answer is cached per serial; zonal manager and warranty
+    # status are cheap and always worked out fresh.
+    customer_val = details['customer']
+    version = zonal_manager_map.current
+    zonal_manager = version.data.get(customer_val, '') if version else ''
+    warranty_expiry_date = details['warranty_expiry_date']
 
     try:
         warranty_date = datetime.strptime(warranty_expiry_date, '%Y-%m-%d').date()
@@ -259,285 +318,650 @@ def get_serial_details():
     except Exception as e:
         maintenance_status = "Unknown"
 
-    result = {
-        'customer': customer_val,
-        'customer_address': row['customer_address'].iloc[0] if 'customer_address' in row.columns else '',
-        'warranty_expiry_date': warranty_expiry_date,
-        'item_name': row['item_name'].iloc[0] if 'item_name' in row.columns else '',
-        'maintenance_status': maintenance_status,
-        'zonal_manager': zonal_manager,
-        'amc_type': row['custom_amc_type_name'].iloc[0] if 'custom_amc_type_name' in row.columns else ''
+    return dict(
+        details,
+        maintenance_status=maintenance_status,
+        zonal_manager=zonal_manager,
+        map_version=version.number if version else None,
+        map_age=round(version.age, 3) if version else None,
+    )
+
+
+@app.route('/get_serial_details', methods=['GET'])
+def get_serial_details():
+    serial_no = request.args.get('serial_no', '')
+    if not serial_no:
+        return jsonify({'error': 'Serial number is required'}), 400
+
+    details = serial_cache.get_or_load(serial_no, lambda: fetch_serial_details(serial_no))
+
+    if details is None:
+        logger.info('serial_not_found', serial_no=serial_no)
+        return jsonify({'error': 'Serial number not found'}), 404
+
+    return jsonify(serial_result(details))
+
+
+def batch_serial_nos(values):
+    # Distinct, non-empty serial numbers in the order they were given
+    return list(dict.fromkeys(str(value).strip() for value in values if value and str(value).strip()))
+
+
+def serial_batch_query(serial_nos):
+    return {
+        'fields': SERIAL_DETAIL_FIELDS,
+        'filters': json.dumps([["name", "in", serial_nos]]),
+        'limit_page_length': len(serial_nos),
     }
 
-    return jsonify(result)
+
+def serial_batch_rows(serial_response, serial_nos):
+    if serial_response.status_code != 200:
+        return None
+    # As for a single serial, only exact matches count
+    wanted = set(serial_nos)
+    return {row.get('name'): row for row in serial_response.json().get('data', []) if row.get('name') in wanted}
+
+
+def serial_batch_details(rows, addresses):
+    return {serial_no: serial_details(row, addresses.get(row.get('customer'))) for serial_no, row in rows.items()}
 
 
-# Global SMTP_SSL configuration using your provided settings
-SMTP_SERVER = "email.electrolabgroup.com"
-SMTP_PORT = 587
-SMTP_USERNAME = "econnect"
-SMTP_PASSWORD = "Requ!reMent$"
-SMTP_EMAIL = "econnect@electrolabgroup.com"  # Sender email
+def fetch_serial_details_many(serial_nos):
+    # One Serial No query for the whole batch and one Address query for the customers
+    # the address index doesn't know; None if the ERP couldn't be asked at all.
+    try:
+        serial_response = erp.get_list('Serial No', **serial_batch_query(serial_nos))
+    except requests.RequestException as e:
+        logger.warning('erp_request_failed', route='/get_serial_details_batch', serials=len(serial_nos), error=e)
+        return None
 
+    rows = serial_batch_rows(serial_response, serial_nos)
+    if rows is None:
+        return None
+    addresses = address_index.get_many(row.get('customer') for row in rows.values())
+    return serial_batch_details(rows, addresses)
+
+
+def serial_batch_result(serial_nos, details_by_serial):
+    results = {}
+    errors = {}
+    for serial_no in serial_nos:
+        details = details_by_serial.get(serial_no)
+        if details is not None:
+            results[serial_no] = serial_result(details)
+        elif serial_no in details_by_serial:
+            errors[serial_no] = 'Serial number not found'
+        else:
+            errors[serial_no] = 'Failed to fetch data from API'
+    return {'results': results, 'errors': errors}
+
+
+def cached_serial_details(serial_nos):
+    # ({serial: details} for the cached ones, [the rest])
+    found = {}
+    misses = []
+    for serial_no in serial_nos:
+        details = serial_cache.get(serial_no)
+        if details is None:
+            misses.append(serial_no)
+        else:
+            found[serial_no] = details
+    return found, misses
+
+
+def store_serial_details(details_by_serial, misses, fetched, epoch):
+    # A failed fetch leaves the misses out, which reports them as lookup failures
+    if fetched is None:
+        return
+    for serial_no in misses:
+        details = details_by_serial[serial_no] = fetched.get(serial_no)
+        serial_cache.put(serial_no, details, epoch)
+
+
+def serial_batch_error(serial_nos):
+    if not serial_nos:
+        return {'error': 'Serial numbers are required'}
+    if len(serial_nos) > SERIAL_BATCH_MAX:
+        return {'error': f'At most {SERIAL_BATCH_MAX} serial numbers per request'}
+    return None
+
+
+@app.route('/get_serial_details_batch', methods=['GET', 'POST'])
+def get_serial_details_batch():
+    # GET ?serial_no=A&serial_no=B, or POST {"serial_no": ["A", "B"]}.
+    # Answers 200 with the serials that resolved under `results` and the rest under `errors`.
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        values = body.get('serial_no') if isinstance(body, dict) else None
+        values = values if isinstance(values, list) else []
+    else:
+        values = request.args.getlist('serial_no')
+    serial_nos = batch_serial_nos(values)
+    error = serial_batch_error(serial_nos)
+    if error:
+        return jsonify(error), 400
+
+    details_by_serial, misses = cached_serial_details(serial_nos)
+    if misses:
+        epoch = serial_cache.epoch()
+        store_serial_details(details_by_serial, misses, fetch_serial_details_many(misses), epoch)
+    return jsonify(serial_batch_result(serial_nos, details_by_serial))
+
+
+def invalidate_serials(form_data):
+    # A new ticket can change what the ERP reports for its serials
+    serials = {form_data.get('serial_no')}
+    serials.update(row.get('serial_no') for row in form_data.get('issue_details', []))
+    for serial in serials:
+        if serial:
+            serial_cache.invalidate(serial)
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'serial_cache': serial_cache.stats(),
+        'serial_index': {'ready': serial_index.ready, 'size': len(serial_index)},
+        'zonal_manager_map': zonal_manager_map.status(),
+        'zonal_map_build': zonal_map.last_timings,
+        'zonal_map_sync': zonal_sync.last_sync,
+        'address_sync': address_index.sync.last_sync,
+        'erp': erp.stats(),
+        'erp_admission': erp.admission(),
+        'rate_limit': rate_limiter.stats(),
+        'static': dict(assets.stats(), pages=len(pages)),
+        'log': log.stats(),
+        'mail': mail_queue.stats(),
+        'otp': otp_store.stats(),
+        'otp_mail': otp_mail.stats(),
+        'outbox': outbox.stats(),
+    })
+
+
+# Confirmation emails are handed to background senders that reuse one SMTP connection,
+# so the response doesn't wait on the mail server.
+mail_queue = MailQueue()
+mail_queue.start()
+atexit.register(mail_queue.stop)
+
+CONFIRMATION_SUBJECTS = {
+    'Issue': "Electrolab Issue Form Notification",
+    'Warranty Claim': "Electrolab Warranty Form Notification",
+}
+
+
+def ticket_created(entry, ticket_name):
+    invalidate_serials(entry.payload)
+    if not entry.email:
+        return
+    message = f"""
+    <html>
+      <body>
+        <p>Dear Sir/Madam,</p>
+        <br>
+        <p>Your service request has been submitted.</p>
+        <p>The following ticket number was issued: <b>{ticket_name}</b></p>
+        <p>Reference No: {entry.reference}</p>
+        <br>
+        <br>
+        <p><strong>** NOTE: This is a system-generated response **</strong></p>
+      </body>
+    </html>
+    """
+    mail_queue.send([entry.email], CONFIRMATION_SUBJECTS[entry.doctype], message)
+
+
+def ticket_rejected(entry, reason):
+    # The ERP refused the ticket as invalid; the contact was told it was submitted
+    if not entry.email:
+        return
+    message = f"""
+    <html>
+      <body>
+        <p>Dear Sir/Madam,</p>
+        <br>
+        <p>We could not create a ticket for your service request (Reference No: {entry.reference}).</p>
+        <p>Please contact us on service@electrolabgroup.com or +91 9167839674, quoting the reference number.</p>
+        <br>
+        <br>
+        <p><strong>** NOTE: This is a system-generated response **</strong></p>
+      </body>
+    </html>
+    """
+    mail_queue.send([entry.email], CONFIRMATION_SUBJECTS[entry.doctype], message)
+
+
+# One-time codes for the email check on the forms (otp.py). They have their own sender,
+# so a code isn't stuck behind a backlog of confirmations, and few retries, since a
+# late code is useless. A correct code marks the address verified in the session of the
+# client that entered it, for OTP_VERIFIED_TTL seconds; the forms and bulk import
+# accept only addresses verified in their own session.
+otp_store = OTPStore()
+# Verified addresses kept per session; the cookie holds them all
+OTP_SESSION_MAX = 20
+otp_mail = MailQueue(max_attempts=2)
+otp_mail.start()
+atexit.register(otp_mail.stop)
+
+OTP_SUBJECT = "Electrolab Email Verification Code"
+OTP_ERRORS = {
+    INVALID: 'Incorrect OTP, please try again',
+    EXPIRED: 'OTP expired, please request a new one',
+    LOCKED: 'Too many attempts, please try again later',
+}
+
+
+def otp_verified(email):
+    expires = session.get('otp_verified', {}).get(email.strip().lower())
+    return expires is not None and expires > time.time()
+
+
+def mark_otp_verified(email):
+    now = time.time()
+    verified = {address: expires for address, expires in session.get('otp_verified', {}).items() if expires > now}
+    verified[email.strip().lower()] = now + OTP_VERIFIED_TTL
+    session['otp_verified'] = dict(sorted(verified.items(), key=lambda item: item[1])[-OTP_SESSION_MAX:])
+
+
+def otp_message(code):
+    return f"""
+    <html>
+      <body>
+        <p>Dear Sir/Madam,</p>
+        <br>
+        <p>Your verification code is: <b>{code}</b></p>
+        <p>It is valid for {otp_store.ttl / 60:.0f} minutes. If you did not request it, please ignore this email.</p>
+        <br>
+        <br>
+        <p><strong>** NOTE: This is a system-generated response **</strong></p>
+      </body>
+    </html>
+    """
+
+
+@app.route('/send_otp', methods=['POST'])
+def send_otp():
+    email = request.form.get('custom_contact_email', '').strip()
+    if not email or not is_valid_email(email):
+        return jsonify({'error': 'Invalid email address'}), 400
+    try:
+        code = otp_store.issue(email)
+    except OTPUnavailable as e:
+        return jsonify({'error': f'{e}, please try again shortly'}), 429, {'Retry-After': str(e.retry_after)}
+    otp_mail.send([email], OTP_SUBJECT, otp_message(code))
+    return jsonify({'message': 'OTP sent'})
+
+
+@app.route('/verify_otp', methods=['POST'])
+def verify_otp():
+    email = request.form.get('custom_contact_email', '').strip()
+    code = request.form.get('otp', '').strip()
+    if not email or not code:
+        return jsonify({'error': 'Email and OTP are required'}), 400
+    result = otp_store.verify(email, code)
+    if result != VERIFIED:
+        return jsonify({'error': OTP_ERRORS[result]}), 400
+    mark_otp_verified(email)
+    return jsonify({'message': 'OTP verified'})
+
+
+# Submissions are journalled locally and delivered to the ERP by background workers,
+# so a slow or unavailable ERP never blocks the form or loses a ticket.
+outbox = Outbox(on_delivered=ticket_created, on_rejected=ticket_rejected)
+outbox.start()
+
+
+@app.route('/submission_status', methods=['GET'])
+def submission_status():
+    # ?reference= for one submission, or ?batch= for every row of a bulk import
+    batch = request.args.get('batch', '')
+    if batch:
+        entries = outbox.batch_status(batch)
+        if entries is None:
+            return jsonify({'error': 'Batch not found'}), 404
+        return jsonify({'batch': batch, 'entries': entries})
+    reference = request.args.get('reference', '')
+    status = outbox.status(reference) if reference else None
+    if status is None:
+        return jsonify({'error': 'Reference not found'}), 404
+    return jsonify(status)
+
+
+def issue_form_data(form, email):
+    # The Issue document for a submitted form; form is request.form, or a row of a bulk import
+    form_data = {
+        "naming_series": form.get('naming_series'),
+        "status": form.get('status'),
+        "subject": form.get('description', '')[:20],
+        "priority": form.get('priority'),
+        "issue_type": ", ".join(form.getlist('issue_type')) if form.getlist('issue_type') else "NA",
+        "serial_no": form.get('serial_no'),
+        "customer": form.get('customer'),
+        "custom_contact_email": email,
+        "issue_generate_date": form.get('issue_generate_date'),
+        "zonal_manager": form.get('zonal_manager'),
+        "territory": form.get('territory'),
+        "job_type": form.get('job_type') or "ONLINE SUPPORT",
+        "issue_responsibility_with": form.get('issue_responsibility_with'),
+        "prio_po_number": form.get('prio_po_number') or "NA",
+        "amc_type": form.get('amc_type') or "Out Of Warranty",
+        "description": (
+            f"{form.get('description', '').strip()}"
+            f"<br><br><b>{form.get('contact_person_name', '').strip()} "
+            f"{form.get('phone_extension', '').strip()}"
+            f"{form.get('phone_number', '').strip()}</b>"
+        )
+    }
+
+    if not form_data['issue_generate_date']:
+        form_data['issue_generate_date'] = datetime.today().strftime('%Y-%m-%d')
+    received_dates = form.getlist('issue_received_date[]')
+    form_data['issue_received_date'] = received_dates[0] if received_dates else form_data['issue_generate_date']
+    issue_data = []
+    item_serial_name = form.getlist('serial_no[]')
+    item_names = form.getlist('item_name[]')
+    item_codes = form.getlist('item_code[]')
+    customer_ids = form.getlist('customer_instrument_id[]')
+    for i in range(len(item_names)):
+        if item_names[i].strip():
+            issue_data.append({
+                "serial_no": item_serial_name[i],
+                "item_name": item_names[i],
+                "item_code": item_codes[i],
+                "customer_instrument_id": customer_ids[i]
+            })
+    if issue_data:
+        form_data["issue_details"] = issue_data
+    return form_data
+
+
+def warranty_form_data(form, email):
+    # The Warranty Claim document for a submitted form, as issue_form_data
+    form_data = {
+        "naming_series": form.get('naming_series'),
+        "status": form.get('status'),
+        "custom_contact_email": email,
+        "priority": form.get('priority'),
+        "customer": form.get('customer'),
+        "serial_no": form.get('serial_no'),
+        "issue_type": form.get('issue_type'),
+        "complaint_date": form.get('complaint_date'),
+        "zonal_manager": form.get('zonal_manager'),
+        "territory": form.get('territory'),
+        "job_type": form.get('job_type'),
+        "warranty_claim_responsibility_with": form.get('warranty_claim_responsibility_with'),
+        "prio_po_number": form.get('prio_po_number'),
+        "amc_type": form.get('amc_type'),
+        "warranty_amc_status": form.get('warranty_amc_status'),
+        "complaint": form.get('complaint'),
+        "warranty_expiry_date": form.get('warranty_expiry_date'),
+        "customer_name": form.get('customer_name'),
+        "customer_address": form.get('customer_address'),
+        "complaint_raised_by": (
+                form.get('contact_person_name', '') + " " + form.get('phone_number', '')
+        )
+    }
+    if not form_data['complaint_date']:
+        form_data['complaint_date'] = datetime.today().strftime('%Y-%m-%d')
+    received_dates = form.getlist('claim_received_date[]')
+    form_data['claim_received_date'] = received_dates[0] if received_dates else form_data['complaint_date']
+    return form_data
 
 
 @app.route('/submit', methods=['POST'])
 def submit_form():
-    base_url = 'https://erpv14.electrolabgroup.com/'
-    endpoint = 'api/resource/Issue'
-    url = base_url + endpoint
-    headers = {
-        'Authorization': 'token 3ee8d03949516d0:6baa361266cf807',
-        'Content-Type': 'application/json',
-        'Expect': ''  # Disable the default Expect header
-    }
     try:
         # Check email validity before processing form data
         email = request.form.get('custom_contact_email', '').strip()
         if not email or not is_valid_email(email):
             flash("Invalid email address. Please enter a valid email.", "error")
             return redirect(url_for('issue'))
+        if OTP_REQUIRED and not otp_verified(email):
+            flash("Please verify your email address with the OTP before submitting.", "error")
+            return redirect(url_for('issue'))
 
-        form_data = {
-            "naming_series": request.form.get('naming_series'),
-            "status": request.form.get('status'),
-            "subject": request.form.get('description', '')[:20],
-            "priority": request.form.get('priority'),
-            "issue_type": ", ".join(request.form.getlist('issue_type')) if request.form.getlist('issue_type') else "NA",
-            "serial_no": request.form.get('serial_no'),
-            "customer": request.form.get('customer'),
-            "custom_contact_email": email,
-            "issue_generate_date": request.form.get('issue_generate_date'),
-            "zonal_manager": request.form.get('zonal_manager'),
-            "territory": request.form.get('territory'),
-            "job_type": request.form.get('job_type') or "ONLINE SUPPORT",
-            "issue_responsibility_with": request.form.get('issue_responsibility_with'),
-            "prio_po_number": request.form.get('prio_po_number') or "NA",
-            "amc_type": request.form.get('amc_type') or "Out Of Warranty",
-            "description": (
-                f"{request.form.get('description', '').strip()}"
-                f"<br><br><b>{request.form.get('contact_person_name', '').strip()} "
-                f"{request.form.get('phone_extension', '').strip()}"
-                f"{request.form.get('phone_number', '').strip()}</b>"
-            )
-        }
-
-        if not form_data['issue_generate_date']:
-            form_data['issue_generate_date'] = datetime.today().strftime('%Y-%m-%d')
-        received_dates = request.form.getlist('issue_received_date[]')
-        form_data['issue_received_date'] = received_dates[0] if received_dates else form_data['issue_generate_date']
-        issue_data = []
-        item_serial_name = request.form.getlist('serial_no[]')
-        item_names = request.form.getlist('item_name[]')
-        item_codes = request.form.getlist('item_code[]')
-        customer_ids = request.form.getlist('customer_instrument_id[]')
-        for i in range(len(item_names)):
-            if item_names[i].strip():
-                issue_data.append({
-                    "serial_no": item_serial_name[i],
-                    "item_name": item_names[i],
-                    "item_code": item_codes[i],
-                    "customer_instrument_id": customer_ids[i]
-                })
-        if issue_data:
-            form_data["issue_details"] = issue_data
-
-        print("Issue Form Data:", form_data)
-        response = requests.post(url, json=form_data, headers=headers)
-        print("ERP Response:", response.text)
-
-        if response.ok:
-            try:
-                issue_response = response.json()
-                issue_name = issue_response.get("data", {}).get("name", "Unknown")
-
-                RECIPIENT_EMAILS = [email]
-                message = f"""
-                <html>
-                  <body>
-                    <p>Dear Sir/Madam,</p>
-                    <br>
-                    <p>Your service request has been submitted.</p>
-                    <p>The following ticket number was issued: <b>{issue_name}</b></p>
-                    <br>
-                    <br>
-                    <p><strong>** NOTE: This is a system-generated response **</strong></p>
-                  </body>
-                </html>
-                """
-
-                msg = MIMEMultipart()
-                msg['From'] = SMTP_EMAIL
-                msg['To'] = ", ".join(RECIPIENT_EMAILS)
-                msg['Subject'] = "Electrolab Issue Form Notification"
-                msg.attach(MIMEText(message, 'html'))
-
-                try:
-                    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                        server.ehlo()  # Identify to mail server
-                        server.starttls()  # Secure the connection
-                        server.ehlo()
-                        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                        server.sendmail(SMTP_EMAIL, RECIPIENT_EMAILS, msg.as_string())
-                        print("Email sent successfully.")
-                except Exception as e:
-                    print("An error occurred while sending email:", e)
-            except Exception as e:
-                issue_name = "Unknown"
-            flash(
-                f'Request submitted successfully! Ticket No: {issue_name}, for any query contact us on: service@electrolabgroup.com or +91 9167839674',
-                'success')
-        else:
-            flash(f'Error {response.status_code}, please check the form and submit again.', 'error')
+        form_data = issue_form_data(request.form, email)
+
+        with OUTBOX_SECONDS.time('Issue', span='outbox'):
+            reference = outbox.enqueue('Issue', form_data, customer=form_data['customer'], email=email)
+        logger.info('form_submitted', doctype='Issue', reference=reference)
+        flash(
+            f'Request submitted successfully! Reference No: {reference}, your ticket number will be emailed to you shortly. For any query contact us on: service@electrolabgroup.com or +91 9167839674',
+            'success')
     except Exception as e:
-        print("Exception details:", str(e))
+        logger.exception('form_submit_failed', route=request.path)
         flash(f'Error occurred: {str(e)}', 'error')
     return redirect(url_for('issue'))
 
 
 @app.route('/submit2', methods=['POST'])
 def submit_form_warranty():
-    base_url = 'https://erpv14.electrolabgroup.com/'
-    endpoint = 'api/resource/Warranty Claim'
-    url = base_url + endpoint
-    headers = {
-        'Authorization': 'token 3ee8d03949516d0:6baa361266cf807',
-        'Content-Type': 'application/json'
-    }
     try:
         # Check email validity before processing warranty form data
         email = request.form.get('custom_contact_email', '').strip()
         if not email or not is_valid_email(email):
             flash("Invalid email address. Please enter a valid email.", "error")
             return redirect(url_for('warranty'))
+        if OTP_REQUIRED and not otp_verified(email):
+            flash("Please verify your email address with the OTP before submitting.", "error")
+            return redirect(url_for('warranty'))
 
-        form_data = {
-            "naming_series": request.form.get('naming_series'),
-            "status": request.form.get('status'),
-            "custom_contact_email": email,
-            "priority": request.form.get('priority'),
-            "customer": request.form.get('customer'),
-            "serial_no": request.form.get('serial_no'),
-            "issue_type": request.form.get('issue_type'),
-            "complaint_date": request.form.get('complaint_date'),
-            "zonal_manager": request.form.get('zonal_manager'),
-            "territory": request.form.get('territory'),
-            "job_type": request.form.get('job_type'),
-            "warranty_claim_responsibility_with": request.form.get('warranty_claim_responsibility_with'),
-            "prio_po_number": request.form.get('prio_po_number'),
-            "amc_type": request.form.get('amc_type'),
-            "warranty_amc_status": request.form.get('warranty_amc_status'),
-            "complaint": request.form.get('complaint'),
-            "warranty_expiry_date": request.form.get('warranty_expiry_date'),
-            "customer_name": request.form.get('customer_name'),
-            "customer_address": request.form.get('customer_address'),
-            "complaint_raised_by": (
-                    request.form.get('contact_person_name', '') + " " + request.form.get('phone_number', '')
-            )
-        }
-        if not form_data['complaint_date']:
-            form_data['complaint_date'] = datetime.today().strftime('%Y-%m-%d')
-        received_dates = request.form.getlist('claim_received_date[]')
-        form_data['claim_received_date'] = received_dates[0] if received_dates else form_data['complaint_date']
-
-        print("Warranty Form Data:", form_data)
-        response = requests.post(url, json=form_data, headers=headers)
-        if response.ok:
-            try:
-                warranty_response = response.json()
-                warranty_name = warranty_response.get("data", {}).get("name", "Unknown")
-
-                RECIPIENT_EMAILS = [email]
-                message = f"""
-                                <html>
-                                  <body>
-                                    <p>Dear Sir/Madam,</p>
-                                    <br>
-                                    <p>Your service request has been submitted.</p>
-                                    <p>The following ticket number was issued: <b>{warranty_name}</b></p>
-                                    <br>
-                                    <br>
-                                    <p><strong>** NOTE: This is a system-generated response **</strong></p>
-                                  </body>
-                                </html>
-                                """
-                #message = f'Your File is submitted with ID : {warranty_name}'
-
-                msg = MIMEMultipart()
-                msg['From'] = SMTP_EMAIL
-                msg['To'] = ", ".join(RECIPIENT_EMAILS)
-                msg['Subject'] = "Electrolab Warranty Form Notification"
-                msg.attach(MIMEText(message, 'html'))
-
-                try:
-                    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                        server.ehlo()  # Identify to mail server
-                        server.starttls()  # Secure the connection
-                        server.ehlo()
-                        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                        server.sendmail(SMTP_EMAIL, RECIPIENT_EMAILS, msg.as_string())
-                        print("Email sent successfully.")
-                except Exception as e:
-                    print("An error occurred:", e)
-            except Exception as e:
-                warranty_name = "Unknown"
-            flash(
-                f'Request submitted successfully! Ticket No: {warranty_name}, for any query contact us on: service@electrolabgroup.com or +91 9167839674',
-                'success')
-        else:
-            flash(f'Error {response.status_code}, please check the form and submit again.', 'error')
+        form_data = warranty_form_data(request.form, email)
+
+        with OUTBOX_SECONDS.time('Warranty Claim', span='outbox'):
+            reference = outbox.enqueue('Warranty Claim', form_data, customer=form_data['customer'], email=email)
+        logger.info('form_submitted', doctype='Warranty Claim', reference=reference)
+        flash(
+            f'Request submitted successfully! Reference No: {reference}, your ticket number will be emailed to you shortly. For any query contact us on: service@electrolabgroup.com or +91 9167839674',
+            'success')
     except Exception as e:
-        print("Exception details:", str(e))
+        logger.exception('form_submit_failed', route=request.path)
         flash(f'Error occurred: {str(e)}', 'error')
     return redirect(url_for('warranty'))
 
 
+# -----------------------------
+# Bulk import (bulk_import.py)
+# -----------------------------
+BULK_DOCTYPES = {
+    'issue': ('Issue', issue_form_data, ['description']),
+    'warranty': ('Warranty Claim', warranty_form_data, ['complaint']),
+}
+# Every row also needs these, as the form does
+BULK_REQUIRED = ['serial_no', 'contact_person_name', 'phone_number']
+
+
+def resolve_serials(serial_nos):
+    # {serial: details, or None if the ERP doesn't know it}, through the serial cache,
+    # SERIAL_BATCH_MAX at a time; serials the ERP couldn't be asked about are left out
+    details_by_serial, misses = cached_serial_details(serial_nos)
+    for start in range(0, len(misses), SERIAL_BATCH_MAX):
+        batch = misses[start:start + SERIAL_BATCH_MAX]
+        epoch = serial_cache.epoch()
+        store_serial_details(details_by_serial, batch, fetch_serial_details_many(batch), epoch)
+    return details_by_serial
+
+
+def fill_from_serial(row, result):
+    # What the form pages fill in from /get_serial_details; the ERP's values win
+    row.update(
+        customer=result['customer'],
+        customer_name=result['customer'],
+        customer_address=result['customer_address'],
+        item_name=result['item_name'],
+        zonal_manager=result['zonal_manager'],
+        amc_type=result['amc_type'] or 'Out Of Warranty',
+    )
+    row.setdefault('warranty_expiry_date', result['warranty_expiry_date'] or '')
+    row.setdefault('warranty_amc_status', result['maintenance_status'])
+
+
+def bulk_row_errors(row, email, uploader, required):
+    errors = [f'{field} is required' for field in BULK_REQUIRED + required if not row.get(field)]
+    if not email or not is_valid_email(email):
+        errors.append('Invalid email address')
+    elif OTP_REQUIRED and email.lower() != uploader.lower() and not otp_verified(email):
+        errors.append('Contact email has not been verified')
+    return errors
+
+
+def bulk_confirmation(results):
+    rows = ''.join(
+        f"<tr><td>{result['reference']}</td><td>{html.escape(result['serial_no'])}</td></tr>"
+        for result in results
+    )
+    return f"""
+    <html>
+      <body>
+        <p>Dear Sir/Madam,</p>
+        <br>
+        <p>Your service requests have been submitted.</p>
+        <table border="1" cellpadding="4" cellspacing="0">
+          <tr><th>Reference No</th><th>Serial No</th></tr>
+          {rows}
+        </table>
+        <p>Each ticket number will be emailed to you as it is issued. For any query contact us on
+        service@electrolabgroup.com or +91 9167839674, quoting the reference number.</p>
+        <br>
+        <br>
+        <p><strong>** NOTE: This is a system-generated response **</strong></p>
+      </body>
+    </html>
+    """
+
+
+@app.route('/bulk_import', methods=['POST'])
+def import_tickets():
+    # multipart/form-data: `file`, a .csv or .xlsx with one ticket per row and the form's
+    # field names as headings; `type`, issue (the default) or warranty; and the uploader's
+    # `custom_contact_email`, used for rows without one. Answers 200 once the rows are
+    # journalled, with the batch id and a result per row:
+    #   queued   journalled, with its reference; the outbox sends it to the ERP
+    #   invalid  not sent; see errors
+    #   failed   its serial couldn't be looked up
+    # /submission_status?batch= follows the queued rows, as ?reference= does one. Each
+    # contact gets one email listing their references, then one per ticket as the ERP
+    # issues it, as for the forms.
+    started = time.perf_counter()
+    request.max_content_length = BULK_IMPORT_MAX_BYTES
+    kind = BULK_DOCTYPES.get(request.form.get('type', 'issue'))
+    if kind is None:
+        return jsonify({'error': 'type must be issue or warranty'}), 400
+    doctype, build, required = kind
+    uploader = request.form.get('custom_contact_email', '').strip()
+    if OTP_REQUIRED and not (uploader and otp_verified(uploader)):
+        return jsonify({'error': 'Please verify your email address with the OTP before importing'}), 403
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': 'A .csv or .xlsx file is required'}), 400
+
+    results = []
+    pending = []  # (result, row) for the rows that passed validation
+    try:
+        for number, row in bulk_import.read_rows(upload.filename, upload.stream):
+            email = row.get('custom_contact_email') or uploader
+            result = {'row': number, 'serial_no': row.get('serial_no', ''), 'email': email, 'reference': None}
+            errors = bulk_row_errors(row, email, uploader, required)
+            if errors:
+                result.update(status=bulk_import.INVALID, errors=errors)
+            else:
+                pending.append((result, row))
+            results.append(result)
+    except BadUpload as e:
+        return jsonify({'error': str(e)}), 400
+    if not results:
+        return jsonify({'error': 'The file has no rows'}), 400
+
+    details_by_serial = resolve_serials(batch_serial_nos(row['serial_no'] for _, row in pending))
+    items = []
+    accepted = []
+    for result, row in pending:
+        serial_no = row['serial_no']
+        if serial_no not in details_by_serial:
+            result.update(status=bulk_import.FAILED, errors=['Failed to fetch data from API'])
+            continue
+        details = details_by_serial[serial_no]
+        if details is None or not details['customer']:
+            result.update(status=bulk_import.INVALID, errors=['Serial number not found'])
+            continue
+        fill_from_serial(row, serial_result(details))
+        form_data = build(MultiDict(row), result['email'])
+        items.append((doctype, form_data, form_data['customer'], result['email']))
+        accepted.append(result)
+
+    batch, references = None, []
+    if items:
+        with OUTBOX_SECONDS.time(doctype, span='outbox'):
+            batch, references = outbox.enqueue_batch(items)
+
+    by_contact = {}
+    for result, reference in zip(accepted, references):
+        result.update(reference=reference, status=bulk_import.QUEUED)
+        by_contact.setdefault(result['email'].lower(), []).append(result)
+    for contact_results in by_contact.values():
+        mail_queue.send([contact_results[0]['email']], CONFIRMATION_SUBJECTS[doctype], bulk_confirmation(contact_results))
+
+    summary = {'rows': len(results)}
+    for outcome in (bulk_import.QUEUED, bulk_import.INVALID, bulk_import.FAILED):
+        summary[outcome] = sum(1 for result in results if result['status'] == outcome)
+        if summary[outcome]:
+            bulk_import.BULK_ROWS.inc(outcome, amount=summary[outcome])
+    logger.info('bulk_import', doctype=doctype, batch=batch, seconds=round(time.perf_counter() - started, 3),
+                **summary)
+    return jsonify(dict(summary, doctype=doctype, batch=batch, results=results))
+
+
 @app.route('/')
 def home():
-    return render_template('index.html')
+    return static_page('index.html')
 
 
 @app.route('/issue')
 def issue():
-    return render_template('issue.html')
+    return static_page('issue.html', otp_required=OTP_REQUIRED)
 
 
 @app.route('/warranty')
 def warranty():
-    return render_template('warranty.html')
+    return static_page('warranty.html', otp_required=OTP_REQUIRED)
 
 
 @app.route('/terms')
 def tnc():
-    return render_template('tnc.html')
+    return static_page('tnc.html')
 
 
-@app.route('/search_serials', methods=['GET'])
-def search_serials():
-    search_term = request.args.get('query', '')
-    if not search_term:
-        return jsonify([])
-
-    base_url = 'https://erpv14.electrolabgroup.com/'
-    endpoint = 'api/resource/Serial No'
-    url = f"{base_url}{endpoint}"
-    headers = {'Authorization': 'token 3ee8d03949516d0:6baa361266cf807'}
-
+def search_serials_params(search_term):
     filters = f'[["customer","is","set"],["name", "like", "%{search_term}%"]]'
-    params = {
+    return {
         'fields': '["name"]',
         'limit_start': 0,
         'limit_page_length': 10,
         'filters': filters
     }
-    response = requests.get(url, params=params, headers=headers)
+
+
+@app.route('/search_serials', methods=['GET'])
+def search_serials():
+    search_term = request.args.get('query', '')
+    if not search_term:
+        return jsonify([])
+    if serial_index.ready:
+        return jsonify(serial_index.search(search_term, 10))
+
+    try:
+        response = erp.request('GET', 'Serial No', params=search_serials_params(search_term))
+    except requests.RequestException as e:
+        logger.warning('erp_request_failed', route='/search_serials', error=e)
+        return jsonify([])
 
     if response.status_code == 200:
         data = response.json().get('data', [])
         serials = [item['name'] for item in data]
         return jsonify(serials)
     else:
-        print(f"Error fetching data from ERP. Status: {response.status_code}, Response: {response.text}")
+        logger.warning('erp_error_response', route='/search_serials', status=response.status_code, body=response.text)
         return jsonify([])
 
 
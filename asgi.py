@@ -0,0 +1,263 @@
+import asyncio
+import functools
+import json
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from anyio import to_thread
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+
+import app as service
+import log
+import metrics
+from erp_client import AsyncERPClient, ERPBusy, ERPError
+from serial_index import SerialRecord
+
+
+# ASGI entry point: `uvicorn asgi:app --host 0.0.0.0 --port 5001`.
+# The lookup routes, which mostly wait on the ERP, run as coroutines on one event loop
+# with a shared async connection pool, so a slow ERP holds open sockets rather than a
+# worker thread per request. Static files are answered here from the same in-memory
+# copies as Flask's. Every other route is the Flask app, served through a thread pool.
+# Both share the process's indexes, zonal map, cache, outbox and mail queue.
+
+async_erp = AsyncERPClient()
+_loading = {}
+
+
+class SortedJSONResponse(JSONResponse):
+    # Same body as Flask's jsonify
+    def render(self, content):
+        return json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def timed(route):
+    # The ASGI counterpart of the Flask before/after_request timing hooks
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            started = time.perf_counter()
+            token = metrics.begin_request()
+            request_id, log_token = log.begin_request(request.headers.get('x-request-id'), route)
+            try:
+                response = await endpoint(request)
+                elapsed = time.perf_counter() - started
+                metrics.HTTP_SECONDS.observe(elapsed, request.method, route, str(response.status_code))
+                response.headers['Server-Timing'] = metrics.server_timing(elapsed)
+                response.headers['X-Request-ID'] = request_id
+                service.access_log.info('request', method=request.method, route=route, status=response.status_code,
+                                        ms=round(elapsed * 1000, 1))
+                return response
+            finally:
+                log.end_request(log_token)
+                metrics.end_request(token)
+        return wrapper
+    return decorate
+
+
+def limited(route):
+    # The ASGI counterpart of the Flask limit_rate hook
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            client = service.client_address(request.client.host if request.client else None, request.headers)
+            retry_after = service.rate_limiter.check(route, client)
+            if retry_after is not None:
+                body, headers = service.too_many_requests(retry_after)
+                return SortedJSONResponse(body, status_code=429, headers=headers)
+            return await endpoint(request)
+        return wrapper
+    return decorate
+
+
+async def handle_erp_busy(request, error):
+    body, headers = service.erp_busy(error)
+    return SortedJSONResponse(body, status_code=503, headers=headers)
+
+
+async def fetch_serial_details(serial_no):
+    try:
+        serial_response = await async_erp.get_list('Serial No', **service.serial_detail_query(serial_no))
+    except ERPError as e:
+        service.logger.warning('erp_request_failed', route='/get_serial_details', serial_no=serial_no, error=e)
+        return None
+
+    row = service.serial_detail_row(serial_response, serial_no)
+    if row is None:
+        return None
+    customer = row.get('customer')
+    known, customer_address = service.address_index.peek(customer)
+    if not known:
+        # Rare once the address index has loaded; the targeted lookup is blocking
+        customer_address = await to_thread.run_sync(service.address_index.get, customer)
+    return service.serial_details(row, customer_address)
+
+
+async def load_serial_details(serial_no):
+    details = service.serial_cache.get(serial_no)
+    if details is not None:
+        return details
+
+    # Concurrent misses for one serial share a single ERP round trip
+    task = _loading.get(serial_no)
+    if task is None:
+        epoch = service.serial_cache.epoch()
+        task = _loading[serial_no] = asyncio.ensure_future(fetch_serial_details(serial_no))
+        try:
+            details = await asyncio.shield(task)
+        finally:
+            _loading.pop(serial_no, None)
+        service.serial_cache.put(serial_no, details, epoch)
+        return details
+    return await asyncio.shield(task)
+
+
+@timed('/get_serial_details')
+@limited('/get_serial_details')
+async def get_serial_details(request):
+    serial_no = request.query_params.get('serial_no', '')
+    if not serial_no:
+        return SortedJSONResponse({'error': 'Serial number is required'}, status_code=400)
+
+    details = await load_serial_details(serial_no)
+    if details is None:
+        service.logger.info('serial_not_found', serial_no=serial_no)
+        return SortedJSONResponse({'error': 'Serial number not found'}, status_code=404)
+    return SortedJSONResponse(service.serial_result(details))
+
+
+async def fetch_serial_details_many(serial_nos):
+    try:
+        serial_response = await async_erp.get_list('Serial No', **service.serial_batch_query(serial_nos))
+    except ERPError as e:
+        service.logger.warning('erp_request_failed', route='/get_serial_details_batch', serials=len(serial_nos),
+                               error=e)
+        return None
+
+    rows = service.serial_batch_rows(serial_response, serial_nos)
+    if rows is None:
+        return None
+    addresses = {}
+    unknown = []
+    for row in rows.values():
+        customer = row.get('customer')
+        known, addresses[customer] = service.address_index.peek(customer)
+        if not known:
+            unknown.append(customer)
+    if unknown:
+        addresses.update(await to_thread.run_sync(service.address_index.get_many, unknown))
+    return service.serial_batch_details(rows, addresses)
+
+
+@timed('/get_serial_details_batch')
+@limited('/get_serial_details_batch')
+async def get_serial_details_batch(request):
+    if request.method == 'POST':
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        values = body.get('serial_no') if isinstance(body, dict) else None
+        values = values if isinstance(values, list) else []
+    else:
+        values = request.query_params.getlist('serial_no')
+    serial_nos = service.batch_serial_nos(values)
+    error = service.serial_batch_error(serial_nos)
+    if error:
+        return SortedJSONResponse(error, status_code=400)
+
+    details_by_serial, misses = service.cached_serial_details(serial_nos)
+    if misses:
+        epoch = service.serial_cache.epoch()
+        fetched = await fetch_serial_details_many(misses)
+        service.store_serial_details(details_by_serial, misses, fetched, epoch)
+    return SortedJSONResponse(service.serial_batch_result(serial_nos, details_by_serial))
+
+
+@timed('/search_serials')
+@limited('/search_serials')
+async def search_serials(request):
+    search_term = request.query_params.get('query', '')
+    if not search_term:
+        return SortedJSONResponse([])
+    if service.serial_index.ready:
+        return SortedJSONResponse(service.serial_index.search(search_term, 10))
+
+    try:
+        response = await async_erp.request('GET', 'Serial No', params=service.search_serials_params(search_term))
+    except ERPError as e:
+        service.logger.warning('erp_request_failed', route='/search_serials', error=e)
+        return SortedJSONResponse([])
+
+    if response.status_code == 200:
+        data = response.json().get('data', [])
+        return SortedJSONResponse([item['name'] for item in data])
+    service.logger.warning('erp_error_response', route='/search_serials', status=response.status_code,
+                           body=response.text)
+    return SortedJSONResponse([])
+
+
+@timed('/get_issue_table')
+@limited('/get_issue_table')
+async def get_issue_table(request):
+    search_term = request.query_params.get('search', '')
+    if service.serial_index.ready:
+        return SortedJSONResponse(service.issue_table_rows(service.serial_index.search_records(search_term, 20)))
+
+    try:
+        response = await async_erp.request('GET', 'Serial No', params=service.issue_table_params(search_term))
+    except ERPError as e:
+        service.logger.warning('erp_request_failed', route='/get_issue_table', error=e)
+        return SortedJSONResponse({"error": "Failed to fetch data from API"}, status_code=500)
+    if response.status_code == 200:
+        data = response.json()
+        return SortedJSONResponse(service.issue_table_rows(SerialRecord(row) for row in data['data']))
+    return SortedJSONResponse({"error": "Failed to fetch data from API"}, status_code=500)
+
+
+@timed('/static/<path:filename>')
+async def static_file(request):
+    found = service.assets.lookup(request.path_params['filename'])
+    if found is None:
+        return PlainTextResponse('Not Found', status_code=404)
+    encoded, cache_control = found
+    status, headers, body = encoded.respond(
+        request.headers.get('accept-encoding'), request.headers.get('if-none-match'), cache_control
+    )
+    return Response(body, status, headers)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await async_erp.aclose()
+
+
+# The native routes give the same CORS answers as CORS(app) in app.py gives the mounted
+# Flask ones: any origin, echoed back rather than *, no credentials. It is per route so
+# the Flask responses don't get the headers twice; OPTIONS is listed so preflights reach it.
+cors = [Middleware(
+    CORSMiddleware,
+    allow_origin_regex='.*',
+    allow_methods=['GET', 'HEAD', 'POST', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'],
+    allow_headers=['*'],
+)]
+
+app = Starlette(
+    routes=[
+        Route('/get_serial_details', get_serial_details, methods=['GET', 'OPTIONS'], middleware=cors),
+        Route('/get_serial_details_batch', get_serial_details_batch, methods=['GET', 'POST', 'OPTIONS'],
+              middleware=cors),
+        Route('/search_serials', search_serials, methods=['GET', 'OPTIONS'], middleware=cors),
+        Route('/get_issue_table', get_issue_table, methods=['GET', 'OPTIONS'], middleware=cors),
+        Route('/static/{filename:path}', static_file, methods=['GET', 'HEAD', 'OPTIONS'], middleware=cors),
+        Mount('/', WSGIMiddleware(service.app)),
+    ],
+    lifespan=lifespan,
+    exception_handlers={ERPBusy: handle_erp_busy},
+)
@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+# Static files and pages, encoded once and served from memory.
+# At startup every file in static/ gets:
+#   - a fingerprinted name such as script.3f2a9c1b0d4e.js
+#   - gzip and brotli variants, kept only where they are smaller
+# Pages link to the fingerprinted names, so those are cached for good (immutable), and
+# a changed file gets a new name. Plain names still work, with a shorter max-age. Every
+# response carries an ETag, and a matching If-None-Match gets 304 with no body.
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_EXTENSIONS = {'.css', '.js', '.png', '.ico', '.svg', '.jpg', '.jpeg', '.gif', '.webp', '.woff', '.woff2'}
+# For plain, unfingerprinted names (e.g. /elec-image, old bookmarks)
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+# Keep a compressed variant only if it saves at least this much (images rarely do)
+MIN_SAVING = 0.1
+ENCODING_TAGS = {'identity': '', 'gzip': '-gz', 'br': '-br'}
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.partition(';')
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    # Weak comparison, any encoding of the same content
+    for tag in (if_none_match or '').split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.removeprefix('W/').strip('"').split('-')[0] == etag:
+            return True
+    return False
+
+
+class Encoded:
+    # One body in every encoding worth keeping, and the ETag it's served under
+
+    __slots__ = ('content_type', 'etag', 'bodies')
+
+    def __init__(self, data, content_type):
+        self.content_type = content_type
+        self.etag = hashlib.sha256(data).hexdigest()[:16]
+        self.bodies = {'identity': data}
+        compressors = [('gzip', lambda body: gzip.compress(body, 9, mtime=0))]
+        if brotli is not None:
+            compressors.append(('br', lambda body: brotli.compress(body, quality=11)))
+        for encoding, compress in compressors:
+            body = compress(data)
+            if len(body) <= len(data) * (1 - MIN_SAVING):
+                self.bodies[encoding] = body
+
+    def respond(self, accept_encoding, if_none_match, cache_control):
+        # -> (status, headers, body)
+        accepted = accepted_encodings(accept_encoding)
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in self.bodies and (candidate in accepted or '*' in accepted):
+                encoding = candidate
+                break
+        headers = {
+            'ETag': f'"{self.etag}{ENCODING_TAGS[encoding]}"',
+            'Cache-Control': cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if etag_matches(if_none_match, self.etag):
+            return 304, headers, b''
+        headers['Content-Type'] = self.content_type
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return 200, headers, self.bodies[encoding]
+
+
+def content_type(filename):
+    guessed = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if guessed.startswith('text/') or guessed.endswith('javascript'):
+        return f'{guessed}; charset=utf-8'
+    return guessed
+
+
+class StaticAssets:
+
+    def __init__(self, directory=STATIC_DIR, max_age=STATIC_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        self._files = {}  # served name, plain or fingerprinted -> (Encoded, Cache-Control)
+        self._urls = {}   # plain name -> fingerprinted name
+        self.load()
+
+    def load(self):
+        files = {}
+        urls = {}
+        for root, dirs, filenames in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith(('.', '__'))]
+            for filename in filenames:
+                extension = os.path.splitext(filename)[1]
+                if extension.lower() not in STATIC_EXTENSIONS:
+                    continue
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    encoded = Encoded(f.read(), content_type(filename))
+                fingerprinted = f'{name[:-len(extension)]}.{encoded.etag[:12]}{extension}'
+                files[name] = (encoded, f'public, max-age={self.max_age}')
+                files[fingerprinted] = (encoded, IMMUTABLE)
+                urls[name] = fingerprinted
+        self._files = files
+        self._urls = urls
+
+    def url(self, name):
+        return self._urls.get(name, name)
+
+    def lookup(self, name):
+        return self._files.get(name)
+
+    def stats(self):
+        return {
+            'files': len(self._urls),
+            'bytes': sum(len(self._files[name][0].bodies['identity']) for name in self._urls),
+            'encodings': sorted({e for encoded, _ in self._files.values() for e in encoded.bodies}),
+        }
+
+
+class PageCache:
+    # Pages with no per-request data, rendered on first use and then kept
+
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        encoded = self._pages.get(key)
+        if encoded is None:
+            # Rendering twice in a race is harmless; the result is the same
+            encoded = Encoded(render().encode('utf-8'), 'text/html; charset=utf-8')
+            with self._lock:
+                encoded = self._pages.setdefault(key, encoded)
+        return encoded
+
+    def __len__(self):
+        return len(self._pages)
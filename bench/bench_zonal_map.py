@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zonal_map import resolve_zonal_managers  # noqa: E402
+
+
+# Roughly today's master data: ~5k customers spread over ~400 territories, with
+# managers assigned at zone level and a few only at region level.
+BASE_CUSTOMERS = 5000
+BASE_CITIES = 300
+
+
+def synthetic_data(scale, seed=1):
+    rng = random.Random(seed)
+    territories = [{'territory': 'All Territories', 'parent_territory': None}]
+    regions = [f'Region {r}' for r in range(8)]
+    zones = []
+    for region in regions:
+        territories.append({'territory': region, 'parent_territory': 'All Territories'})
+        for z in range(4):
+            zone = f'{region} Zone {z}'
+            zones.append(zone)
+            territories.append({'territory': zone, 'parent_territory': region})
+    cities = []
+    for c in range(BASE_CITIES * scale):
+        city = f'City {c}'
+        cities.append(city)
+        territories.append({'territory': city, 'parent_territory': rng.choice(zones)})
+    # Some areas sit one level deeper than the rest
+    for a in range(BASE_CITIES * scale // 10):
+        area = f'Area {a}'
+        cities.append(area)
+        territories.append({'territory': area, 'parent_territory': rng.choice(cities[:BASE_CITIES * scale])})
+
+    managers = []
+    for i, zone in enumerate(zones):
+        if i % 5:
+            managers.append({'zonal_manager': f'Manager {i}', 'parent_territory': zone})
+    for i, region in enumerate(regions):
+        managers.append({'zonal_manager': f'Regional {i}', 'parent_territory': region})
+    managers.append({'zonal_manager': 'Second Manager', 'parent_territory': zones[1]})
+
+    customers = [
+        {'name': f'Customer {n}', 'territory': rng.choice(cities + zones)}
+        for n in range(BASE_CUSTOMERS * scale)
+    ]
+    return pd.DataFrame(managers), pd.DataFrame(customers), pd.DataFrame(territories)
+
+
+def legacy_resolve(result_df_1, customer_df, territory_df):
+    # The merge + groupby/transform + per-territory scan this module used before
+    result_df_2 = pd.merge(customer_df, territory_df, on='territory', how='left')
+    result_df = pd.merge(result_df_1, result_df_2, on='parent_territory', how='right')
+    result = result_df.copy()
+    result['zonal_manager'] = result.groupby('parent_territory')['zonal_manager'].transform(
+        lambda x: x.fillna(x.dropna().iloc[0] if not x.dropna().empty else x)
+    )
+    mask = result['zonal_manager'].isna()
+    if mask.any():
+        territory_zm_dict = {}
+        for terr in result.loc[mask, 'parent_territory'].unique():
+            zm_values = result[(result['territory'] == terr) & (result['zonal_manager'].notna())]['zonal_manager']
+            if not zm_values.empty:
+                territory_zm_dict[terr] = zm_values.iloc[0]
+        result.loc[mask, 'zonal_manager'] = result.loc[mask, 'parent_territory'].map(territory_zm_dict)
+    result = result[["name", "zonal_manager"]].rename(columns={'name': 'customer'})
+    return result.set_index('customer')['zonal_manager'].to_dict()
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the zonal manager resolution against the legacy one.')
+    parser.add_argument('--scales', default='1,10,100')
+    parser.add_argument('--skip-legacy-above', type=int, default=10,
+                        help='the legacy scan is quadratic; skip it for larger scales')
+    args = parser.parse_args()
+
+    print(f"{'scale':>6} {'customers':>10} {'territories':>12} {'legacy s':>10} {'new s':>8} {'same':>6} {'extra':>6}")
+    for scale in [int(s) for s in args.scales.split(',')]:
+        managers, customers, territories = synthetic_data(scale)
+        new, new_time = timed(resolve_zonal_managers, managers, customers, territories)
+
+        legacy_time = same = extra = None
+        if scale <= args.skip_legacy_above:
+            legacy, legacy_time = timed(legacy_resolve, managers, customers, territories)
+            resolved = {k: v for k, v in legacy.items() if v == v}
+            mismatched = [k for k, v in resolved.items() if new.get(k) != v]
+            if mismatched:
+                print(f"  {len(mismatched)} customers differ, e.g. {mismatched[:3]}")
+            same = not mismatched and new.keys() == legacy.keys()
+            # Customers the legacy single hop left unresolved that the tree walk resolves
+            extra = sum(1 for k, v in new.items() if v == v and k not in resolved)
+
+        print(f"{scale:>6} {len(customers):>10} {len(territories):>12} "
+              f"{legacy_time if legacy_time is None else round(legacy_time, 3)!s:>10} {new_time:>8.3f} "
+              f"{same!s:>6} {extra!s:>6}")
+
+
+if __name__ == '__main__':
+    main()
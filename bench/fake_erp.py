@@ -0,0 +1,225 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+# A stand-in for the Frappe `api/resource/<doctype>` endpoints the service calls, with
+# synthetic master data and a fixed per-request latency, for benchmarks and load tests.
+# Supports the filter operators the service uses (=, like, is set, in, >, >=), order_by
+# (default `modified desc`, as in Frappe), limit_start / limit_page_length paging, and
+# POST inserts, which later list queries see.
+
+BASE_CUSTOMERS = 5000
+BASE_SERIALS = 20000
+BASE_CITIES = 300
+
+
+def _modified(n):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1704067200 + n))
+
+
+def synthetic_tables(scale=1, seed=1, serial_scale=None):
+    # serial_scale defaults to scale; 0 leaves Serial No empty for runs that don't need it
+    serial_scale = scale if serial_scale is None else serial_scale
+    rng = random.Random(seed)
+    territories = [{'territory_name': 'All Territories', 'parent_territory': ''}]
+    zones = []
+    for r in range(8):
+        region = f'Region {r}'
+        territories.append({'territory_name': region, 'parent_territory': 'All Territories'})
+        for z in range(4):
+            zone = f'{region} Zone {z}'
+            zones.append(zone)
+            territories.append({'territory_name': zone, 'parent_territory': region})
+    cities = [f'City {c}' for c in range(BASE_CITIES * scale)]
+    territories.extend({'territory_name': city, 'parent_territory': rng.choice(zones)} for city in cities)
+    for n, territory in enumerate(territories):
+        territory.update(name=territory['territory_name'], modified=_modified(n))
+
+    employees = []
+    service_persons = []
+    for i, zone in enumerate(zones):
+        employees.append({
+            'name': f'EMP-{i:04d}', 'employee_name': f'Manager {i}',
+            'designation': 'Area Service Manager', 'status': 'Active', 'modified': _modified(i),
+        })
+        service_persons.append({
+            'name': f'SP-{i:04d}', 'employee': f'EMP-{i:04d}', 'territory': zone, 'modified': _modified(i),
+        })
+
+    customers = []
+    addresses = []
+    for n in range(BASE_CUSTOMERS * scale):
+        name = f'Customer {n}'
+        customers.append({'name': name, 'territory': rng.choice(cities), 'modified': _modified(n)})
+        addresses.append({'name': f'{name}-Billing', 'link_name': name, 'modified': _modified(n)})
+
+    serials = []
+    for n in range(BASE_SERIALS * serial_scale):
+        serials.append({
+            'name': f'SN{n:07d}',
+            'item_name': f'Instrument {n % 40}',
+            'item_code': f'IC-{n % 40:03d}',
+            'customer_instrument_id': f'CI-{n}',
+            'customer': f'Customer {rng.randrange(BASE_CUSTOMERS * scale)}',
+            'custom_amc_type_name': rng.choice(['AMC', 'CMC', 'Warranty']),
+            'warranty_expiry_date': f'20{rng.randrange(15, 35)}-06-30',
+            'modified': _modified(n),
+        })
+
+    return {
+        'Service Person': service_persons,
+        'Employee': employees,
+        'Customer': customers,
+        'Territory': territories,
+        'Address': addresses,
+        'Serial No': serials,
+    }
+
+
+def apply_filters(rows, filters):
+    for condition in json.loads(filters):
+        field, op, value = condition[-3:]
+        if op == '=':
+            rows = [r for r in rows if r.get(field) == value]
+        elif op == 'like':
+            needle = value.strip('%').lower()
+            rows = [r for r in rows if needle in (r.get(field) or '').lower()]
+        elif op == 'is':
+            rows = [r for r in rows if bool(r.get(field)) == (value == 'set')]
+        elif op == 'in':
+            values = set(value)
+            rows = [r for r in rows if r.get(field) in values]
+        elif op == '>':
+            rows = [r for r in rows if (r.get(field) or '') > value]
+        elif op == '>=':
+            rows = [r for r in rows if (r.get(field) or '') >= value]
+    return rows
+
+
+def apply_order(rows, order_by):
+    # Sorts by each `field [asc|desc]` term, last term first, so earlier terms win
+    for term in reversed(order_by.split(',')):
+        parts = term.replace('`', '').split()
+        field = parts[0].rsplit('.', 1)[-1]
+        desc = len(parts) > 1 and parts[1].lower() == 'desc'
+        rows = sorted(rows, key=lambda r: r.get(field) or '', reverse=desc)
+    return rows
+
+
+class FakeERP(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, tables, latency=0.0):
+        super().__init__(address, _Handler)
+        self.tables = tables
+        self.latency = latency
+        self.down = False
+        self.requests = 0
+        self.inserted = []
+        self._lock = threading.Lock()
+        self._selections = {}
+
+    def select(self, doctype, filters, order_by):
+        # Paged pulls repeat the same query once per page; filter and sort it only once
+        key = (doctype, filters, order_by)
+        rows = self._selections.get(key)
+        if rows is None:
+            rows = self.tables.get(doctype, [])
+            if filters:
+                rows = apply_filters(rows, filters)
+            rows = self._selections[key] = apply_order(rows, order_by)
+        return rows
+
+    def changed(self):
+        # Call after editing self.tables
+        self._selections = {}
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-erp', daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _doctype(self):
+        path = urlparse(self.path).path
+        return unquote(path.split('/api/resource/', 1)[1])
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _begin(self):
+        server = self.server
+        with server._lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        return not server.down
+
+    def do_GET(self):
+        if not self._begin():
+            return self._send(503, {'exc': 'down'})
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        rows = self.server.select(self._doctype(), query.get('filters'), query.get('order_by') or 'modified desc')
+        start = int(query.get('limit_start', 0))
+        length = int(query.get('limit_page_length', 20))
+        fields = json.loads(query.get('fields', '["name"]'))
+        if '*' not in fields:
+            keys = [f.rsplit('.', 1)[-1] for f in fields]
+            rows = [{k: r.get(k) for k in keys} for r in rows[start:start + length]]
+        else:
+            rows = rows[start:start + length]
+        self._send(200, {'data': rows})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self._begin():
+            return self._send(503, {'exc': 'down'})
+        doc = json.loads(body or b'{}')
+        doctype = self._doctype()
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self.server._lock:
+            self.server.inserted.append((doctype, doc))
+            name = f'{doctype[:3].upper()}-{len(self.server.inserted):05d}'
+            doc = dict(doc, name=name, creation=now, modified=now)
+            self.server.tables.setdefault(doctype, []).append(doc)
+            self.server.changed()
+        self._send(200, {'data': doc})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Frappe ERP with synthetic data.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--serial-scale', type=int, default=None, help='Serial No size, if not --scale')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    args = parser.parse_args()
+
+    tables = synthetic_tables(args.scale, serial_scale=args.serial_scale)
+    server = FakeERP(('127.0.0.1', args.port), tables, args.latency)
+    print(f'Fake ERP on {server.url} ({len(server.tables["Serial No"])} serials)', flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
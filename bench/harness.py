@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import aiohttp
+
+
+# Process plumbing shared by the load tests: the fake ERP and the server under test each
+# run in their own process, and the load generator drives them over HTTP from this one.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'flask': [sys.executable, '-c', 'import sys, app; app.app.run(port=int(sys.argv[1]), threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--log-level', 'warning', '--port'],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(process, url, what, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urlopen(url, timeout=1):
+                return
+        except HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{what} did not start')
+
+
+def start_erp(scale, latency, serial_scale=None):
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'bench', 'fake_erp.py'),
+               '--port', str(port), '--scale', str(scale), '--latency', str(latency)]
+    if serial_scale is not None:
+        command += ['--serial-scale', str(serial_scale)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/'
+    wait_until_up(process, f'{url}api/resource/Employee', 'fake ERP', timeout=600)
+    return process, url
+
+
+def start_server(mode, erp_url, workdir, **extra_env):
+    port = free_port()
+    env = dict(
+        os.environ,
+        ERP_BASE_URL=erp_url,
+        SNAPSHOT_DIR=os.path.join(workdir, mode),
+        OUTBOX_PATH=os.path.join(workdir, f'{mode}.sqlite3'),
+        PYTHONUNBUFFERED='1',
+        # Every load test request comes from one address, and the benchmarks measure
+        # serving rather than load shedding, so no rate limits or ERP caps
+        RATE_LIMIT_BACKEND='off',
+        ERP_MAX_CONCURRENCY='0',
+    )
+    env.update(extra_env)
+    process = subprocess.Popen(SERVERS[mode] + [str(port)], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    wait_until_up(process, f'{url}/stats', f'{mode} server')
+    return process, url
+
+
+def get_json(url):
+    with urlopen(url, timeout=30) as response:
+        return json.load(response)
+
+
+def wait_for(predicate, timeout, interval=0.2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def stop(process):
+    process.terminate()
+    process.wait()
+
+
+def peak_rss_mib(pid):
+    # High-water resident set size of a running process, from /proc (Linux only)
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def drive(url, requests, concurrency):
+    # requests: (method, path, params, form) tuples, sent by `concurrency` workers.
+    # Returns (latencies, errors, elapsed); a redirect counts as success.
+    latencies = []
+    errors = 0
+    pending = iter(requests)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def worker(client):
+        nonlocal errors
+        for method, path, params, form in pending:
+            started = time.perf_counter()
+            try:
+                async with client.request(method, f'{url}{path}', params=params, data=form,
+                                          allow_redirects=False) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def run_load(url, requests, concurrency):
+    latencies, errors, elapsed = asyncio.run(drive(url, requests, concurrency))
+    return {
+        'requests': len(latencies),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'errors': errors,
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
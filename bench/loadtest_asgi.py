@@ -0,0 +1,51 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_erp import synthetic_tables  # noqa: E402
+from bench.harness import run_load, start_erp, start_server, stop  # noqa: E402
+
+
+# Compares the threaded Flask server with the ASGI mode on /get_serial_details against a
+# fake ERP with a fixed latency. Every request asks for a different serial, so each one
+# is a cache miss that waits on the ERP; that wait is what the two modes handle differently.
+# The fake ERP, the server under test and the load generator each run in their own process.
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the Flask and ASGI serving modes.')
+    parser.add_argument('--modes', default='flask,asgi')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.2, help='fake ERP latency per request (s)')
+    parser.add_argument('--scale', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    serials = [row['name'] for row in synthetic_tables(args.scale)['Serial No']]
+    erp_process, erp_url = start_erp(args.scale, args.latency)
+
+    try:
+        print(f"ERP latency {args.latency * 1000:.0f} ms, {args.requests} requests, concurrency {args.concurrency}")
+        print(f"{'mode':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        with tempfile.TemporaryDirectory() as workdir:
+            for mode in args.modes.split(','):
+                process, url = start_server(mode, erp_url, workdir)
+                try:
+                    sample = rng.sample(serials, args.requests)
+                    result = run_load(url, [('GET', '/get_serial_details', {'serial_no': serial}, None)
+                                            for serial in sample], args.concurrency)
+                finally:
+                    stop(process)
+                print(f"{mode:>6} {result['throughput']:>8.1f} {result['p50_ms']:>8.1f} "
+                      f"{result['p99_ms']:>8.1f} {result['errors']:>7}")
+    finally:
+        erp_process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import socketserver
+import threading
+import time
+
+
+# A local SMTP server that accepts every message and throws it away, so the submit
+# routes can be load-tested end to end without a real mail server. Plain SMTP only:
+# run the service with SMTP_STARTTLS=0 and SMTP_USERNAME= (empty, no login).
+# Tests can queue replies in `replies`, e.g. '451 Try again later', to answer the next
+# messages with instead of 250 OK; `recipients` lists those of each accepted message.
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, delay=0.0):
+        super().__init__(address, _Handler)
+        self.delay = delay
+        self.received = 0
+        self.connections = 0
+        self.replies = []
+        self.recipients = []
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            setattr(self, key, getattr(self, key) + 1)
+
+    def accept(self, recipients):
+        # -> the reply to a message: 250 OK, or the next queued one
+        with self._lock:
+            if self.replies:
+                return self.replies.pop(0)
+            self.received += 1
+            self.recipients.append(recipients)
+            return '250 OK'
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True).start()
+        return self
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.count('connections')
+        self.reply('220 sink ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.split(b' ', 1)[0].strip().upper()
+            if command == b'EHLO':
+                self.reply('250-sink')
+                self.reply('250 8BITMIME')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+                self.reply(self.server.accept(recipients))
+                recipients = []
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            elif command == b'RCPT':
+                recipients.append(line.split(b':', 1)[-1].strip().strip(b'<>').decode('ascii', 'replace'))
+                self.reply('250 OK')
+            elif command in (b'HELO', b'MAIL', b'RSET', b'NOOP'):
+                if command == b'RSET':
+                    recipients = []
+                self.reply('250 OK')
+            else:
+                self.reply('502 Command not implemented')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Accept and discard mail over plain SMTP.')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds added to every message')
+    args = parser.parse_args()
+
+    server = SMTPSink(('127.0.0.1', args.port), args.delay)
+    print(f'SMTP sink on 127.0.0.1:{server.port}', flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_erp import synthetic_tables  # noqa: E402
+from bench.harness import (  # noqa: E402
+    ROOT, get_json, peak_rss_mib, run_load, start_erp, start_server, stop, wait_for,
+)
+from bench.smtp_sink import SMTPSink  # noqa: E402
+
+
+# End-to-end benchmark of the service against the fake ERP (bench/fake_erp.py) and a local
+# SMTP sink (bench/smtp_sink.py), so nothing touches the real ERP or mail server:
+#
+#   zonal    full and delta zonal map sync at each --scales size, one process per size
+#   lookups  the lookup routes under concurrent load, once the indexes have loaded
+#   submit   /submit under load, then until every ticket is in the ERP and every
+#            confirmation email has reached the sink
+#   logging  cost to the request thread of logging a submitted form through log.py,
+#            against the print() it replaced, with a fast and a slow log collector
+#
+# Each stage reports throughput, p50/p99 latency and peak RSS. --output writes the same
+# numbers as JSON, to compare runs.
+
+LOOKUP_ROUTES = ['serial_details_miss', 'serial_details_hot', 'serial_details_batch',
+                 'search_serials', 'issue_table', 'zonal_manager']
+
+
+def zonal_child():
+    # Runs in its own process so its peak RSS is the sync's alone
+    import zonal_map
+
+    sync = zonal_map.ZonalMapSync()
+    started = time.perf_counter()
+    result = sync()
+    full = time.perf_counter() - started
+    full_timings = zonal_map.last_timings
+    started = time.perf_counter()
+    sync()
+    delta = time.perf_counter() - started
+    print(json.dumps({
+        'customers': len(result or ()),
+        'full_s': round(full, 3),
+        'delta_s': round(delta, 3),
+        'fetch_s': full_timings['fetch'],
+        'resolve_s': full_timings['resolve'],
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def bench_zonal(scales, latency):
+    results = {}
+    print(f"\nzonal map sync (ERP latency {latency * 1000:.0f} ms)")
+    print(f"{'scale':>6} {'customers':>10} {'full s':>8} {'fetch s':>8} {'resolve s':>10} {'delta s':>8} {'RSS MiB':>8}")
+    for scale in scales:
+        erp_process, erp_url = start_erp(scale, latency, serial_scale=0)
+        try:
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--zonal-child'],
+                cwd=ROOT, env=dict(os.environ, ERP_BASE_URL=erp_url),
+                capture_output=True, text=True, check=True,
+            )
+        finally:
+            stop(erp_process)
+        result = results[scale] = json.loads(child.stdout.strip().splitlines()[-1])
+        print(f"{scale:>6} {result['customers']:>10} {result['full_s']:>8.3f} {result['fetch_s']:>8.3f} "
+              f"{result['resolve_s']:>10.3f} {result['delta_s']:>8.3f} {result['peak_rss_mib']:>8.1f}")
+    return results
+
+
+def lookup_requests(route, tables, n, rng):
+    serials = [row['name'] for row in tables['Serial No']]
+    customers = [row['name'] for row in tables['Customer']]
+    if route == 'serial_details_miss':
+        # Distinct serials: each one waits on the ERP
+        return [('GET', '/get_serial_details', {'serial_no': s}, None) for s in rng.sample(serials, n)]
+    if route == 'serial_details_hot':
+        hot = rng.sample(serials, 50)
+        return [('GET', '/get_serial_details', {'serial_no': rng.choice(hot)}, None) for _ in range(n)]
+    if route == 'serial_details_batch':
+        return [('GET', '/get_serial_details_batch', [('serial_no', s) for s in rng.sample(serials, 20)], None)
+                for _ in range(n)]
+    if route == 'search_serials':
+        return [('GET', '/search_serials', {'query': f'SN00{rng.randrange(100):02d}'}, None) for _ in range(n)]
+    if route == 'issue_table':
+        return [('GET', '/get_issue_table', {'search': f'{rng.randrange(1000):03d}'}, None) for _ in range(n)]
+    if route == 'zonal_manager':
+        return [('GET', '/get_zonal_manager', {'customer': rng.choice(customers)}, None) for _ in range(n)]
+    raise ValueError(route)
+
+
+SUBMIT_ROUTES = {
+    'submit_issue': ('/submit', {'description': 'Benchmark ticket'}),
+    'submit_warranty': ('/submit2', {'complaint': 'Benchmark claim'}),
+}
+
+
+def submit_requests(route, n, offset):
+    # One customer per ticket; the outbox delivers a customer's tickets one at a time
+    path, fields = SUBMIT_ROUTES[route]
+    return [('POST', path, None, dict(
+        fields,
+        custom_contact_email=f'bench{i}@example.com',
+        customer=f'Customer {i}',
+        serial_no=f'SN{i:07d}',
+        contact_person_name='Bench',
+        phone_number='0000000000',
+    )) for i in range(offset, offset + n)]
+
+
+def server_ready(url):
+    stats = get_json(f'{url}/stats')
+    return stats['serial_index']['ready'] and stats['zonal_manager_map']['version'] is not None
+
+
+class SlowStream(io.TextIOBase):
+    # stdout as seen through a log collector that takes `delay` per write
+
+    def __init__(self):
+        self.delay = 0.0
+        self.lines = 0
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        self.lines += text.count('\n')
+        return len(text)
+
+
+def bench_logging(records, delays):
+    import log
+
+    stream = SlowStream()
+    log.setup(stream=stream)
+    logger = log.get('bench')
+    form = dict(submit_requests('submit_issue', 1, 0)[0][3], issue_generate_date='2025-01-01',
+                description='Benchmark ticket<br><br><b>Bench +91 98765 43210</b>')
+    results = {}
+    print(f"\nlogging a submitted form, {records} records")
+    print(f"{'sink ms':>8} {'print us':>9} {'log us':>8} {'drain s':>8} {'dropped':>8}")
+    for delay in delays:
+        stream.delay = delay
+        started = time.perf_counter()
+        for _ in range(records):
+            print("Issue Form Data:", form, file=stream)
+        sync = (time.perf_counter() - started) / records
+
+        dropped = log.stats()['dropped']
+        started = time.perf_counter()
+        for _ in range(records):
+            logger.info('form_submitted', doctype='Issue', reference='WEB-0000000000', form=form)
+        queued = (time.perf_counter() - started) / records
+        wait_for(lambda: log.stats()['pending'] == 0, 600, interval=0.01)
+        result = results[f'{delay * 1000:g}ms'] = {
+            'print_us': round(sync * 1e6, 1),
+            'log_us': round(queued * 1e6, 1),
+            'drain_s': round(time.perf_counter() - started, 3),
+            'dropped': log.stats()['dropped'] - dropped,
+        }
+        print(f"{delay * 1000:>8g} {result['print_us']:>9.1f} {result['log_us']:>8.1f} "
+              f"{result['drain_s']:>8.3f} {result['dropped']:>8}")
+    return results
+
+
+def bench_service(args):
+    results = {}
+    rng = random.Random(1)
+    tables = synthetic_tables(args.lookup_scale)
+    sink = SMTPSink(('127.0.0.1', 0), args.smtp_delay).start()
+    erp_process, erp_url = start_erp(args.lookup_scale, args.latency)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            process, url = start_server(
+                args.mode, erp_url, workdir,
+                SMTP_SERVER='127.0.0.1', SMTP_PORT=str(sink.port), SMTP_STARTTLS='0', SMTP_USERNAME='',
+            )
+            try:
+                if not wait_for(lambda: server_ready(url), 600):
+                    raise RuntimeError('server indexes did not load')
+                print(f"\n{args.mode} server, scale {args.lookup_scale}, ERP latency {args.latency * 1000:.0f} ms, "
+                      f"concurrency {args.concurrency}")
+                print(f"{'route':>22} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+                if 'lookups' in args.stages:
+                    for route in LOOKUP_ROUTES:
+                        result = results[route] = run_load(
+                            url, lookup_requests(route, tables, args.requests, rng), args.concurrency)
+                        print(f"{route:>22} {result['throughput']:>8.1f} {result['p50_ms']:>8.1f} "
+                              f"{result['p99_ms']:>8.1f} {result['errors']:>7}")
+
+                if 'submit' in args.stages:
+                    for n, route in enumerate(SUBMIT_ROUTES):
+                        expected = (n + 1) * args.submits
+                        started = time.perf_counter()
+                        result = results[route] = run_load(
+                            url, submit_requests(route, args.submits, n * args.submits), args.concurrency)
+
+                        def drained():
+                            outbox = get_json(f'{url}/stats')['outbox']
+                            return outbox.get('done', 0) >= expected and sink.received >= expected
+
+                        result['drained'] = wait_for(drained, 300)
+                        result['drain_s'] = round(time.perf_counter() - started, 3)
+                        print(f"{route:>22} {result['throughput']:>8.1f} {result['p50_ms']:>8.1f} "
+                              f"{result['p99_ms']:>8.1f} {result['errors']:>7}   "
+                              f"all in the ERP and mailed after {result['drain_s']:.2f}s"
+                              f"{'' if result['drained'] else ' (timed out)'}")
+
+                results['server_peak_rss_mib'] = round(peak_rss_mib(process.pid) or 0, 1)
+                print(f"server peak RSS {results['server_peak_rss_mib']:.1f} MiB")
+            finally:
+                stop(process)
+    finally:
+        stop(erp_process)
+        sink.shutdown()
+    return results
+
+
+def main():
+    if sys.argv[1:] == ['--zonal-child']:
+        return zonal_child()
+
+    parser = argparse.ArgumentParser(description='Benchmark the service against a local fake ERP and SMTP sink.')
+    parser.add_argument('--stages', default='zonal,lookups,submit,logging')
+    parser.add_argument('--scales', default='1,10,100', help='data sizes for the zonal stage')
+    parser.add_argument('--lookup-scale', type=int, default=1, help='data size for the lookup and submit stages')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake ERP latency per request (s)')
+    parser.add_argument('--smtp-delay', type=float, default=0.0, help='SMTP sink delay per message (s)')
+    parser.add_argument('--mode', default='flask', choices=['flask', 'asgi'])
+    parser.add_argument('--requests', type=int, default=1000, help='requests per lookup route')
+    parser.add_argument('--submits', type=int, default=200, help='submissions per submit route')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--log-records', type=int, default=5000, help='records per logging run')
+    parser.add_argument('--log-sink-delays', default='0,0.001',
+                        help='seconds the log collector takes per write, one logging run each')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+    args.stages = args.stages.split(',')
+
+    results = {'args': vars(args)}
+    if 'zonal' in args.stages:
+        results['zonal'] = bench_zonal([int(s) for s in args.scales.split(',')], args.latency)
+    if 'lookups' in args.stages or 'submit' in args.stages:
+        results['service'] = bench_service(args)
+    if 'logging' in args.stages:
+        results['logging'] = bench_logging(args.log_records, [float(d) for d in args.log_sink_delays.split(',')])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
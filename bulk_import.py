@@ -0,0 +1,178 @@
+import csv
+import io
+import os
+import posixpath
+import re
+import zipfile
+from datetime import date, timedelta
+from xml.etree import ElementTree
+
+import metrics
+
+
+# Spreadsheets of service requests, one ticket per row. Rows are read one at a time from
+# the upload, CSV or XLSX, with the form's field names as column headings (in any case,
+# with spaces or underscores). The tickets are journalled in the outbox as one batch and
+# the upload is answered straight away; the outbox workers send them to the ERP. Rows of
+# one import reach the ERP side by side, so their order among themselves isn't kept;
+# rows of a customer with earlier tickets still in the outbox wait for those, as any
+# submission would.
+#
+# XLSX is read with zipfile and ElementTree: only the first sheet's cell values, which is
+# all an export from a spreadsheet needs, without another dependency.
+
+BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS', 1000))
+BULK_IMPORT_MAX_BYTES = int(os.environ.get('BULK_IMPORT_MAX_BYTES', 5 * 1024 * 1024))
+# XLSX is compressed; refuse one that unpacks to more than this
+MAX_UNPACKED = 20 * BULK_IMPORT_MAX_BYTES
+
+BULK_ROWS = metrics.counter('bulk_import_rows_total', 'Rows of bulk imports, by outcome.', ['outcome'])
+
+QUEUED = 'queued'
+INVALID = 'invalid'
+FAILED = 'failed'
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+# Spreadsheets count days from here, and store dates as that number
+EXCEL_EPOCH = date(1899, 12, 30)
+
+
+class BadUpload(ValueError):
+    pass
+
+
+def column_name(heading):
+    # "Contact Email" and "contact_email" are the same column
+    return re.sub(r'[\s_]+', '_', str(heading or '').strip()).lower()
+
+
+def read_rows(filename, stream, max_rows=BULK_IMPORT_MAX_ROWS):
+    # -> (spreadsheet row number, {column: text}) for each row with anything in it.
+    # Raises BadUpload for a file that can't be read, or more than max_rows rows.
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        rows = csv_rows(stream)
+    elif extension == '.xlsx':
+        rows = xlsx_rows(stream)
+    else:
+        raise BadUpload('Upload a .csv or .xlsx file')
+
+    header = next(rows, None)
+    if header is None:
+        raise BadUpload('The file is empty')
+    columns = [column_name(heading) for heading in header[1]]
+    count = 0
+    for number, values in rows:
+        values = [str(value).strip() if value is not None else '' for value in values]
+        if not any(values):
+            continue
+        count += 1
+        if count > max_rows:
+            raise BadUpload(f'At most {max_rows} rows per import')
+        yield number, {column: value for column, value in zip(columns, values) if column and value}
+
+
+def csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        for number, values in enumerate(csv.reader(text), 1):
+            yield number, values
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise BadUpload(f'Not a readable UTF-8 CSV file: {e}')
+    finally:
+        text.detach()
+
+
+def excel_date(value):
+    # A number in an XLSX date column is a day count; the cell's style, which isn't
+    # read, would show it as a date
+    if not re.fullmatch(r'\d+(\.\d+)?', value):
+        return value
+    try:
+        return (EXCEL_EPOCH + timedelta(days=int(float(value)))).isoformat()
+    except (ValueError, OverflowError):
+        return value
+
+
+def cell_index(ref):
+    # "AB12" -> 27
+    index = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def first_sheet(archive):
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{MAIN_NS}sheets/{MAIN_NS}sheet')
+    if sheet is None:
+        raise BadUpload('The workbook has no sheets')
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{PACKAGE_REL_NS}Relationship'):
+        if rel.get('Id') == sheet.get(f'{REL_NS}id'):
+            target = rel.get('Target')
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(f'xl/{target}')
+    raise BadUpload('The workbook has no sheets')
+
+
+def shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, element in ElementTree.iterparse(f):
+            if element.tag == f'{MAIN_NS}si':
+                strings.append(''.join(text.text or '' for text in element.iter(f'{MAIN_NS}t')))
+                element.clear()
+    return strings
+
+
+def cell_value(cell, strings, is_date=False):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f'{MAIN_NS}t'))
+    value = cell.findtext(f'{MAIN_NS}v')
+    if value is None:
+        return ''
+    if kind == 's':
+        return strings[int(value)]
+    if kind == 'b':
+        return 'TRUE' if value == '1' else 'FALSE'
+    if kind is None or kind == 'n':
+        if is_date:
+            return excel_date(value)
+        # Whole numbers come back as 42.0 from some writers; a phone number shouldn't
+        return value[:-2] if value.endswith('.0') else value
+    return value
+
+
+def xlsx_rows(stream):
+    try:
+        archive = zipfile.ZipFile(stream)
+        if sum(info.file_size for info in archive.infolist()) > MAX_UNPACKED:
+            raise BadUpload('The XLSX file is too large')
+        strings = shared_strings(archive)
+        sheet = archive.open(first_sheet(archive))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise BadUpload(f'Not a readable XLSX file: {e}')
+    with archive, sheet:
+        date_columns = None  # from the first row, the headings
+        try:
+            for _, element in ElementTree.iterparse(sheet):
+                if element.tag != f'{MAIN_NS}row':
+                    continue
+                values = []
+                for cell in element.iter(f'{MAIN_NS}c'):
+                    index = cell_index(cell.get('r', '')) if cell.get('r') else len(values)
+                    values.extend([''] * (index - len(values)))
+                    values.append(cell_value(cell, strings, date_columns is not None and index in date_columns))
+                if date_columns is None:
+                    date_columns = {i for i, heading in enumerate(values) if column_name(heading).endswith('_date')}
+                yield int(element.get('r') or 0), values
+                element.clear()
+        except (ElementTree.ParseError, IndexError, ValueError) as e:
+            raise BadUpload(f'Not a readable XLSX file: {e}')
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call:
+    __slots__ = ('event', 'value', 'error', 'stale')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class TTLCache:
+    # Bounded LRU with a per-entry TTL. Concurrent misses for the same key wait for the
+    # first caller's load instead of each going to the ERP (single-flight). None results
+    # are returned to every waiter but not stored, so a missing serial is retried.
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, loader):
+        leader = False
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+                self.expirations += 1
+
+            call = self._inflight.get(key)
+            if call is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                call = self._inflight[key] = _Call()
+                leader = True
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = loader()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if call.error is None and call.value is not None and not call.stale:
+                    self._data[key] = (time.monotonic() + self.ttl, call.value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+                        self.evictions += 1
+            call.event.set()
+        return call.value
+
+    def get(self, key):
+        # Lookup without loading, for callers (the ASGI routes) that coordinate their own loads
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def epoch(self):
+        return self._epoch
+
+    def put(self, key, value, epoch=None):
+        # A value loaded before an invalidation (epoch changed since it started) is dropped
+        with self._lock:
+            self.misses += 1
+            if value is None or (epoch is not None and epoch != self._epoch):
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._epoch += 1
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+            call = self._inflight.get(key)
+            if call is not None:
+                # A load that started before the invalidation must not repopulate the cache
+                call.stale = True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+
+import requests
+
+import log
+import metrics
+from erp_client import erp
+
+
+DELTA_FULL_INTERVAL = int(os.environ.get('DELTA_FULL_INTERVAL', 6 * 3600))
+
+logger = log.get('sync')
+
+SYNC_SECONDS = metrics.histogram('sync_seconds', 'Full and delta syncs of the lookup tables.',
+                                 ['builder', 'mode', 'outcome'], buckets=metrics.BACKGROUND_BUCKETS)
+
+
+class DeltaSource:
+    # One doctype pulled in full once, then only the rows whose `modified` is at or after
+    # the newest one seen. `>=` re-reads the rows sharing that timestamp, so applying a
+    # pull must be idempotent. Pulls are lazy row iterators; the mark only moves when the
+    # caller commits after applying them.
+    # Deleted rows never show up here; they go away at the next full pull.
+
+    def __init__(self, doctype, fields, filters=None):
+        self.doctype = doctype
+        self.fields = json.dumps(list(fields) + ['modified'])
+        self.filters = list(filters or [])
+        self.high_water = None
+        self.last_pull = None
+        self._seen = None
+
+    def pull_all(self):
+        filters = json.dumps(self.filters) if self.filters else None
+        return self._track(erp.iter_list(self.doctype, self.fields, filters=filters))
+
+    def pull_changes(self):
+        # In the default `modified desc` order; see PagedRows
+        filters = self.filters + [['modified', '>=', self.high_water or '']]
+        return self._track(erp.iter_list(self.doctype, self.fields, filters=json.dumps(filters)))
+
+    def _track(self, rows):
+        self.last_pull = rows
+        self._seen = None
+        for row in rows:
+            modified = row.get('modified') or ''
+            if self._seen is None or modified > self._seen:
+                self._seen = modified
+            yield row
+
+    def commit(self):
+        # Called once the pulled rows have been applied
+        if self._seen is not None and (self.high_water is None or self._seen > self.high_water):
+            self.high_water = self._seen
+
+
+class DeltaBuilder:
+    # Snapshot build callable that keeps its tables between runs: a full pull the first
+    # time and every `full_interval` (which also drops deleted rows), otherwise only the
+    # changes since the last run. Subclasses implement full() and delta(); delta() returns
+    # snapshot.UNCHANGED when no value moved.
+
+    def __init__(self, full_interval=DELTA_FULL_INTERVAL):
+        self.full_interval = full_interval
+        self.full_at = None
+        self.last_sync = None
+
+    def __call__(self):
+        full = self.full_at is None or time.time() - self.full_at >= self.full_interval
+        mode = 'full' if full else 'delta'
+        started = time.perf_counter()
+        try:
+            result = self.full() if full else self.delta()
+        except (requests.RequestException, ValueError) as e:
+            SYNC_SECONDS.observe(time.perf_counter() - started, type(self).__name__, mode, 'error')
+            logger.error('sync_failed', builder=type(self).__name__, mode=mode, error=e)
+            return None
+        if result is not None and full:
+            self.full_at = time.time()
+        elapsed = time.perf_counter() - started
+        SYNC_SECONDS.observe(elapsed, type(self).__name__, mode, 'error' if result is None else 'ok')
+        self.last_sync = {
+            'mode': mode,
+            'ok': result is not None,
+            'seconds': round(elapsed, 3),
+            'at': time.time(),
+        }
+        return result
@@ -0,0 +1,424 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+
+ERP_BASE_URL = os.environ.get('ERP_BASE_URL', 'https://erpv14.electrolabgroup.com/')
+ERP_API_TOKEN = os.environ.get('ERP_API_TOKEN', '3ee8d03949516d0:6baa361266cf807')
+ERP_CONNECT_TIMEOUT = float(os.environ.get('ERP_CONNECT_TIMEOUT', 5))
+ERP_READ_TIMEOUT = float(os.environ.get('ERP_READ_TIMEOUT', 30))
+ERP_RETRIES = int(os.environ.get('ERP_RETRIES', 2))
+ERP_RETRY_BACKOFF = float(os.environ.get('ERP_RETRY_BACKOFF', 0.5))
+ERP_POOL_SIZE = int(os.environ.get('ERP_POOL_SIZE', 20))
+ERP_ASYNC_POOL_SIZE = int(os.environ.get('ERP_ASYNC_POOL_SIZE', 100))
+ERP_PAGE_SIZE = int(os.environ.get('ERP_PAGE_SIZE', 5000))
+ERP_PAGES_IN_FLIGHT = int(os.environ.get('ERP_PAGES_IN_FLIGHT', 4))
+# At most this many ERP calls at once per process, from every client together: Flask
+# routes, ASGI routes and background work (0 = no cap). Background syncs and ticket
+# delivery may hold at most ERP_BACKGROUND_CONCURRENCY of them and wait for a slot, so
+# they can't be shed and always leave the rest to requests. A request may use any free
+# slot; one that can't get a slot within ERP_QUEUE_TIMEOUT seconds is shed with ERPBusy.
+ERP_MAX_CONCURRENCY = int(os.environ.get('ERP_MAX_CONCURRENCY', 24))
+ERP_BACKGROUND_CONCURRENCY = int(os.environ.get('ERP_BACKGROUND_CONCURRENCY', 8))
+ERP_QUEUE_TIMEOUT = float(os.environ.get('ERP_QUEUE_TIMEOUT', 1))
+ERP_BUSY_RETRY_AFTER = int(os.environ.get('ERP_BUSY_RETRY_AFTER', 2))
+
+ERP_SECONDS = metrics.histogram('erp_request_seconds', 'ERP API calls, by method and doctype.',
+                                ['method', 'doctype', 'outcome'])
+ERP_SHED = metrics.counter('erp_shed_total', 'ERP calls refused because every slot stayed busy.', ['method', 'doctype'])
+
+
+class ERPBusy(Exception):
+    # Raised instead of queueing without limit for an ERP slot; answer 503 with Retry-After
+    def __init__(self, message, retry_after=ERP_BUSY_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Slots:
+    # A counting semaphore shared by threads and coroutines, on any event loop. Slots go
+    # to waiters in arrival order: release() hands the slot straight to the oldest.
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._waiters = deque()  # threading.Event, or (loop, future) for a coroutine
+
+    def _take(self):
+        # With self._lock held
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return True
+        return False
+
+    def _withdraw(self, waiter):
+        # -> True if the waiter was handed a slot after all, as it gave up
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return True
+        return False
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            if self._take():
+                return True
+            event = threading.Event()
+            self._waiters.append(event)
+        return event.wait(timeout) or self._withdraw(event)
+
+    async def acquire_async(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._take():
+                return True
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._withdraw(waiter)
+        except BaseException:
+            # Cancelled; pass on a slot handed over meanwhile
+            if self._withdraw(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.in_use -= 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+            return
+        loop, future = waiter
+        try:
+            loop.call_soon_threadsafe(_wake, future)
+        except RuntimeError:
+            # Its loop has closed
+            self.release()
+
+
+# The process's ERP budget, which every client shares unless given its own
+SLOTS = Slots(ERP_MAX_CONCURRENCY) if ERP_MAX_CONCURRENCY else None
+BACKGROUND_SLOTS = Slots(ERP_BACKGROUND_CONCURRENCY) if ERP_BACKGROUND_CONCURRENCY else None
+
+
+class ERPClient:
+    # Thin wrapper around one pooled requests.Session per worker process. GETs are
+    # retried with backoff on connection errors and 502/503/504; POSTs are only
+    # retried when the connection could not be made, so a ticket is never sent twice.
+
+    def __init__(self, base_url=ERP_BASE_URL, token=ERP_API_TOKEN,
+                 connect_timeout=ERP_CONNECT_TIMEOUT, read_timeout=ERP_READ_TIMEOUT,
+                 retries=ERP_RETRIES, backoff=ERP_RETRY_BACKOFF, pool_size=ERP_POOL_SIZE,
+                 slots=SLOTS, background_slots=BACKGROUND_SLOTS, queue_timeout=ERP_QUEUE_TIMEOUT):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.token = token
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.queue_timeout = queue_timeout
+        self._slots = slots
+        self._background_slots = background_slots
+        self._session = None
+        self._pid = None
+        self._session_lock = threading.Lock()
+        self._stats = {}
+        self._shed = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Sessions must not be shared across a fork (e.g. gunicorn --preload)
+        if self._session is None or self._pid != os.getpid():
+            with self._session_lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._make_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _make_session(self):
+        session = requests.Session()
+        session.headers['Authorization'] = f'token {self.token}'
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @contextmanager
+    def _slot(self, method, doctype, background):
+        held = []
+        try:
+            if background:
+                # Background callers wait as long as it takes; they aren't holding up a user
+                for slots in (self._background_slots, self._slots):
+                    if slots is not None:
+                        slots.acquire()
+                        held.append(slots)
+            elif self._slots is not None:
+                if not self._slots.acquire(self.queue_timeout):
+                    self._busy(method, doctype)
+                held.append(self._slots)
+            yield
+        finally:
+            for slots in reversed(held):
+                slots.release()
+
+    def _busy(self, method, doctype):
+        ERP_SHED.inc(method, doctype)
+        with self._stats_lock:
+            self._shed += 1
+        raise ERPBusy(f'{self._slots.limit} ERP calls already in flight')
+
+    def request(self, method, doctype, background=False, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        with self._slot(method, doctype, background):
+            started = time.perf_counter()
+            failed = True
+            try:
+                response = self.session.request(method, f'{self.base_url}api/resource/{doctype}', **kwargs)
+                failed = response.status_code >= 400
+                return response
+            finally:
+                self._record(method, doctype, time.perf_counter() - started, failed)
+
+    def get_list(self, doctype, fields, filters=None, limit_start=0, limit_page_length=20, background=False,
+                 **params):
+        params.update({
+            'fields': fields,
+            'limit_start': limit_start,
+            'limit_page_length': limit_page_length,
+        })
+        if filters is not None:
+            params['filters'] = filters
+        return self.request('GET', doctype, background=background, params=params)
+
+    def iter_list(self, doctype, fields, filters=None, **kwargs):
+        return PagedRows(self, doctype, fields, filters, **kwargs)
+
+    def insert(self, doctype, data, headers=None, background=False):
+        return self.request('POST', doctype, background=background, json=data, headers=headers)
+
+    def _record(self, method, doctype, elapsed, failed):
+        ERP_SECONDS.observe(elapsed, method, doctype, 'error' if failed else 'ok')
+        metrics.add_span('erp', elapsed)
+        endpoint = f'{method} {doctype}'
+        with self._stats_lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = {'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+            stats['count'] += 1
+            stats['errors'] += failed
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+    def stats(self):
+        with self._stats_lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._stats.items()}
+
+    def admission(self):
+        # The budget as a whole, with this client's shed calls
+        with self._stats_lock:
+            shed = self._shed
+        return {
+            'max_concurrency': self._slots.limit if self._slots else 0,
+            'in_flight': self._slots.in_use if self._slots else None,
+            'background_concurrency': self._background_slots.limit if self._background_slots else 0,
+            'background_in_flight': self._background_slots.in_use if self._background_slots else None,
+            'queue_timeout': self.queue_timeout,
+            'shed': shed,
+        }
+
+
+class PagedRows:
+    # Iterates every row of a list query one page (limit_start / limit_page_length) at a
+    # time, with up to `in_flight` pages requested ahead of the consumer. Only those pages
+    # are held in memory, whatever the size of the table. Pages are ordered by the ERP's
+    # default `modified desc` plus `name` as a tie-break.
+    #
+    # Offsets aren't a snapshot: rows written while the pages are read shift the ones
+    # after them. In `modified desc` order an edited or new row moves ahead of the pages
+    # already read, so a later page repeats a row at its boundary (callers apply rows
+    # idempotently), and the edited row itself is newer than anything this pull saw, so
+    # the next delta sync reads it. A row deleted (or filtered out) mid-pull shifts rows
+    # the other way, and one at a page boundary can be missed until the next full pull.
+    # Pulls in `modified asc` order would miss rows on every edit, so the delta syncs
+    # keep the default order too.
+    #
+    # A failed page raises requests.RequestException from the iteration. Bulk pulls are
+    # background work unless the caller says otherwise.
+
+    def __init__(self, client, doctype, fields, filters=None, order_by=None,
+                 page_size=ERP_PAGE_SIZE, in_flight=ERP_PAGES_IN_FLIGHT, background=True, **params):
+        self.client = client
+        self.doctype = doctype
+        self.fields = fields
+        self.filters = filters
+        self.order_by = order_by or f'`tab{doctype}`.`modified` desc, `tab{doctype}`.`name` desc'
+        self.page_size = page_size
+        self.in_flight = in_flight
+        self.background = background
+        self.params = params
+        self.rows = 0
+        self.pages = 0
+        self.decode_seconds = 0.0
+
+    def _page(self, start):
+        params = dict(
+            self.params, fields=self.fields, order_by=self.order_by,
+            limit_start=start, limit_page_length=self.page_size,
+        )
+        if self.filters is not None:
+            params['filters'] = self.filters
+        response = self.client.request('GET', self.doctype, background=self.background, params=params)
+        if response.status_code != 200:
+            raise requests.HTTPError(f'{response.status_code} from ERP', response=response)
+        started = time.perf_counter()
+        rows = response.json()['data']
+        return rows, time.perf_counter() - started
+
+    def __iter__(self):
+        pool = ThreadPoolExecutor(self.in_flight, thread_name_prefix='erp-pages')
+        pending = deque()
+        next_start = 0
+        try:
+            while True:
+                while len(pending) < self.in_flight:
+                    pending.append(pool.submit(self._page, next_start))
+                    next_start += self.page_size
+                rows, decode_seconds = pending.popleft().result()
+                self.pages += 1
+                self.rows += len(rows)
+                self.decode_seconds += decode_seconds
+                yield from rows
+                if len(rows) < self.page_size:
+                    return
+        finally:
+            # Pages past the end of the table come back empty; don't wait for them
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ERPResponse:
+    # The parts of requests.Response the service uses, for a fully read aiohttp reply
+    __slots__ = ('status_code', 'content')
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise ERPError(f'{self.status_code} from ERP')
+
+
+class ERPError(Exception):
+    pass
+
+
+class AsyncERPClient(ERPClient):
+    # Same configuration, retry policy and counters as ERPClient, on one aiohttp session
+    # for the ASGI serving mode; get_list() and insert() return awaitables here. Replies
+    # are read in full and returned as ERPResponse. Transport failures raise ERPError.
+    # Create the session from inside the event loop that will use it.
+
+    def __init__(self, pool_size=ERP_ASYNC_POOL_SIZE, **kwargs):
+        super().__init__(pool_size=pool_size, **kwargs)
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import aiohttp
+
+            self._client = aiohttp.ClientSession(
+                headers={'Authorization': f'token {self.token}'},
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1]),
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+        return self._client
+
+    async def request(self, method, doctype, background=False, **kwargs):
+        # Only the ASGI routes use this client, so every call is on the request path. The
+        # slots are those the process's sync client and background work draw on too.
+        if self._slots is not None and not await self._slots.acquire_async(self.queue_timeout):
+            self._busy(method, doctype)
+        try:
+            return await self._request(method, doctype, **kwargs)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    async def _request(self, method, doctype, **kwargs):
+        import aiohttp
+
+        if kwargs.get('headers') is None:
+            kwargs.pop('headers', None)
+        kwargs.pop('timeout', None)
+        attempts = self.retries + 1
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            started = time.perf_counter()
+            failed = True
+            try:
+                async with self.client.request(method, f'{self.base_url}api/resource/{doctype}', **kwargs) as reply:
+                    response = ERPResponse(reply.status, await reply.read())
+                failed = response.status_code >= 400
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # As with the sync client, POSTs are only retried if nothing was sent
+                if last or (method != 'GET' and not isinstance(e, aiohttp.ClientConnectorError)):
+                    raise ERPError(str(e) or type(e).__name__) from e
+            else:
+                if last or method != 'GET' or response.status_code not in (502, 503, 504):
+                    return response
+            finally:
+                self._record(method, doctype, time.perf_counter() - started, failed)
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+erp = ERPClient()
@@ -0,0 +1,275 @@
+import atexit
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextvars import ContextVar
+
+import metrics
+
+
+# Structured logging that never blocks the caller. A log call checks the level and the
+# request's sampling decision, then puts a tuple on a bounded queue. Everything else
+# happens on one writer thread: redaction, size caps, JSON encoding and the write to
+# stdout. When the queue is full, because the collector behind stdout has stalled, new
+# records are dropped and counted instead of holding up requests.
+#
+# Each record is one JSON line:
+#   {"ts": ..., "level": ..., "logger": ..., "event": ..., "request_id": ..., <fields>}
+# request_id is set for the length of each request (X-Request-ID from the client or
+# proxy, or a new one) and is echoed in the response. On the high-volume lookup routes,
+# only a sample of requests log below ERROR.
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'info').lower()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json, or text for reading on a terminal
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Longest string logged in any one field, and most items logged from a list or dict
+LOG_MAX_FIELD = int(os.environ.get('LOG_MAX_FIELD', 512))
+LOG_MAX_ITEMS = int(os.environ.get('LOG_MAX_ITEMS', 50))
+# Tracebacks get more room, and are cut from the front so the exception line is kept
+LOG_MAX_TRACEBACK = int(os.environ.get('LOG_MAX_TRACEBACK', 8192))
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+LOG_SAMPLED_ROUTES = set(filter(None, os.environ.get(
+    'LOG_SAMPLED_ROUTES',
+    '/search_serials,/get_issue_table,/get_serial_details,/get_serial_details_batch,/get_zonal_manager',
+).split(',')))
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+REDACTED = '[redacted]'
+# Fields that hold contact details, whatever their value looks like. Ticket text is
+# among them: the form puts the contact's name and phone number in description.
+PII_FIELDS = {'custom_contact_email', 'email', 'recipients', 'phone_number', 'contact_person_name',
+              'complaint_raised_by', 'customer_name', 'customer_address', 'description', 'complaint'}
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@([\w-]+\.[\w.-]+)')
+# Nine or more digits, optionally with +, spaces or dashes between them; dates and
+# serial numbers are shorter or glued to letters
+PHONE_PATTERN = re.compile(r'(?<![\w+])\+?\d(?:[ -]?\d){8,14}(?!\w)')
+REQUEST_ID_PATTERN = re.compile(r'[\w.-]{1,64}')
+
+RECORDS = metrics.counter('log_records_total', 'Log records written, by level.', ['level'])
+DROPPED = metrics.counter('log_records_dropped_total', 'Log records dropped because the log queue was full.')
+
+_context = ContextVar('log_context', default=(None, True))
+_level = LEVELS.get(LOG_LEVEL, INFO)
+_writer = None
+_setup_lock = threading.Lock()
+
+
+def redact(text):
+    text = EMAIL_PATTERN.sub(r'***@\1', text)
+    return PHONE_PATTERN.sub('[phone]', text)
+
+
+def cap(text):
+    if len(text) <= LOG_MAX_FIELD:
+        return text
+    return f'{text[:LOG_MAX_FIELD]}…[+{len(text) - LOG_MAX_FIELD} chars]'
+
+
+def cap_traceback(text):
+    if len(text) <= LOG_MAX_TRACEBACK:
+        return text
+    return f'[{len(text) - LOG_MAX_TRACEBACK} chars]…{text[-LOG_MAX_TRACEBACK:]}'
+
+
+def clean(value, depth=0):
+    # A JSON-safe, redacted and size-capped copy of a field value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return cap(redact(value))
+    if isinstance(value, BaseException):
+        return cap(redact(f'{type(value).__name__}: {value}'))
+    if depth >= 3:
+        return cap(redact(repr(value)))
+    if isinstance(value, dict):
+        items = list(value.items())
+        cleaned = {
+            str(key): REDACTED if key in PII_FIELDS else clean(item, depth + 1)
+            for key, item in items[:LOG_MAX_ITEMS]
+        }
+        if len(items) > LOG_MAX_ITEMS:
+            cleaned['…'] = f'+{len(items) - LOG_MAX_ITEMS} more'
+        return cleaned
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)
+        cleaned = [clean(item, depth + 1) for item in items[:LOG_MAX_ITEMS]]
+        if len(items) > LOG_MAX_ITEMS:
+            cleaned.append(f'…+{len(items) - LOG_MAX_ITEMS} more')
+        return cleaned
+    return cap(redact(str(value)))
+
+
+def entry(record):
+    created, level, logger, event, request_id, fields, exc_info = record
+    result = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(created)) + f'.{int(created % 1 * 1000):03d}Z',
+        'level': LEVEL_NAMES[level],
+        'logger': logger,
+        'event': event,
+    }
+    if request_id:
+        result['request_id'] = request_id
+    for key, value in fields.items():
+        result[key] = REDACTED if key in PII_FIELDS else clean(value)
+    if exc_info:
+        result['traceback'] = cap_traceback(redact(''.join(traceback.format_exception(*exc_info))))
+    return result
+
+
+def format_json(record):
+    return json.dumps(entry(record), ensure_ascii=False, default=str)
+
+
+def format_text(record):
+    fields = entry(record)
+    head = ' '.join(str(fields.pop(key)) for key in ('ts', 'level', 'logger', 'event'))
+    return ' '.join([head] + [f'{key}={json.dumps(value, ensure_ascii=False, default=str)}'
+                              for key, value in fields.items()])
+
+
+class LogWriter:
+    # Formats and writes queued records on its own thread, whatever is waiting in one go
+
+    def __init__(self, stream, formatter=format_json, queue_size=LOG_QUEUE_SIZE, batch_size=500):
+        self.stream = stream
+        self.formatter = formatter
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            DROPPED.inc()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        # Writes what is already queued first
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            dropped = self.dropped
+        return {'pending': self._queue.qsize(), 'capacity': self._queue.maxsize, 'dropped': dropped}
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is None:
+                    continue
+                try:
+                    lines.append(self.formatter(record))
+                except Exception as e:
+                    lines.append(json.dumps({'level': 'error', 'logger': 'log', 'event': 'format_failed',
+                                             'for': record[3], 'error': f'{type(e).__name__}: {e}'}))
+                RECORDS.inc(LEVEL_NAMES[record[1]])
+            try:
+                if lines:
+                    self.stream.write('\n'.join(lines) + '\n')
+                    self.stream.flush()
+            except (OSError, ValueError):
+                pass  # Nowhere left to say so
+            if batch[-1] is None:
+                return
+
+
+class Logger:
+    # debug/info/warning/error(event, **fields); event is a short snake_case name
+
+    def __init__(self, name):
+        self.name = name
+
+    def _log(self, level, event, fields, exc_info=None):
+        if level < _level:
+            return
+        request_id, keep = _context.get()
+        if not keep and level < ERROR:
+            return
+        _writer.put((time.time(), level, self.name, event, request_id, fields, exc_info))
+
+    def debug(self, event, **fields):
+        self._log(DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        # From an except block, with the traceback
+        self._log(ERROR, event, fields, exc_info=sys.exc_info())
+
+
+def get(name):
+    setup()
+    return Logger(name)
+
+
+def setup(stream=None, log_format=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE):
+    # Idempotent; later calls (from every module's get()) keep the first configuration
+    global _writer
+    with _setup_lock:
+        if _writer is not None:
+            return
+        _writer = LogWriter(sys.stdout if stream is None else stream,
+                            format_text if log_format == 'text' else format_json, queue_size)
+        _writer.start()
+        atexit.register(_writer.stop)
+
+
+def stats():
+    return _writer.stats()
+
+
+def request_id(header=None):
+    # The caller's X-Request-ID if it looks like one, otherwise a new one
+    if header and REQUEST_ID_PATTERN.fullmatch(header):
+        return header
+    return uuid.uuid4().hex[:16]
+
+
+def sampled(route):
+    return route not in LOG_SAMPLED_ROUTES or random.random() < LOG_SAMPLE_RATE
+
+
+def begin_request(header, route):
+    # -> (request id, token for end_request)
+    rid = request_id(header)
+    return rid, _context.set((rid, sampled(route)))
+
+
+def end_request(token):
+    _context.reset(token)
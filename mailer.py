@@ -0,0 +1,237 @@
+import heapq
+import itertools
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import log
+import metrics
+
+
+SMTP_SERVER = os.environ.get('SMTP_SERVER', "email.electrolabgroup.com")
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME', "econnect")
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', "Requ!reMent$")
+SMTP_EMAIL = os.environ.get('SMTP_EMAIL', "econnect@electrolabgroup.com")  # Sender email
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') not in ('', '0', 'false')
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 30))
+SMTP_SENDERS = int(os.environ.get('SMTP_SENDERS', 1))
+SMTP_BATCH_SIZE = int(os.environ.get('SMTP_BATCH_SIZE', 20))
+SMTP_MAX_ATTEMPTS = int(os.environ.get('SMTP_MAX_ATTEMPTS', 5))
+SMTP_RETRY_BACKOFF = float(os.environ.get('SMTP_RETRY_BACKOFF', 5))
+SMTP_KEEPALIVE = float(os.environ.get('SMTP_KEEPALIVE', 30))
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', 300))
+
+SMTP_SECONDS = metrics.histogram('smtp_seconds', 'SMTP connects and sends.', ['operation', 'outcome'])
+MAIL_EVENTS = metrics.counter('mail_events_total', 'Confirmation emails queued, sent, retried and failed.', ['event'])
+
+logger = log.get('mail')
+
+
+class _Message:
+    __slots__ = ('recipients', 'subject', 'html', 'attempts')
+
+    def __init__(self, recipients, subject, html):
+        self.recipients = list(recipients)
+        self.subject = subject
+        self.html = html
+        self.attempts = 0
+
+
+class MailQueue:
+    # Confirmation emails are queued by the request and delivered by sender threads.
+    # Each sender keeps one authenticated SMTP connection open, sends whatever is queued
+    # in batches over it, checks it with NOOP after a quiet spell, and reconnects on failure.
+    # Temporary failures are retried with exponential backoff; 5xx replies are dropped.
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 sender=SMTP_EMAIL, starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT, workers=SMTP_SENDERS,
+                 batch_size=SMTP_BATCH_SIZE, max_attempts=SMTP_MAX_ATTEMPTS, backoff=SMTP_RETRY_BACKOFF,
+                 keepalive=SMTP_KEEPALIVE, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.starttls = starttls
+        self.timeout = timeout
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue()
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self._stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'connects': 0}
+
+    def send(self, recipients, subject, html):
+        self._queue.put(_Message(recipients, subject, html))
+        self._count('queued')
+
+    def start(self):
+        if self._threads:
+            return
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'mail-sender-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10):
+        # Senders finish what is already queued (but not pending retries) before exiting
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, pending=self._queue.qsize())
+
+    def _count(self, key, n=1):
+        MAIL_EVENTS.inc(key, amount=n)
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def _connect(self):
+        started = time.perf_counter()
+        try:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                server.ehlo()  # Identify to mail server
+                if self.starttls:
+                    server.starttls()  # Secure the connection
+                    server.ehlo()
+                if self.username:
+                    server.login(self.username, self.password)
+            except Exception:
+                server.close()
+                raise
+        except Exception:
+            SMTP_SECONDS.observe(time.perf_counter() - started, 'connect', 'error')
+            raise
+        SMTP_SECONDS.observe(time.perf_counter() - started, 'connect', 'ok')
+        self._count('connects')
+        return server
+
+    def _sendmail(self, server, message):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            server.sendmail(self.sender, message.recipients, self._build(message))
+            outcome = 'ok'
+        finally:
+            SMTP_SECONDS.observe(time.perf_counter() - started, 'send', outcome)
+
+    def _build(self, message):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = ", ".join(message.recipients)
+        msg['Subject'] = message.subject
+        msg.attach(MIMEText(message.html, 'html'))
+        return msg.as_string()
+
+    def _run(self):
+        server = None
+        last_used = time.monotonic()
+        retries = []
+        seq = itertools.count()
+
+        while True:
+            now = time.monotonic()
+            while retries and retries[0][0] <= now:
+                self._queue.put(heapq.heappop(retries)[2])
+
+            wait = retries[0][0] - now if retries else self.idle_timeout
+            try:
+                message = self._queue.get(timeout=min(wait, self.idle_timeout))
+            except queue.Empty:
+                if server is not None and time.monotonic() - last_used >= self.idle_timeout:
+                    self._close(server)
+                    server = None
+                continue
+            if message is None:
+                break
+
+            batch = [message]
+            while len(batch) < self.batch_size:
+                try:
+                    message = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message is None:
+                    self._queue.put(None)
+                    break
+                batch.append(message)
+
+            for message in batch:
+                try:
+                    if server is not None and time.monotonic() - last_used >= self.keepalive:
+                        if server.noop()[0] != 250:
+                            raise smtplib.SMTPServerDisconnected('NOOP failed')
+                    if server is None:
+                        server = self._connect()
+                except Exception as e:
+                    # Connecting or logging in failed, whatever the reply (a 535 too); that
+                    # says nothing about this message, so it waits for the next attempt
+                    server = self._drop(server)
+                    self._retry(message, retries, seq, e)
+                    continue
+                try:
+                    self._sendmail(server, message)
+                    last_used = time.monotonic()
+                    self._count('sent')
+                    logger.debug('email_sent', subject=message.subject)
+                except smtplib.SMTPResponseException as e:
+                    if e.smtp_code >= 500:
+                        logger.error('email_rejected', recipients=message.recipients, error=e)
+                        self._count('failed')
+                        continue
+                    # 4xx: the session is still usable (a 421 shows up as a disconnect next time)
+                    self._retry(message, retries, seq, e)
+                except smtplib.SMTPRecipientsRefused as e:
+                    logger.error('email_refused', recipients=message.recipients, error=e)
+                    self._count('failed')
+                except (smtplib.SMTPException, OSError) as e:
+                    server = self._drop(server)
+                    self._retry(message, retries, seq, e)
+                except Exception as e:
+                    # This message can't be sent at all (e.g. an address smtplib can't
+                    # encode); the session may be mid-transaction, so start a new one
+                    logger.exception('email_unsendable', recipients=message.recipients)
+                    self._count('failed')
+                    server = self._drop(server)
+
+        if server is not None:
+            self._close(server)
+
+    def _retry(self, message, retries, seq, error):
+        message.attempts += 1
+        if message.attempts >= self.max_attempts:
+            logger.error('email_failed', recipients=message.recipients, attempts=message.attempts, error=error)
+            self._count('failed')
+            return
+        delay = self.backoff * 2 ** (message.attempts - 1)
+        logger.warning('email_retry', recipients=message.recipients, attempts=message.attempts, delay=delay, error=error)
+        heapq.heappush(retries, (time.monotonic() + delay, next(seq), message))
+        self._count('retried')
+
+    def _drop(self, server):
+        if server is not None:
+            try:
+                server.close()
+            except Exception:
+                pass
+        return None
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
@@ -0,0 +1,155 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# In-process counters and latency histograms, exported in the Prometheus text format on
+# /metrics. Each worker process keeps its own; scrape every worker (or sum them) as for
+# any multi-process Prometheus client. An observation is one lock and one bisect.
+#
+# While a request is being handled, timed sections also add up per name for that request
+# and come back in its Server-Timing header.
+
+PREFIX = 'service_desk_'
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# For background jobs (syncs, refreshes) that take seconds to minutes
+BACKGROUND_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+
+_spans = ContextVar('server_timing_spans', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f'{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues, span=None):
+        # Times the block; `span` also adds it to the current request's Server-Timing
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(elapsed, *labelvalues)
+            if span is not None:
+                add_span(span, elapsed)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labelvalues, list(counts), total, count)
+                            for labelvalues, (counts, total, count) in self._series.items())
+        for labelvalues, counts, total, count in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                le = bound if bound == '+Inf' else _number(float(bound))
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labelvalues, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labelvalues)} {count}')
+        return lines
+
+
+_metrics = []
+
+
+def counter(name, help, labelnames=()):
+    metric = Counter(name, help, labelnames)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, help, labelnames, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def begin_request():
+    return _spans.set({})
+
+
+def end_request(token):
+    _spans.reset(token)
+
+
+def add_span(name, seconds):
+    spans = _spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+def server_timing(total):
+    # Server-Timing header value: each span's total for this request, then the whole request
+    spans = _spans.get() or {}
+    parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in spans.items()]
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+HTTP_SECONDS = histogram('http_request_seconds', 'Time spent handling a request, by route.',
+                         ['method', 'route', 'status'])
@@ -0,0 +1,226 @@
+import hashlib
+import hmac
+import math
+import os
+import secrets
+import threading
+import time
+
+import metrics
+
+
+# One-time codes that show the customer can read the email address on the form.
+# Codes live in this process only. Addresses and codes are stored as keyed BLAKE2b
+# hashes under a per-process secret, so neither is kept in memory. Expiry is a timing wheel, so it
+# costs the same per code however many are outstanding. Behind several workers,
+# /send_otp and /verify_otp need sticky sessions, because only the issuing process
+# knows a code. What a correct code proves is the caller's to keep (the app puts it in
+# the client's session), so asking for a new code can't undo someone's verification.
+#
+# Wrong codes are counted per address, not per code, so asking for a new code doesn't
+# reset them. Every OTP_MAX_ATTEMPTS of them lock the address for OTP_LOCKOUT seconds,
+# doubling with each lockout up to OTP_MAX_LOCKOUT, and an address's failures are
+# remembered for OTP_FAILURE_MEMORY seconds.
+
+OTP_TTL = float(os.environ.get('OTP_TTL', 300))
+OTP_LENGTH = int(os.environ.get('OTP_LENGTH', 6))
+OTP_MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+OTP_RESEND_INTERVAL = float(os.environ.get('OTP_RESEND_INTERVAL', 30))
+OTP_LOCKOUT = float(os.environ.get('OTP_LOCKOUT', 300))
+OTP_MAX_LOCKOUT = float(os.environ.get('OTP_MAX_LOCKOUT', 86400))
+OTP_FAILURE_MEMORY = float(os.environ.get('OTP_FAILURE_MEMORY', 86400))
+# How long a verified address stays verified, to fill in and submit the form
+OTP_VERIFIED_TTL = float(os.environ.get('OTP_VERIFIED_TTL', 1800))
+# Addresses held at once, with a code or failures to remember, about 300 bytes each
+OTP_MAX_ENTRIES = int(os.environ.get('OTP_MAX_ENTRIES', 200000))
+OTP_WHEEL_TICK = float(os.environ.get('OTP_WHEEL_TICK', 1))
+
+OTP_EVENTS = metrics.counter('otp_events_total', 'One-time codes issued, verified, rejected and expired.', ['event'])
+
+VERIFIED = 'verified'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+
+class OTPUnavailable(Exception):
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TimingWheel:
+    # One slot per tick, covering `span` seconds. A key is filed with its deadline under
+    # the first tick at or after it, or the wheel's last slot for a deadline beyond that
+    # (the caller files it again when it comes up early). advance() empties the slots
+    # the clock has passed, so each filing is handled once, and nothing is scanned that
+    # isn't due.
+
+    def __init__(self, span, tick=OTP_WHEEL_TICK):
+        self.tick = tick
+        self._slots = [[] for _ in range(math.ceil(span / tick) + 2)]
+        self._current = math.floor(time.monotonic() / tick)
+
+    def schedule(self, key, deadline):
+        t = max(math.ceil(deadline / self.tick), self._current + 1)
+        t = min(t, self._current + len(self._slots) - 1)
+        self._slots[t % len(self._slots)].append((key, deadline))
+
+    def advance(self, now):
+        # -> the (key, deadline) filings that are due
+        target = math.floor(now / self.tick)
+        due = []
+        # After a gap longer than the wheel, every slot is due, once
+        for t in range(max(self._current + 1, target - len(self._slots) + 1), target + 1):
+            slot = t % len(self._slots)
+            if self._slots[slot]:
+                due.extend(self._slots[slot])
+                self._slots[slot] = []
+        self._current = max(self._current, target)
+        return due
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+
+class _Entry:
+    # One address. digest is that of the current code, None once it is used up by a
+    # lockout. A verified code keeps working until it expires, so a repeated check of
+    # the same code succeeds. expires is when the entry as a whole is forgotten.
+    __slots__ = ('digest', 'sent', 'code_expires', 'verified', 'attempts', 'lockouts', 'locked_until', 'expires')
+
+    def __init__(self):
+        self.digest = None
+        self.sent = 0.0
+        self.code_expires = 0.0
+        self.verified = False
+        self.attempts = 0
+        self.lockouts = 0
+        self.locked_until = 0.0
+        self.expires = 0.0
+
+
+class OTPStore:
+
+    def __init__(self, ttl=OTP_TTL, length=OTP_LENGTH, max_attempts=OTP_MAX_ATTEMPTS,
+                 resend_interval=OTP_RESEND_INTERVAL, lockout=OTP_LOCKOUT, max_lockout=OTP_MAX_LOCKOUT,
+                 failure_memory=OTP_FAILURE_MEMORY, max_entries=OTP_MAX_ENTRIES, tick=OTP_WHEEL_TICK):
+        self.ttl = ttl
+        self.length = length
+        self.max_attempts = max_attempts
+        self.resend_interval = resend_interval
+        self.lockout = lockout
+        self.max_lockout = max_lockout
+        self.failure_memory = failure_memory
+        self.max_entries = max_entries
+        self._secret = secrets.token_bytes(32)
+        self._entries = {}
+        # Failures are remembered for longer than a code lives; those entries go round again
+        self._wheel = TimingWheel(max(ttl, resend_interval), tick)
+        self._lock = threading.Lock()
+        self._stats = {'issued': 0, 'throttled': 0, 'full': 0, VERIFIED: 0, INVALID: 0, EXPIRED: 0, LOCKED: 0}
+
+    def _key(self, email):
+        return hashlib.blake2b(email.strip().lower().encode(), key=self._secret, digest_size=16).digest()
+
+    def _digest(self, key, code):
+        return hashlib.blake2b(key + code.strip().encode(), key=self._secret, digest_size=16).digest()
+
+    def _count(self, event):
+        OTP_EVENTS.inc(event)
+        self._stats[event] += 1
+
+    def _expire(self, now):
+        for key, deadline in self._wheel.advance(now):
+            entry = self._entries.get(key)
+            # A key is filed again whenever its deadline moves; only the latest filing counts
+            if entry is None or entry.expires != deadline:
+                continue
+            if deadline <= now:
+                del self._entries[key]
+            else:
+                self._wheel.schedule(key, deadline)
+
+    def _keep(self, key, entry, until):
+        # Holds on to the entry until at least `until`
+        if until > entry.expires:
+            entry.expires = until
+            self._wheel.schedule(key, until)
+
+    def _live(self, key, now):
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= now:
+            # Due within the current tick
+            del self._entries[key]
+            return None
+        return entry
+
+    def issue(self, email):
+        # -> a new code for `email`, replacing any earlier one. Raises OTPUnavailable if
+        # one was sent less than resend_interval ago, the address is locked, or the store
+        # is full.
+        key = self._key(email)
+        code = f'{secrets.randbelow(10 ** self.length):0{self.length}d}'
+        digest = self._digest(key, code)
+        with self._lock:
+            now = time.monotonic()
+            entry = self._live(key, now)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    self._count('full')
+                    raise OTPUnavailable('Too many codes outstanding', math.ceil(self.resend_interval))
+                entry = self._entries[key] = _Entry()
+            elif entry.locked_until > now:
+                self._count('throttled')
+                raise OTPUnavailable('Too many incorrect codes', math.ceil(entry.locked_until - now))
+            elif entry.sent + self.resend_interval > now:
+                self._count('throttled')
+                raise OTPUnavailable('A code was sent recently', math.ceil(entry.sent + self.resend_interval - now))
+            entry.digest = digest
+            entry.sent = now
+            entry.code_expires = now + self.ttl
+            entry.verified = False
+            self._keep(key, entry, entry.code_expires)
+            self._count('issued')
+        return code
+
+    def verify(self, email, code):
+        # -> VERIFIED, INVALID (try again), EXPIRED (no code) or LOCKED (too many attempts)
+        key = self._key(email)
+        digest = self._digest(key, code)
+        with self._lock:
+            now = time.monotonic()
+            entry = self._live(key, now)
+            if entry is None:
+                result = EXPIRED
+            elif entry.locked_until > now:
+                result = LOCKED
+            elif entry.digest is None or entry.code_expires <= now:
+                result = EXPIRED
+            elif hmac.compare_digest(entry.digest, digest):
+                entry.verified = True
+                entry.attempts = entry.lockouts = 0
+                result = VERIFIED
+            else:
+                # Even once the code has been used: a right guess now would verify the guesser
+                entry.attempts += 1
+                if entry.attempts >= self.max_attempts:
+                    entry.lockouts += 1
+                    entry.locked_until = now + min(self.max_lockout, self.lockout * 2 ** min(entry.lockouts - 1, 32))
+                    entry.attempts = 0
+                    entry.digest = None
+                    result = LOCKED
+                else:
+                    result = INVALID
+                self._keep(key, entry, max(now, entry.locked_until) + self.failure_memory)
+            self._count(result)
+        return result
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, outstanding=len(self._entries), max_entries=self.max_entries, ttl=self.ttl)
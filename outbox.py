@@ -0,0 +1,391 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+import log
+import metrics
+from erp_client import erp
+
+
+OUTBOX_PATH = os.environ.get(
+    'OUTBOX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outbox.sqlite3')
+)
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 4))
+OUTBOX_RETRY_BACKOFF = float(os.environ.get('OUTBOX_RETRY_BACKOFF', 5))
+OUTBOX_MAX_BACKOFF = float(os.environ.get('OUTBOX_MAX_BACKOFF', 300))
+OUTBOX_LEASE = float(os.environ.get('OUTBOX_LEASE', 300))
+# After a POST whose outcome is unknown, wait at least this long before looking it up,
+# so an insert the ERP is still working on has committed by then
+OUTBOX_UNCONFIRMED_DELAY = float(os.environ.get('OUTBOX_UNCONFIRMED_DELAY', 60))
+# Delivered entries are deleted this many days after submission; their payload, which
+# holds the contact's details, is dropped as soon as the ERP has the ticket
+OUTBOX_RETENTION_DAYS = float(os.environ.get('OUTBOX_RETENTION_DAYS', 30))
+PURGE_INTERVAL = 3600
+
+logger = log.get('outbox')
+REJECTED = metrics.counter('outbox_rejected_total', 'Submissions the ERP refused as invalid, by doctype.', ['doctype'])
+# Replies that can refuse the document itself. Any other error, such as 401/403 from an
+# expired or rotated API token, is about the request and is retried like a 5xx.
+REJECTION_STATUSES = {400, 409, 417, 422}
+# An entry is looked up in the ERP before every retry, so a POST that timed out after the
+# ERP committed it is not created twice. Set this to a custom field on Issue / Warranty
+# Claim to store the reference in and look it up by; otherwise the lookup matches the
+# fields below on documents created since the day before the submission, leaving out
+# any another entry was already matched to. (description is left out: the ERP cleans up
+# its HTML on save, and subject is its first characters.)
+OUTBOX_IDEMPOTENCY_FIELD = os.environ.get('OUTBOX_IDEMPOTENCY_FIELD', '')
+MATCH_FIELDS = {
+    'Issue': ('customer', 'custom_contact_email', 'serial_no', 'subject'),
+    'Warranty Claim': ('customer', 'custom_contact_email', 'serial_no', 'complaint_date'),
+}
+DEFAULT_MATCH_FIELDS = ('customer', 'custom_contact_email')
+# Replies after which the ERP may well have the document although it didn't say so; a
+# gateway can time out on an insert that then commits
+UNCONFIRMED_STATUSES = {502, 504}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    reference TEXT NOT NULL UNIQUE,
+    doctype TEXT NOT NULL,
+    customer TEXT,
+    email TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    claimed_at REAL,
+    created REAL NOT NULL,
+    erp_name TEXT,
+    last_error TEXT,
+    batch TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (status, next_attempt);
+CREATE INDEX IF NOT EXISTS outbox_customer ON outbox (customer, status);
+"""
+
+
+def rejection(response):
+    # The ERP's reason if it refused the document as invalid, otherwise None. Frappe
+    # describes such a refusal with exc_type / exception in the body.
+    if response.status_code not in REJECTION_STATUSES:
+        return None
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    return body.get('exception') or body.get('exc_type') or body.get('_server_messages') or None
+
+
+def not_sent(error):
+    # Whether a requests exception came before any of the request reached the ERP: no
+    # connection could be made (refused, or timed out while connecting)
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class UnknownOutcome(Exception):
+    # The POST may or may not have created the document
+    pass
+
+
+class OutboxEntry:
+    __slots__ = ('id', 'reference', 'doctype', 'customer', 'email', 'payload', 'attempts', 'created')
+
+    def __init__(self, row):
+        (self.id, self.reference, self.doctype, self.customer, self.email, payload, self.attempts,
+         self.created) = row
+        self.payload = json.loads(payload) if isinstance(payload, str) else payload
+
+
+class Outbox:
+    # SQLite journal of Issue / Warranty Claim submissions. A submission is committed
+    # locally and acknowledged with a provisional reference; worker threads then POST it
+    # to the ERP, retrying with backoff for as long as the ERP is unreachable. Only the
+    # oldest unfinished entry of a customer is eligible, so each customer's tickets reach
+    # the ERP in submission order. The exception is a batch from enqueue_batch(): its
+    # entries go out side by side, in no particular order among themselves (but after
+    # the customer's earlier tickets). Any number of processes can share one journal file.
+    #
+    # Statuses: pending (waiting for a worker), sending (claimed), unconfirmed (the last
+    # POST timed out or its reply couldn't be read, so the next attempt looks it up
+    # first), done and failed (rejected by the ERP).
+
+    def __init__(self, path=OUTBOX_PATH, workers=OUTBOX_WORKERS, on_delivered=None, on_rejected=None):
+        self.path = path
+        self.workers = workers
+        self.on_delivered = on_delivered
+        self.on_rejected = on_rejected
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._purged = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            if 'batch' not in {row[1] for row in conn.execute('PRAGMA table_info(outbox)')}:
+                # A journal from before batches
+                try:
+                    conn.execute('ALTER TABLE outbox ADD COLUMN batch TEXT')
+                except sqlite3.OperationalError:
+                    pass  # Another process got there first
+            conn.execute('CREATE INDEX IF NOT EXISTS outbox_batch ON outbox (batch) WHERE batch IS NOT NULL')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _new(self, payload):
+        reference = f'WEB-{uuid.uuid4().hex[:10].upper()}'
+        if OUTBOX_IDEMPOTENCY_FIELD:
+            payload = dict(payload, **{OUTBOX_IDEMPOTENCY_FIELD: reference})
+        return reference, payload
+
+    def enqueue(self, doctype, payload, customer=None, email=None):
+        reference, payload = self._new(payload)
+        now = time.time()
+        self._connect().execute(
+            'INSERT INTO outbox (reference, doctype, customer, email, payload, next_attempt, created) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (reference, doctype, customer, email, json.dumps(payload), now, now)
+        )
+        self._wakeup.set()
+        return reference
+
+    def enqueue_batch(self, items):
+        # Journals (doctype, payload, customer, email) items in one transaction, as one
+        # batch. -> (batch id, [reference of each item])
+        batch = f'BATCH-{uuid.uuid4().hex[:10].upper()}'
+        conn = self._connect()
+        now = time.time()
+        references = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for doctype, payload, customer, email in items:
+                reference, payload = self._new(payload)
+                conn.execute(
+                    'INSERT INTO outbox (reference, doctype, customer, email, payload, next_attempt, created, batch) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (reference, doctype, customer, email, json.dumps(payload), now, now, batch)
+                )
+                references.append(reference)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._wakeup.set()
+        return batch, references
+
+    def status(self, reference):
+        row = self._connect().execute(
+            'SELECT status, erp_name, attempts FROM outbox WHERE reference = ?', (reference,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'reference': reference, 'status': row[0], 'ticket': row[1], 'attempts': row[2]}
+
+    def batch_status(self, batch):
+        # -> status() of each entry of the batch, in order, or None for an unknown batch
+        rows = self._connect().execute(
+            'SELECT reference, status, erp_name, attempts FROM outbox WHERE batch = ? ORDER BY id', (batch,)
+        ).fetchall()
+        if not rows:
+            return None
+        return [{'reference': row[0], 'status': row[1], 'ticket': row[2], 'attempts': row[3]} for row in rows]
+
+    def stats(self):
+        # Unfinished and failed entries only, off the outbox_ready index; delivered ones
+        # are the bulk of the table
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) FROM outbox WHERE status IN ('pending', 'sending', 'unconfirmed', 'failed') "
+            "GROUP BY status"
+        ).fetchall()
+        return dict(rows)
+
+    def purge(self, retention_days=OUTBOX_RETENTION_DAYS):
+        # -> number of delivered entries deleted
+        cursor = self._connect().execute(
+            "DELETE FROM outbox WHERE status = 'done' AND created < ?", (time.time() - retention_days * 86400,)
+        )
+        return cursor.rowcount
+
+    def claim(self):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Entries stuck in 'sending' belong to a worker that died, maybe mid-POST
+            conn.execute(
+                "UPDATE outbox SET status = 'unconfirmed', attempts = attempts + 1 "
+                "WHERE status = 'sending' AND claimed_at < ?",
+                (now - OUTBOX_LEASE,)
+            )
+            row = conn.execute(
+                "SELECT id, reference, doctype, customer, email, payload, attempts, created FROM outbox o "
+                "WHERE status IN ('pending', 'unconfirmed') AND next_attempt <= ? AND NOT EXISTS ("
+                "  SELECT 1 FROM outbox p WHERE p.customer IS o.customer AND p.id < o.id"
+                "  AND p.status IN ('pending', 'sending', 'unconfirmed') AND (o.batch IS NULL OR p.batch IS NOT o.batch)"
+                ") ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?", (now, row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return OutboxEntry(row) if row else None
+
+    def _finish(self, entry, status, erp_name=None, error=None, delay=0):
+        self._connect().execute(
+            'UPDATE outbox SET status = ?, erp_name = ?, last_error = ?, attempts = ?, next_attempt = ?, '
+            "payload = CASE WHEN ? = 'done' THEN '{}' ELSE payload END WHERE id = ?",
+            (status, erp_name, error, entry.attempts + 1, time.time() + delay, status, entry.id)
+        )
+
+    def _existing(self, entry):
+        # The ERP's name for a document an earlier attempt created, if any
+        if OUTBOX_IDEMPOTENCY_FIELD:
+            filters = [[OUTBOX_IDEMPOTENCY_FIELD, '=', entry.reference]]
+        else:
+            filters = [
+                [field, '=', entry.payload[field]]
+                for field in MATCH_FIELDS.get(entry.doctype, DEFAULT_MATCH_FIELDS)
+                if entry.payload.get(field) is not None
+            ]
+            since = time.strftime('%Y-%m-%d', time.localtime(entry.created - 86400))
+            filters.append(['creation', '>=', since])
+        response = erp.get_list(
+            entry.doctype, '["name"]', filters=json.dumps(filters), order_by='creation asc',
+            limit_page_length=20, background=True,
+        )
+        response.raise_for_status()
+        names = [row['name'] for row in response.json().get('data', [])]
+        if not names or OUTBOX_IDEMPOTENCY_FIELD:
+            return names[0] if names else None
+        taken = {row[0] for row in self._connect().execute(
+            f"SELECT erp_name FROM outbox WHERE doctype = ? AND erp_name IN ({', '.join('?' * len(names))})",
+            [entry.doctype] + names
+        )}
+        return next((name for name in names if name not in taken), None)
+
+    def deliver(self, entry):
+        delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_RETRY_BACKOFF * 2 ** entry.attempts)
+        try:
+            erp_name = self._existing(entry) if entry.attempts else None
+            if erp_name is None:
+                erp_name = self._insert(entry)
+                if erp_name is None:
+                    return False
+        except UnknownOutcome as e:
+            delay = max(delay, OUTBOX_UNCONFIRMED_DELAY)
+            logger.warning('delivery_unconfirmed', reference=entry.reference, attempts=entry.attempts + 1,
+                           delay=delay, error=e)
+            self._finish(entry, 'unconfirmed', error=str(e), delay=delay)
+            return False
+        except (requests.RequestException, ValueError) as e:
+            # Including a failed lookup, which leaves the entry unsent
+            logger.warning('delivery_failed', reference=entry.reference, attempts=entry.attempts + 1, delay=delay,
+                           error=e)
+            self._finish(entry, 'pending', error=str(e), delay=delay)
+            return False
+
+        self._finish(entry, 'done', erp_name=erp_name)
+        if self.on_delivered is not None:
+            try:
+                self.on_delivered(entry, erp_name)
+            except Exception as e:
+                logger.exception('post_delivery_failed', reference=entry.reference)
+        return True
+
+    def _insert(self, entry):
+        # -> the new document's name, or None if the ERP rejected it. Raises UnknownOutcome
+        # when the ERP may have created it without saying so, RequestException when it
+        # didn't and the entry should be retried.
+        try:
+            response = erp.insert(
+                entry.doctype, entry.payload, headers={'Idempotency-Key': entry.reference}, background=True
+            )
+        except requests.RequestException as e:
+            if not_sent(e):
+                raise
+            # The request may have been sent in full before the timeout or reset
+            raise UnknownOutcome(f'{type(e).__name__}: {e}')
+        if not response.ok:
+            # Only a failed reply's body is logged; a created document echoes the contact's details
+            logger.warning('erp_error_response', reference=entry.reference, doctype=entry.doctype,
+                           status=response.status_code, body=response.text)
+        if response.status_code in UNCONFIRMED_STATUSES:
+            raise UnknownOutcome(f'{response.status_code} from ERP')
+        if not response.ok:
+            reason = rejection(response)
+            if reason is None:
+                if response.status_code in (401, 403):
+                    logger.error('erp_auth_failed', reference=entry.reference, status=response.status_code)
+                raise requests.HTTPError(f'{response.status_code} from ERP')
+            # The ERP rejected the document itself; retrying will not help
+            self._reject(entry, response.status_code, reason)
+            return None
+        try:
+            erp_name = response.json()['data']['name']
+        except (ValueError, KeyError, TypeError):
+            logger.warning('erp_error_response', reference=entry.reference, doctype=entry.doctype,
+                           status=response.status_code, body=response.text)
+            raise UnknownOutcome(f'{response.status_code} from ERP without a document name')
+        logger.info('erp_response', reference=entry.reference, doctype=entry.doctype, status=response.status_code,
+                    erp_name=erp_name)
+        return erp_name
+
+    def _reject(self, entry, status, reason):
+        self._finish(entry, 'failed', error=f'{status}: {reason[:1000]}')
+        REJECTED.inc(entry.doctype)
+        logger.error('erp_rejected', reference=entry.reference, doctype=entry.doctype, status=status, reason=reason)
+        if self.on_rejected is not None:
+            try:
+                self.on_rejected(entry, reason)
+            except Exception:
+                logger.exception('post_rejection_failed', reference=entry.reference)
+
+    def start(self):
+        if self._threads:
+            return
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            if time.time() - self._purged > PURGE_INTERVAL:
+                self._purged = time.time()
+                try:
+                    purged = self.purge()
+                    if purged:
+                        logger.info('outbox_purged', entries=purged)
+                except sqlite3.Error as e:
+                    logger.error('purge_failed', error=e)
+            try:
+                entry = self.claim()
+            except sqlite3.Error as e:
+                logger.error('claim_failed', error=e)
+                entry = None
+            if entry is None:
+                # Other processes' submissions are picked up on the next poll
+                self._wakeup.wait(1)
+                self._wakeup.clear()
+                continue
+            self.deliver(entry)
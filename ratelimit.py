@@ -0,0 +1,184 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+# Token buckets per (route, client IP) in front of the ERP-backed, OTP and import routes. Each bucket
+# holds up to `burst` tokens and refills at `rate` per second; a request takes one or
+# is answered 429 with Retry-After. Buckets live in a backend:
+#   memory  this process only (the default)
+#   sqlite  one file shared by every worker process on the host, like the outbox
+#   off     no limiting
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_PATH = os.environ.get(
+    'RATE_LIMIT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ratelimit.sqlite3')
+)
+# route=rate/burst, comma separated
+RATE_LIMITS = os.environ.get(
+    'RATE_LIMITS',
+    '/search_serials=5/20,/get_issue_table=2/10,/get_serial_details=2/10,/get_serial_details_batch=0.5/5,'
+    '/send_otp=0.1/3,/verify_otp=0.5/10,/bulk_import=0.05/3',
+)
+# Use the first X-Forwarded-For address as the client; only behind a proxy that sets it
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', '') not in ('', '0', 'false')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+LIMITED = metrics.counter('rate_limited_total', 'Requests answered 429 by the rate limiter.', ['route'])
+
+
+def parse_limits(spec):
+    limits = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        route, _, rule = item.partition('=')
+        rate, _, burst = rule.partition('/')
+        limits[route.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+def refill(tokens, updated, now, rate, burst):
+    # -> (tokens after taking one or None if empty, seconds until one is available)
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return None, (1 - tokens) / rate
+
+
+class MemoryBackend:
+    # Buckets in least recently used order. Past max_keys, each new bucket evicts the
+    # least recently used one, which is most likely full again already (the same as no
+    # bucket) and otherwise belongs to the client that has gone quietest.
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens, updated = burst, now
+            else:
+                tokens, updated = bucket
+                # A refused request counts as use too, so a client being limited isn't evicted
+                self._buckets.move_to_end(key)
+            left, wait = refill(tokens, updated, now, rate, burst)
+            if left is None:
+                return wait
+            self._buckets[key] = (left, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS buckets (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL,
+        full_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at);
+    """
+
+    def __init__(self, path=RATE_LIMIT_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._new_keys = 0
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            left, wait = refill(tokens, updated, now, rate, burst)
+            if left is not None:
+                conn.execute(
+                    'INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                    (key, left, now, now + (burst - left) / rate)
+                )
+                if row is None:
+                    self._new_keys += 1
+                    if self._new_keys % 1000 == 0:
+                        # A bucket that has refilled completely is the same as no row
+                        conn.execute('DELETE FROM buckets WHERE full_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM buckets').fetchone()[0]
+
+
+def make_backend(name=RATE_LIMIT_BACKEND):
+    if name == 'off':
+        return None
+    if name == 'sqlite':
+        return SQLiteBackend()
+    if name == 'memory':
+        return MemoryBackend()
+    raise ValueError(f'Unknown RATE_LIMIT_BACKEND {name!r}')
+
+
+class RateLimiter:
+
+    def __init__(self, backend, limits=None, trust_forwarded=RATE_LIMIT_TRUST_FORWARDED):
+        self.backend = backend
+        self.limits = parse_limits(RATE_LIMITS) if limits is None else limits
+        self.trust_forwarded = trust_forwarded
+        self.allowed = 0
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def client(self, remote_addr, forwarded_for=None):
+        if self.trust_forwarded and forwarded_for:
+            return forwarded_for.split(',')[0].strip()
+        return remote_addr or 'unknown'
+
+    def check(self, route, client):
+        # Seconds to wait before retrying, or None if the request may go ahead
+        limit = self.limits.get(route)
+        if limit is None or self.backend is None:
+            return None
+        wait = self.backend.take(f'{route}|{client}', limit[0], limit[1], time.time())
+        with self._lock:
+            if not wait:
+                self.allowed += 1
+                return None
+            self.limited += 1
+        LIMITED.inc(route)
+        return max(1, math.ceil(wait))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__ if self.backend else None,
+                'limits': {route: {'rate': rate, 'burst': burst} for route, (rate, burst) in self.limits.items()},
+                'allowed': self.allowed,
+                'limited': self.limited,
+            }
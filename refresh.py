@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+import log
+import metrics
+
+
+REFRESH_SECONDS = metrics.histogram('refresh_seconds', 'Background rebuilds of shared lookup tables.',
+                                    ['name', 'outcome'], buckets=metrics.BACKGROUND_BUCKETS)
+
+logger = log.get('refresh')
+
+
+class Version(namedtuple('Version', ['number', 'loaded_at', 'data'])):
+    __slots__ = ()
+
+    @property
+    def age(self):
+        return time.time() - self.loaded_at
+
+
+class RefreshingValue:
+    # Holds the last good result of `loader` as an immutable Version and rebuilds it
+    # off the request path. Readers grab `current` once and use that version for the
+    # whole request; a failed or still-running rebuild never replaces it.
+
+    def __init__(self, name, loader, interval, retry_interval=60):
+        self.name = name
+        self.loader = loader
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.current = None
+        self.last_error = None
+        self.last_attempt = None
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def refresh(self):
+        with self._refresh_lock:
+            self.last_attempt = time.time()
+            error = 'loader returned no data'
+            started = time.perf_counter()
+            try:
+                data = self.loader()
+            except Exception as e:
+                data = None
+                error = str(e)
+            REFRESH_SECONDS.observe(time.perf_counter() - started, self.name, 'error' if data is None else 'ok')
+            if data is None:
+                self.last_error = error
+                logger.warning('refresh_failed', name=self.name, error=error)
+                return False
+
+            self.publish(data)
+            self.last_error = None
+            return True
+
+    def publish(self, data):
+        if data is None or (self.current is not None and data is self.current.data):
+            return
+        # Snapshot-backed data carries its own version so every worker reports the same one
+        number = getattr(data, 'version', None) or (self.current.number + 1 if self.current else 1)
+        loaded_at = getattr(data, 'created_at', None) or time.time()
+        if isinstance(data, dict):
+            data = MappingProxyType(data)
+        self.current = Version(number, loaded_at, data)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'refresh-{self.name}', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            ok = self.refresh()
+            self._stop.wait(self.interval if ok else self.retry_interval)
+
+    def status(self):
+        version = self.current
+        return {
+            'name': self.name,
+            'version': version.number if version else None,
+            'age': round(version.age, 3) if version else None,
+            'last_error': self.last_error,
+        }
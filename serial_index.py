@@ -0,0 +1,227 @@
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+import requests
+
+import log
+from erp_client import erp
+
+
+SERIAL_INDEX_REFRESH_INTERVAL = int(os.environ.get('SERIAL_INDEX_REFRESH_INTERVAL', 60))
+SERIAL_INDEX_FULL_INTERVAL = int(os.environ.get('SERIAL_INDEX_FULL_INTERVAL', 6 * 3600))
+
+logger = log.get('serial_index')
+
+SERIAL_FIELDS = '["name", "item_name", "item_code", "customer_instrument_id", "customer", "custom_amc_type_name", "modified"]'
+GRAM = 3
+
+
+class SerialRecord:
+    __slots__ = ('serial_no', 'item_name', 'item_code', 'customer_instrument_id', 'customer', 'amc_type')
+
+    def __init__(self, row):
+        # Item, customer and AMC values repeat across thousands of serials; share one copy
+        self.serial_no = row.get('name')
+        self.item_name = _intern(row.get('item_name'))
+        self.item_code = _intern(row.get('item_code'))
+        self.customer_instrument_id = row.get('customer_instrument_id')
+        self.customer = _intern(row.get('customer'))
+        self.amc_type = _intern(row.get('custom_amc_type_name'))
+
+    def as_dict(self):
+        return {
+            'serial_no': self.serial_no,
+            'item_name': self.item_name,
+            'item_code': self.item_code,
+            'customer_instrument_id': self.customer_instrument_id,
+            'customer': self.customer,
+            'amc_type': self.amc_type,
+        }
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _grams(text, n=GRAM):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _all_grams(text):
+    # Trigrams, plus every one- and two-character substring, so that a term shorter
+    # than a trigram has its exact hit list too instead of a scan over every name
+    grams = _grams(text)
+    for n in range(1, GRAM):
+        grams.update(_grams(text, n))
+    return grams
+
+
+class _State:
+    # records[i] is None once a serial loses its customer; its id stays in the
+    # postings and is skipped at query time until the next full rebuild compacts it.
+
+    def __init__(self):
+        self.records = []
+        self.lower = []
+        self.ids = {}
+        self.by_name = []
+        self.postings = {}
+        self.high_water = ''
+        self.live = 0
+
+    def apply(self, row, keep_sorted=True):
+        name = row.get('name')
+        if not name:
+            return
+        record = SerialRecord(row) if row.get('customer') else None
+        modified = row.get('modified') or ''
+        if modified > self.high_water:
+            self.high_water = modified
+
+        i = self.ids.get(name)
+        if i is not None:
+            self.live += (record is not None) - (self.records[i] is not None)
+            self.records[i] = record
+            return
+        if record is None:
+            return
+
+        self.live += 1
+        i = len(self.records)
+        lower = name.lower()
+        self.records.append(record)
+        self.lower.append(lower)
+        self.ids[name] = i
+        if keep_sorted:
+            insort(self.by_name, (lower, i))
+        else:
+            self.by_name.append((lower, i))
+        for gram in _all_grams(lower):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('I')
+            posting.append(i)
+
+
+class SerialIndex:
+    # In-process index over Serial No records that have a customer, matching the ERP's
+    # case-insensitive `like %term%`. Prefix hits come from a sorted name list, substring
+    # hits from trigram postings (id arrays) verified against the lower-cased name. Terms
+    # of one or two characters have postings of their own, which are exact.
+    # The full table is loaded once; after that only rows with a newer `modified` are pulled.
+
+    def __init__(self, refresh_interval=SERIAL_INDEX_REFRESH_INTERVAL, full_interval=SERIAL_INDEX_FULL_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.full_interval = full_interval
+        self.loaded_at = None
+        self.updated_at = None
+        self._state = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._state is not None
+
+    def __len__(self):
+        state = self._state
+        return state.live if state else 0
+
+    def load(self):
+        state = _State()
+        try:
+            for row in erp.iter_list('Serial No', SERIAL_FIELDS, filters='[["customer","is","set"]]'):
+                state.apply(row, keep_sorted=False)
+        except (requests.RequestException, ValueError) as e:
+            logger.error('sync_failed', builder='SerialIndex', mode='full', error=e)
+            return False
+        state.by_name.sort()
+        with self._lock:
+            self._state = state
+            self.loaded_at = self.updated_at = time.time()
+        return True
+
+    def update(self):
+        state = self._state
+        if state is None:
+            return self.load()
+
+        # `>=` so rows sharing the high-water timestamp are not lost; re-applying is harmless.
+        # In the default `modified desc` order, as for the full pull; see PagedRows.
+        try:
+            rows = list(erp.iter_list(
+                'Serial No', SERIAL_FIELDS,
+                filters=f'[["modified", ">=", "{state.high_water}"]]',
+            ))
+        except (requests.RequestException, ValueError) as e:
+            logger.error('sync_failed', builder='SerialIndex', mode='delta', error=e)
+            return False
+
+        with self._lock:
+            if state is self._state:
+                for row in rows:
+                    state.apply(row)
+                self.updated_at = time.time()
+        return True
+
+    def search(self, term, limit):
+        return [record.serial_no for record in self._match(term, limit)]
+
+    def search_records(self, term, limit):
+        return list(self._match(term, limit))
+
+    def _match(self, term, limit):
+        state = self._state
+        if state is None or limit <= 0:
+            return
+        term = term.lower()
+        records = state.records
+        seen = set()
+
+        # Prefix matches first, in name order
+        by_name = state.by_name
+        pos = bisect_left(by_name, (term,))
+        while pos < len(by_name) and by_name[pos][0].startswith(term):
+            i = by_name[pos][1]
+            pos += 1
+            record = records[i]
+            if record is not None:
+                seen.add(i)
+                yield record
+                if len(seen) >= limit:
+                    return
+
+        # Then other substring matches, checked against the shortest posting list
+        if len(term) >= GRAM:
+            candidates = min((state.postings.get(g, ()) for g in _grams(term)), key=len)
+        else:
+            candidates = state.postings.get(term, ())
+        lower = state.lower
+        for i in candidates:
+            if i not in seen and term in lower[i]:
+                record = records[i]
+                if record is not None:
+                    seen.add(i)
+                    yield record
+                    if len(seen) >= limit:
+                        return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='serial-index', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self.loaded_at is None or time.time() - self.loaded_at >= self.full_interval:
+                    self.load()
+                else:
+                    self.update()
+            except Exception as e:
+                logger.exception('serial_index_refresh_failed')
+            time.sleep(self.refresh_interval)
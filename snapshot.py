@@ -0,0 +1,233 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import log
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines run a single process anyway
+    fcntl = None
+
+
+SNAPSHOT_DIR = os.environ.get(
+    'SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+)
+SNAPSHOT_READ_ONLY = os.environ.get('SNAPSHOT_READ_ONLY', '') not in ('', '0', 'false')
+
+logger = log.get('snapshot')
+
+# File layout (little endian):
+#   header   magic, version, created_at, entry count, distinct value count
+#   entries  (key offset, key length, value id) sorted by key bytes
+#   values   (offset, length) per distinct value
+#   blob     utf-8 keys and values
+MAGIC = b'SDSNAP01'
+HEADER = struct.Struct('<8sQdII')
+ENTRY = struct.Struct('<III')
+VALUE = struct.Struct('<II')
+CREATED_AT = struct.Struct('<d')
+CREATED_AT_OFFSET = 16
+
+# A build may return this instead of a mapping when nothing changed since its last one
+UNCHANGED = object()
+
+
+class SnapshotMap(Mapping):
+    # Read-only str -> str mapping backed by a memory-mapped snapshot file, so every
+    # worker on the host shares the same page cache instead of holding its own dict.
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.created_at, self._count, n_values = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        self._entries = HEADER.size
+        self._values = self._entries + self._count * ENTRY.size
+
+    def _key(self, i):
+        offset, length, value_id = ENTRY.unpack_from(self._mm, self._entries + i * ENTRY.size)
+        return self._mm[offset:offset + length], value_id
+
+    def _value(self, value_id):
+        offset, length = VALUE.unpack_from(self._mm, self._values + value_id * VALUE.size)
+        return self._mm[offset:offset + length].decode('utf-8')
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        target = key.encode('utf-8')
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count:
+            found, value_id = self._key(lo)
+            if found == target:
+                return self._value(value_id)
+        raise KeyError(key)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._key(i)[0].decode('utf-8')
+
+    def __len__(self):
+        return self._count
+
+
+def write_snapshot(path, mapping, version):
+    items = sorted(
+        (str(k).encode('utf-8'), str(v))
+        for k, v in mapping.items()
+        if k is not None and v is not None and v == v  # skip NaN from pandas
+    )
+    value_ids = {}
+    for _, value in items:
+        value_ids.setdefault(value, len(value_ids))
+
+    blob_start = HEADER.size + len(items) * ENTRY.size + len(value_ids) * VALUE.size
+    blob = bytearray()
+    entries = bytearray()
+    for key, value in items:
+        entries += ENTRY.pack(blob_start + len(blob), len(key), value_ids[value])
+        blob += key
+    values = bytearray()
+    for value in value_ids:
+        encoded = value.encode('utf-8')
+        values += VALUE.pack(blob_start + len(blob), len(encoded))
+        blob += encoded
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, version, time.time(), len(items), len(value_ids)))
+        f.write(entries)
+        f.write(values)
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers keep their mapping of the old inode until they reopen
+    os.replace(tmp_path, path)
+
+
+def touch_snapshot(path):
+    # Marks the snapshot as rebuilt without rewriting it; readers see the new mtime and reopen
+    with open(path, 'r+b') as f:
+        f.seek(CREATED_AT_OFFSET)
+        f.write(CREATED_AT.pack(time.time()))
+
+
+@contextmanager
+def _writer_lock(path, blocking):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+b') as f:
+        acquired = True
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired and fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SnapshotStore:
+    # One snapshot file per lookup table. Whichever process holds the lock file rebuilds
+    # a stale snapshot from the ERP; everyone else keeps reading the current file and
+    # picks up the new one when its inode changes.
+
+    def __init__(self, name, build, max_age, directory=None, read_only=SNAPSHOT_READ_ONLY):
+        self.name = name
+        self.build = build
+        self.max_age = max_age
+        self.read_only = read_only
+        self.path = os.path.join(directory or SNAPSHOT_DIR, f'{name}.snap')
+        self._opened = None
+        self._written = None
+
+    def open(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._opened is None or self._opened[0] != stamp:
+            try:
+                self._opened = (stamp, SnapshotMap(self.path))
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning('snapshot_open_failed', path=self.path, error=e)
+                return None
+        return self._opened[1]
+
+    def is_fresh(self, data):
+        return data is not None and time.time() - data.created_at < self.max_age
+
+    def load(self):
+        data = self.open()
+        if self.read_only or self.is_fresh(data):
+            return data
+
+        # Without any snapshot, wait for the current writer rather than pulling the ERP too
+        with _writer_lock(self.path + '.lock', blocking=data is None) as acquired:
+            if not acquired:
+                return data
+            data = self.open()
+            if self.is_fresh(data):
+                return data
+            built = self.build()
+            if built is None:
+                return None
+            if built is UNCHANGED:
+                if self._written is None:
+                    return data
+                if data is not None and data.version == self._written[0]:
+                    touch_snapshot(self.path)
+                    return self.open()
+                # Another process wrote in between; put this process's current mapping back
+                built = self._written[1]
+            version = data.version + 1 if data else 1
+            write_snapshot(self.path, built, version)
+            self._written = (version, built)
+            return self.open()
+
+
+def main():
+    # Dedicated writer: run this from cron or a sidecar and start the web workers
+    # with SNAPSHOT_READ_ONLY=1 so they never talk to the ERP for these tables.
+    from address_index import AddressSync, ADDRESS_SNAPSHOT
+    from zonal_map import ZonalMapSync, ZONAL_MAP_SNAPSHOT
+
+    parser = argparse.ArgumentParser(description='Rebuild the lookup table snapshots from the ERP.')
+    parser.add_argument('--loop', type=int, default=0, help='rebuild every N seconds instead of once')
+    args = parser.parse_args()
+
+    stores = [
+        SnapshotStore(ZONAL_MAP_SNAPSHOT, ZonalMapSync(), 0, read_only=False),
+        SnapshotStore(ADDRESS_SNAPSHOT, AddressSync(), 0, read_only=False),
+    ]
+    while True:
+        for store in stores:
+            started = time.time()
+            data = store.load()
+            if data is None:
+                print(f"{store.name}: rebuild failed")
+            else:
+                print(f"{store.name}: version {data.version}, {len(data)} entries in {time.time() - started:.1f}s")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == '__main__':
+    main()
@@ -32,48 +32,142 @@ document.addEventListener("DOMContentLoaded", function () {
     fetchAndProcess(serialNo);
   }
 
-  // Function to fetch serial number suggestions
-  function fetchSuggestions(query) {
+  // Serial typeahead: input is debounced, a newer query aborts the request for an older
+  // one, and answers are cached per query. /search_serials returns at most
+  // SUGGESTION_LIMIT matches, so a shorter answer is the complete match set and any
+  // longer query that extends it is filtered locally instead of asking the server.
+  const SUGGESTION_LIMIT = 10;
+  const SUGGESTION_DEBOUNCE_MS = 250;
+  const SUGGESTION_CACHE_TTL_MS = 5 * 60 * 1000;
+  const SUGGESTION_CACHE_SIZE = 200;
+  const suggestionCache = new Map(); // lower-cased query -> {serials, at}
+  let suggestionTimer = null;
+  let suggestionRequest = null;
+  let latestQuery = "";
+
+  function cachedSuggestions(query) {
+    const key = query.toLowerCase();
+    const now = Date.now();
+    for (let length = key.length; length >= 2; length--) {
+      const prefix = key.slice(0, length);
+      const entry = suggestionCache.get(prefix);
+      if (!entry) {
+        continue;
+      }
+      if (now - entry.at > SUGGESTION_CACHE_TTL_MS) {
+        suggestionCache.delete(prefix);
+        continue;
+      }
+      if (length === key.length) {
+        return entry.serials;
+      }
+      if (entry.serials.length < SUGGESTION_LIMIT) {
+        // Same order as the server: prefix matches first, then other substring matches
+        const matches = entry.serials.filter((serial) => serial.toLowerCase().includes(key));
+        const starts = matches.filter((serial) => serial.toLowerCase().startsWith(key));
+        const others = matches.filter((serial) => !serial.toLowerCase().startsWith(key));
+        starts.sort((a, b) => (a.toLowerCase() < b.toLowerCase() ? -1 : a.toLowerCase() > b.toLowerCase() ? 1 : 0));
+        return starts.concat(others);
+      }
+    }
+    return null;
+  }
+
+  function rememberSuggestions(query, serials) {
+    const key = query.toLowerCase();
+    suggestionCache.delete(key);
+    suggestionCache.set(key, { serials: serials, at: Date.now() });
+    // Maps iterate in insertion order, so the first key is the least recently stored
+    while (suggestionCache.size > SUGGESTION_CACHE_SIZE) {
+      suggestionCache.delete(suggestionCache.keys().next().value);
+    }
+  }
+
+  function cancelSuggestions() {
+    clearTimeout(suggestionTimer);
+    suggestionTimer = null;
+    if (suggestionRequest) {
+      suggestionRequest.abort();
+      suggestionRequest = null;
+    }
+  }
+
+  // Called on every keystroke; only the query typed last is looked up
+  function scheduleSuggestions(query) {
+    latestQuery = query;
+    cancelSuggestions();
     if (query.length < 2) {
       suggestionBox.style.display = "none";
       return;
     }
+    const cached = cachedSuggestions(query);
+    if (cached) {
+      renderSuggestions(cached);
+      return;
+    }
+    suggestionTimer = setTimeout(() => fetchSuggestions(query), SUGGESTION_DEBOUNCE_MS);
+  }
 
-    fetch(`/search_serials?query=${encodeURIComponent(query)}`)
-      .then((response) => response.json())
+  // Function to fetch serial number suggestions
+  function fetchSuggestions(query) {
+    const controller = new AbortController();
+    suggestionRequest = controller;
+
+    fetch(`/search_serials?query=${encodeURIComponent(query)}`, { signal: controller.signal })
+      .then((response) => (response.ok ? response.json() : null))
       .then((data) => {
-        suggestionBox.innerHTML = "";
-        if (data.length === 0) {
-          suggestionBox.style.display = "none";
+        if (suggestionRequest === controller) {
+          suggestionRequest = null;
+        }
+        // 429/503 replies carry an error object, not a list; show and keep nothing
+        if (!Array.isArray(data)) {
           return;
         }
-
-        data.forEach((serial) => {
-          const item = document.createElement("div");
-          item.textContent = serial;
-          item.style.padding = "8px";
-          item.style.cursor = "pointer";
-
-          item.addEventListener("mouseover", function() {
-            this.style.backgroundColor = "#e0e0e0"; // Grey color on hover
-          });
-          item.addEventListener("mouseout", function() {
-            this.style.backgroundColor = "white";
-          });
-          
-          item.addEventListener("click", function () {
-            serialInput.value = serial;
-            suggestionBox.style.display = "none";
-            // Do not auto-trigger fetchAndProcess here so selection doesn't immediately redirect
-          });
-          suggestionBox.appendChild(item);
-        });
-
-        suggestionBox.style.display = "block";
+        // The server also answers [] when the ERP couldn't be asked, so an empty list
+        // isn't kept: as a prefix it would hide the suggestions for every longer query
+        if (data.length > 0) {
+          rememberSuggestions(query, data);
+        }
+        if (query === latestQuery) {
+          renderSuggestions(data);
+        }
       })
       .catch((error) => {
-        console.error("Error fetching serials:", error);
+        if (error.name !== "AbortError") {
+          console.error("Error fetching serials:", error);
+        }
+      });
+  }
+
+  function renderSuggestions(data) {
+    suggestionBox.innerHTML = "";
+    if (data.length === 0) {
+      suggestionBox.style.display = "none";
+      return;
+    }
+
+    data.forEach((serial) => {
+      const item = document.createElement("div");
+      item.textContent = serial;
+      item.style.padding = "8px";
+      item.style.cursor = "pointer";
+
+      item.addEventListener("mouseover", function() {
+        this.style.backgroundColor = "#e0e0e0"; // Grey color on hover
       });
+      item.addEventListener("mouseout", function() {
+        this.style.backgroundColor = "white";
+      });
+      
+      item.addEventListener("click", function () {
+        serialInput.value = serial;
+        suggestionBox.style.display = "none";
+        // Do not auto-trigger fetchAndProcess here so selection doesn't immediately redirect
+      });
+      suggestionBox.appendChild(item);
+    });
+
+    suggestionBox.style.display = "block";
   }
 
   // Function to display an error dialog
@@ -186,7 +280,7 @@ document.addEventListener("DOMContentLoaded", function () {
   // Attach event listener for serial number input
   serialInput.addEventListener("input", function () {
     const query = serialInput.value.trim();
-    fetchSuggestions(query);
+    scheduleSuggestions(query);
   });
 
   serialInput.addEventListener("keypress", function (e) {
@@ -195,6 +289,8 @@ document.addEventListener("DOMContentLoaded", function () {
       if (query) {
         fetchAndProcess(query); // Process on Enter key as well
       }
+      latestQuery = "";
+      cancelSuggestions();
       serialInput.blur();
       suggestionBox.style.display = "none";
     }
@@ -213,3 +309,84 @@ document.addEventListener("DOMContentLoaded", function () {
     }, 500);
   }
 });
+
+
+// Email verification, on pages that ask for it: send a one-time code to the contact
+// address, then check what the customer types in.
+document.addEventListener("DOMContentLoaded", function () {
+  const sendOtpButton = document.getElementById("sendOtpButton");
+  if (!sendOtpButton) {
+    return;
+  }
+  const emailInput = document.getElementById("custom_contact_email");
+  const otpContainer = document.getElementById("otpContainer");
+  const otpInput = document.getElementById("otp");
+  const verifyOtpButton = document.getElementById("verifyOtpButton");
+  const otpStatus = document.getElementById("otpStatus");
+
+  function postOtpForm(url, fields) {
+    const formData = new FormData();
+    Object.keys(fields).forEach((key) => formData.append(key, fields[key]));
+    return fetch(url, { method: "POST", body: formData }).then((response) => response.json());
+  }
+
+  sendOtpButton.addEventListener("click", function () {
+    const email = emailInput.value.trim();
+    if (!email) {
+      otpStatus.innerText = "Please enter your email address first.";
+      return;
+    }
+    sendOtpButton.disabled = true;
+    postOtpForm("/send_otp", { custom_contact_email: email })
+      .then((data) => {
+        if (data.error) {
+          otpStatus.innerText = data.error;
+        } else {
+          otpStatus.innerText = "OTP sent to " + email + ".";
+          otpContainer.style.display = "block";
+          verifyOtpButton.disabled = false;
+          verifyOtpButton.innerText = "Verify";
+          otpInput.focus();
+        }
+      })
+      .catch((err) => {
+        console.error("Error sending OTP:", err);
+        otpStatus.innerText = "Could not send the OTP, please try again.";
+      })
+      .finally(() => {
+        sendOtpButton.disabled = false;
+        sendOtpButton.innerText = "Resend OTP";
+      });
+  });
+
+  verifyOtpButton.addEventListener("click", function () {
+    const otp = otpInput.value.trim();
+    const email = emailInput.value.trim();
+    if (!otp || !email) {
+      return;
+    }
+    postOtpForm("/verify_otp", { custom_contact_email: email, otp: otp })
+      .then((data) => {
+        if (data.error) {
+          otpStatus.innerText = data.error;
+          verifyOtpButton.innerText = "Verify Again";
+        } else {
+          otpStatus.innerHTML = '<i class="fa fa-check" style="color:green;"></i> OTP verified successfully.';
+          verifyOtpButton.disabled = true;
+        }
+      })
+      .catch((err) => {
+        console.error("Error verifying OTP:", err);
+        otpStatus.innerText = "OTP verification failed.";
+        verifyOtpButton.innerText = "Verify Again";
+      });
+  });
+
+  // A code proves one address; changing it means verifying again
+  emailInput.addEventListener("input", function () {
+    otpContainer.style.display = "none";
+    otpInput.value = "";
+    otpStatus.innerText = "";
+    sendOtpButton.innerText = "Send OTP";
+  });
+});
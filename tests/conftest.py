@@ -0,0 +1,19 @@
+import os
+import sys
+import time
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules live at the top of the repository, next to bench/
+sys.path.insert(0, ROOT)
+
+
+def wait_for(condition, timeout=5.0):
+    # Polls condition() until it is true; fails the test after `timeout` seconds
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail('timed out waiting for a background thread')
+        time.sleep(0.01)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from cache import TTLCache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(maxsize=10, ttl=60)
+    calls = []
+    started = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('key', loader)))
+               for _ in range(8)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == ['value'] * 8
+    assert cache.stats()['coalesced'] == 7
+    assert cache.get_or_load('key', lambda: 'other') == 'value'
+
+
+def test_a_failed_load_reaches_every_waiter_and_is_not_stored():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    def loader():
+        raise ValueError('ERP down')
+
+    for _ in range(2):
+        try:
+            cache.get_or_load('key', loader)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('the error was swallowed')
+    assert cache.stats()['misses'] == 2
+
+
+def test_none_is_returned_but_not_stored():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get_or_load('missing', lambda: None) is None
+    assert cache.get_or_load('missing', lambda: 'found') == 'found'
+
+
+def test_entries_expire_and_the_oldest_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    for key in 'abc':
+        cache.put(key, key.upper())
+    assert cache.get('a') is None
+    assert cache.get('c') == 'C'
+    time.sleep(0.06)
+    assert cache.get('c') is None
+    stats = cache.stats()
+    assert (stats['evictions'], stats['expirations']) == (1, 1)
+
+
+def test_a_value_loaded_before_an_invalidation_is_dropped():
+    cache = TTLCache(maxsize=10, ttl=60)
+    epoch = cache.epoch()
+    cache.invalidate('key')
+    cache.put('key', 'stale', epoch)
+    assert cache.get('key') is None
+    cache.put('key', 'fresh', cache.epoch())
+    assert cache.get('key') == 'fresh'
+
+
+def test_an_invalidation_during_a_load_keeps_its_result_out():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    def loader():
+        cache.invalidate('key')  # as a submission for this serial would, mid-load
+        return 'stale'
+
+    assert cache.get_or_load('key', loader) == 'stale'
+    assert cache.get('key') is None
@@ -0,0 +1,88 @@
+import pytest
+
+from bench.smtp_sink import SMTPSink
+from conftest import wait_for
+from mailer import MailQueue
+
+
+@pytest.fixture
+def sink():
+    server = SMTPSink(('127.0.0.1', 0)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def mail_queue(sink, **kwargs):
+    queue = MailQueue(host='127.0.0.1', port=sink.port, username='', starttls=False, timeout=5,
+                      backoff=0.01, **kwargs)
+    queue.start()
+    return queue
+
+
+def test_delivers_over_one_connection(sink):
+    queue = mail_queue(sink)
+    try:
+        for n in range(3):
+            queue.send([f'user{n}@example.com'], 'Subject', '<p>Hello</p>')
+        wait_for(lambda: queue.stats()['sent'] == 3)
+    finally:
+        queue.stop()
+    assert sink.received == 3
+    assert sink.recipients == [['user0@example.com'], ['user1@example.com'], ['user2@example.com']]
+    assert queue.stats()['connects'] == 1
+
+
+def test_retries_after_a_temporary_failure(sink):
+    sink.replies = ['451 Try again later']
+    queue = mail_queue(sink)
+    try:
+        queue.send(['user@example.com'], 'Subject', '<p>Hello</p>')
+        wait_for(lambda: queue.stats()['sent'] == 1)
+    finally:
+        queue.stop()
+    stats = queue.stats()
+    assert (stats['retried'], stats['failed']) == (1, 0)
+    assert sink.received == 1
+
+
+def test_gives_up_after_max_attempts(sink):
+    sink.replies = ['451 Try again later'] * 3
+    queue = mail_queue(sink, max_attempts=3)
+    try:
+        queue.send(['user@example.com'], 'Subject', '<p>Hello</p>')
+        wait_for(lambda: queue.stats()['failed'] == 1)
+    finally:
+        queue.stop()
+    stats = queue.stats()
+    assert (stats['sent'], stats['retried']) == (0, 2)
+    assert sink.received == 0
+
+
+def test_permanent_failure_is_not_retried(sink):
+    sink.replies = ['550 No such user']
+    queue = mail_queue(sink)
+    try:
+        queue.send(['nobody@example.com'], 'Subject', '<p>Hello</p>')
+        queue.send(['user@example.com'], 'Subject', '<p>Hello</p>')
+        wait_for(lambda: queue.stats()['sent'] == 1)
+    finally:
+        queue.stop()
+    stats = queue.stats()
+    assert (stats['failed'], stats['retried']) == (1, 0)
+    assert sink.recipients == [['user@example.com']]
+
+
+def test_retries_when_the_server_is_unreachable(sink):
+    port = sink.port
+    sink.shutdown()
+    sink.server_close()
+    queue = MailQueue(host='127.0.0.1', port=port, username='', starttls=False, timeout=1, backoff=0.01,
+                      max_attempts=2)
+    queue.start()
+    try:
+        queue.send(['user@example.com'], 'Subject', '<p>Hello</p>')
+        wait_for(lambda: queue.stats()['failed'] == 1)
+    finally:
+        queue.stop()
+    assert queue.stats()['retried'] == 1
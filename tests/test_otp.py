@@ -0,0 +1,116 @@
+import pytest
+
+import otp
+from otp import EXPIRED, INVALID, LOCKED, VERIFIED, OTPStore, OTPUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(otp, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def store(clock):
+    return OTPStore(ttl=300, max_attempts=3, resend_interval=30, lockout=60, max_lockout=200, failure_memory=1000)
+
+
+def wrong(code):
+    return f'{(int(code) + 1) % 10 ** len(code):0{len(code)}d}'
+
+
+def lock(store, code):
+    return [store.verify('a@example.com', wrong(code)) for _ in range(store.max_attempts)]
+
+
+def test_the_right_code(store):
+    code = store.issue('A@example.com ')
+    assert store.verify('a@example.com', code) == VERIFIED
+    assert store.verify('b@example.com', code) == EXPIRED
+
+
+def test_codes_expire(store, clock):
+    code = store.issue('a@example.com')
+    clock.now += 301
+    assert store.verify('a@example.com', code) == EXPIRED
+    assert len(store) == 0
+
+
+def test_resends_are_throttled_even_after_verifying(store, clock):
+    code = store.issue('a@example.com')
+    assert store.verify('a@example.com', code) == VERIFIED
+    with pytest.raises(OTPUnavailable) as e:
+        store.issue('a@example.com')
+    assert e.value.retry_after == 30
+    clock.now += 30
+    store.issue('a@example.com')
+
+
+def test_too_many_wrong_codes_lock_the_address(store, clock):
+    code = store.issue('a@example.com')
+    assert lock(store, code) == [INVALID, INVALID, LOCKED]
+    # Not even the right code now, nor a new one
+    assert store.verify('a@example.com', code) == LOCKED
+    with pytest.raises(OTPUnavailable) as e:
+        store.issue('a@example.com')
+    assert e.value.retry_after == 60
+
+    clock.now += 60
+    # The locked-out code is gone
+    assert store.verify('a@example.com', code) == EXPIRED
+    code = store.issue('a@example.com')
+    assert store.verify('a@example.com', code) == VERIFIED
+
+
+def test_lockouts_double_up_to_the_maximum(store, clock):
+    retry_after = []
+    for _ in range(4):
+        code = store.issue('a@example.com')
+        lock(store, code)
+        with pytest.raises(OTPUnavailable) as e:
+            store.issue('a@example.com')
+        retry_after.append(e.value.retry_after)
+        clock.now += e.value.retry_after
+    assert retry_after == [60, 120, 200, 200]
+
+
+def test_a_new_code_does_not_reset_the_attempts(store, clock):
+    code = store.issue('a@example.com')
+    assert store.verify('a@example.com', wrong(code)) == INVALID
+    assert store.verify('a@example.com', wrong(code)) == INVALID
+    clock.now += 30
+    code = store.issue('a@example.com')
+    assert store.verify('a@example.com', wrong(code)) == LOCKED
+
+
+def test_failures_are_remembered_past_the_code(store, clock):
+    code = store.issue('a@example.com')
+    lock(store, code)
+    clock.now += 60 + 999
+    assert len(store) == 1
+    code = store.issue('a@example.com')
+    lock(store, code)
+    with pytest.raises(OTPUnavailable) as e:
+        store.issue('a@example.com')
+    assert e.value.retry_after == 120
+
+    clock.now += 120 + 1001
+    store.verify('a@example.com', code)
+    assert len(store) == 0
+
+
+def test_the_store_is_bounded(clock):
+    store = OTPStore(max_entries=2)
+    store.issue('a@example.com')
+    store.issue('b@example.com')
+    with pytest.raises(OTPUnavailable):
+        store.issue('c@example.com')
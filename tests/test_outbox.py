@@ -0,0 +1,150 @@
+import pytest
+
+import outbox
+from bench.fake_erp import FakeERP
+from conftest import wait_for
+from erp_client import ERPClient
+from outbox import Outbox
+
+
+class Reply:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._body = body
+        self.text = str(body)
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def fake():
+    server = FakeERP(('127.0.0.1', 0), {}).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def box(tmp_path, fake, monkeypatch):
+    monkeypatch.setattr(outbox, 'erp', ERPClient(base_url=fake.url, read_timeout=0.2, retries=0,
+                                                 slots=None, background_slots=None))
+    monkeypatch.setattr(outbox, 'OUTBOX_RETRY_BACKOFF', 0)
+    monkeypatch.setattr(outbox, 'OUTBOX_UNCONFIRMED_DELAY', 0)
+    return Outbox(str(tmp_path / 'outbox.sqlite3'), workers=0)
+
+
+def issue(customer, subject):
+    return {'customer': customer, 'custom_contact_email': 'a@example.com', 'serial_no': 'SN-1', 'subject': subject}
+
+
+def test_a_customers_tickets_go_out_in_order(box):
+    first = box.enqueue('Issue', issue('C1', 'first'), 'C1')
+    second = box.enqueue('Issue', issue('C1', 'second'), 'C1')
+    other = box.enqueue('Issue', issue('C2', 'other'), 'C2')
+
+    entry = box.claim()
+    assert entry.reference == first
+    # C1's second ticket waits for the first; C2's doesn't
+    assert box.claim().reference == other
+    assert box.claim() is None
+
+    assert box.deliver(entry)
+    assert box.claim().reference == second
+
+
+def test_a_failed_delivery_keeps_the_customers_place(box, fake):
+    first = box.enqueue('Issue', issue('C1', 'first'), 'C1')
+    box.enqueue('Issue', issue('C1', 'second'), 'C1')
+    fake.down = True
+    assert not box.deliver(box.claim())
+    assert box.status(first)['status'] == 'pending'
+    fake.down = False
+    entry = box.claim()
+    assert entry.reference == first
+    assert box.deliver(entry)
+    assert box.status(first)['status'] == 'done'
+
+
+def test_a_batch_goes_out_side_by_side_after_earlier_tickets(box):
+    earlier = box.enqueue('Issue', issue('C1', 'earlier'), 'C1')
+    batch, references = box.enqueue_batch([('Issue', issue('C1', f'row {n}'), 'C1', None) for n in range(3)])
+
+    entry = box.claim()
+    assert entry.reference == earlier
+    assert box.claim() is None
+    box.deliver(entry)
+
+    claimed = [box.claim() for _ in range(3)]
+    assert [e.reference for e in claimed] == references
+    for e in claimed:
+        assert box.deliver(e)
+    assert [row['status'] for row in box.batch_status(batch)] == ['done'] * 3
+    assert box.batch_status('BATCH-UNKNOWN') is None
+
+
+def test_an_expired_lease_is_looked_up_before_sending_again(box, fake, monkeypatch):
+    reference = box.enqueue('Issue', issue('C1', 'lost'), 'C1')
+    entry = box.claim()
+    # The worker POSTs, then dies before recording it
+    outbox.erp.insert('Issue', entry.payload)
+    assert len(fake.inserted) == 1
+
+    monkeypatch.setattr(outbox, 'OUTBOX_LEASE', -1)
+    again = box.claim()
+    assert again.reference == reference
+    assert again.attempts == 1
+    assert box.deliver(again)
+    assert len(fake.inserted) == 1
+    assert box.status(reference) == {'reference': reference, 'status': 'done', 'ticket': 'ISS-00001',
+                                     'attempts': 2}
+
+
+def test_a_lookup_does_not_claim_another_entrys_document(box, fake, monkeypatch):
+    # Two identical tickets; the first was delivered, the second's POST was lost
+    first = box.enqueue('Issue', issue('C1', 'same'), 'C1')
+    second = box.enqueue('Issue', issue('C1', 'same'), 'C1')
+    assert box.deliver(box.claim())
+    box.claim()
+    monkeypatch.setattr(outbox, 'OUTBOX_LEASE', -1)
+    assert box.deliver(box.claim())
+    assert len(fake.inserted) == 2
+    assert box.status(first)['ticket'] != box.status(second)['ticket']
+
+
+def test_a_read_timeout_is_unconfirmed_and_not_sent_twice(box, fake):
+    reference = box.enqueue('Issue', issue('C1', 'slow'), 'C1')
+    fake.latency = 0.5
+    assert not box.deliver(box.claim())
+    assert box.status(reference)['status'] == 'unconfirmed'
+
+    wait_for(lambda: fake.inserted)
+    fake.latency = 0
+    assert box.deliver(box.claim())
+    assert len(fake.inserted) == 1
+    assert box.status(reference)['status'] == 'done'
+
+
+def test_a_rejected_ticket_fails_without_holding_up_the_customer(box, fake, monkeypatch):
+    rejected = []
+    box.on_rejected = lambda entry, reason: rejected.append(entry.reference)
+    monkeypatch.setattr(outbox.erp, 'insert', lambda *args, **kwargs: Reply(417, {'exc_type': 'ValidationError'}))
+    first = box.enqueue('Issue', issue('C1', 'bad'), 'C1')
+    second = box.enqueue('Issue', issue('C1', 'next'), 'C1')
+    assert not box.deliver(box.claim())
+    assert rejected == [first]
+    assert box.status(first)['status'] == 'failed'
+    assert box.claim().reference == second
+
+
+def test_purge_keeps_recent_and_unfinished_entries(box):
+    done = box.enqueue('Issue', issue('C1', 'done'), 'C1')
+    box.deliver(box.claim())
+    waiting = box.enqueue('Issue', issue('C2', 'waiting'), 'C2')
+    assert box.purge(retention_days=1) == 0
+    assert box.purge(retention_days=-1) == 1
+    assert box.status(done) is None
+    assert box.status(waiting)['status'] == 'pending'
+    assert box.stats() == {'pending': 1}
+
@@ -0,0 +1,61 @@
+import pytest
+
+from ratelimit import MemoryBackend, RateLimiter, SQLiteBackend, parse_limits
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'ratelimit.sqlite3'))
+
+
+def test_a_burst_then_the_refill_rate(backend):
+    assert [backend.take('k', 1, 3, 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert backend.take('k', 1, 3, 100.0) == pytest.approx(1.0)
+    assert backend.take('k', 1, 3, 100.5) == pytest.approx(0.5)
+    assert backend.take('k', 1, 3, 101.0) == 0.0
+    # Other keys have buckets of their own
+    assert backend.take('other', 1, 3, 101.0) == 0.0
+
+
+def test_an_idle_bucket_refills_to_the_burst_only(backend):
+    for _ in range(3):
+        backend.take('k', 1, 3, 100.0)
+    assert [backend.take('k', 1, 3, 1000.0) for _ in range(4)][-1] == pytest.approx(1.0)
+
+
+def test_memory_backend_evicts_the_least_recently_used_bucket():
+    backend = MemoryBackend(max_keys=2)
+    backend.take('a', 1, 1, 100.0)
+    backend.take('b', 1, 1, 100.0)
+    # A refused request counts as use: 'a' stays and 'b' goes
+    assert backend.take('a', 1, 1, 100.0) > 0
+    backend.take('c', 1, 1, 100.0)
+    assert len(backend) == 2
+    assert backend.take('a', 1, 1, 100.0) > 0
+    assert backend.take('b', 1, 1, 100.0) == 0.0
+
+
+def test_parse_limits():
+    assert parse_limits('/a=5/20, /b=0.5,') == {'/a': (5.0, 20.0), '/b': (0.5, 0.5)}
+
+
+def test_limiter_answers_with_whole_seconds():
+    limiter = RateLimiter(MemoryBackend(), limits={'/search': (0.5, 1)})
+    assert limiter.check('/search', '10.0.0.1') is None
+    assert limiter.check('/search', '10.0.0.1') == 2
+    assert limiter.check('/search', '10.0.0.2') is None
+    assert limiter.check('/unlimited', '10.0.0.1') is None
+    assert (limiter.stats()['allowed'], limiter.stats()['limited']) == (2, 1)
+
+
+def test_limiter_off():
+    assert RateLimiter(None, limits={'/search': (1, 1)}).check('/search', '10.0.0.1') is None
+
+
+def test_forwarded_for_is_only_trusted_when_configured():
+    assert RateLimiter(None, limits={}).client('10.0.0.1', '1.2.3.4') == '10.0.0.1'
+    trusting = RateLimiter(None, limits={}, trust_forwarded=True)
+    assert trusting.client('10.0.0.1', '1.2.3.4, 10.0.0.9') == '1.2.3.4'
+    assert trusting.client('10.0.0.1', None) == '10.0.0.1'
@@ -0,0 +1,68 @@
+import pytest
+
+from serial_index import SerialIndex, _State
+
+
+def row(name, customer='Customer 1', modified='2024-01-01 00:00:00'):
+    return {'name': name, 'item_name': 'Instrument', 'item_code': 'IC-001', 'customer_instrument_id': 'CI-1',
+            'customer': customer, 'custom_amc_type_name': 'AMC', 'modified': modified}
+
+
+@pytest.fixture
+def index():
+    state = _State()
+    for name in ['SN-0100', 'SN-0010', 'AB-1000', 'XSN-200', 'ab-55', 'ZZ-9', 'NOCUST-1']:
+        state.apply(row(name, customer=None if name.startswith('NOCUST') else 'Customer 1'), keep_sorted=False)
+    state.by_name.sort()
+    serials = SerialIndex()
+    serials._state = state
+    return serials
+
+
+def test_prefix_matches_come_first_in_name_order(index):
+    assert index.search('sn-', 10) == ['SN-0010', 'SN-0100', 'XSN-200']
+
+
+def test_substring(index):
+    assert sorted(index.search('100', 10)) == ['AB-1000', 'SN-0100']
+    assert index.search('-9', 10) == ['ZZ-9']
+
+
+def test_one_and_two_character_terms(index):
+    assert index.search('ab', 10) == ['AB-1000', 'ab-55']
+    assert index.search('z', 10) == ['ZZ-9']
+    assert set(index.search('5', 10)) == {'ab-55'}
+    assert set(index.search('x', 10)) == {'XSN-200'}
+    assert index.search('q', 10) == []
+
+
+def test_case_insensitive(index):
+    assert index.search('Xsn', 10) == ['XSN-200']
+
+
+def test_limit(index):
+    assert len(index.search('-', 3)) == 3
+    assert index.search('-', 0) == []
+
+
+def test_serials_without_a_customer_are_left_out(index):
+    assert index.search('nocust', 10) == []
+    assert len(index) == 6
+
+
+def test_a_serial_that_loses_its_customer_drops_out(index):
+    index._state.apply(row('ZZ-9', customer=None, modified='2024-02-01 00:00:00'))
+    assert index.search('z', 10) == []
+    index._state.apply(row('ZZ-9', modified='2024-03-01 00:00:00'))
+    assert index.search('z', 10) == ['ZZ-9']
+    assert index._state.high_water == '2024-03-01 00:00:00'
+
+
+def test_a_new_serial_is_found_by_prefix_and_substring(index):
+    index._state.apply(row('SN-0001'))
+    assert index.search('sn-', 2) == ['SN-0001', 'SN-0010']
+    assert set(index.search('01', 10)) == {'SN-0001', 'SN-0010', 'SN-0100'}
+
+
+def test_not_loaded():
+    assert SerialIndex().search('sn', 10) == []
@@ -0,0 +1,71 @@
+import math
+
+import pytest
+
+from snapshot import UNCHANGED, SnapshotMap, SnapshotStore, write_snapshot
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'table.snap')
+    mapping = {'Zone B': 'Manager 1', 'Zone A': 'Manager 1', 'Zône C': 'Managér 2', 'empty': None,
+               'nan': math.nan}
+    write_snapshot(path, mapping, version=3)
+
+    data = SnapshotMap(path)
+    assert data.version == 3
+    assert dict(data) == {'Zone A': 'Manager 1', 'Zone B': 'Manager 1', 'Zône C': 'Managér 2'}
+    assert list(data) == ['Zone A', 'Zone B', 'Zône C']
+    assert data['Zône C'] == 'Managér 2'
+    assert data.get('Zone') is None
+    with pytest.raises(KeyError):
+        data[1]
+
+
+def test_an_empty_mapping(tmp_path):
+    path = str(tmp_path / 'table.snap')
+    write_snapshot(path, {}, version=1)
+    data = SnapshotMap(path)
+    assert len(data) == 0
+    assert 'anything' not in data
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / 'table.snap'
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        SnapshotMap(str(path))
+
+
+def test_store_builds_once_while_fresh(tmp_path):
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {'key': f'value {len(builds)}'}
+
+    store = SnapshotStore('table', build, max_age=60, directory=str(tmp_path), read_only=False)
+    assert dict(store.load()) == {'key': 'value 1'}
+    assert dict(store.load()) == {'key': 'value 1'}
+    assert len(builds) == 1
+
+    # Another worker sees the same file without building
+    reader = SnapshotStore('table', build, max_age=60, directory=str(tmp_path), read_only=True)
+    assert dict(reader.load()) == {'key': 'value 1'}
+    assert len(builds) == 1
+
+
+def test_store_rebuilds_when_stale(tmp_path):
+    results = [{'key': 'old'}, UNCHANGED, {'key': 'new'}]
+    store = SnapshotStore('table', lambda: results.pop(0), max_age=0, directory=str(tmp_path), read_only=False)
+    first = store.load()
+    assert (first.version, first['key']) == (1, 'old')
+    unchanged = store.load()
+    assert (unchanged.version, unchanged['key']) == (1, 'old')
+    assert unchanged.created_at >= first.created_at
+    rebuilt = store.load()
+    assert (rebuilt.version, rebuilt['key']) == (2, 'new')
+
+
+def test_read_only_store_without_a_file(tmp_path):
+    store = SnapshotStore('table', lambda: {'key': 'value'}, max_age=60, directory=str(tmp_path), read_only=True)
+    assert store.load() is None
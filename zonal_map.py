@@ -0,0 +1,310 @@
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import log
+from delta_sync import DeltaBuilder, DeltaSource
+from snapshot import UNCHANGED
+
+
+ZONAL_MAP_REFRESH_INTERVAL = int(os.environ.get('ZONAL_MAP_REFRESH_INTERVAL', 60))
+ZONAL_MAP_RETRY_INTERVAL = int(os.environ.get('ZONAL_MAP_RETRY_INTERVAL', 60))
+ZONAL_MAP_FULL_INTERVAL = int(os.environ.get('ZONAL_MAP_FULL_INTERVAL', 6 * 3600))
+ZONAL_MAP_MAX_DEPTH = int(os.environ.get('ZONAL_MAP_MAX_DEPTH', 10))
+ZONAL_MAP_SNAPSHOT = 'customer_zonal_manager'
+
+logger = log.get('zonal_map')
+
+ZONAL_MANAGER_DESIGNATION = 'Area Service Manager'
+
+# Managers assigned by hand on top of the Service Person records
+MANUAL_MANAGERS = [("Shivam Kumar", "East"), ("Anuraj T. R", "South 3")]
+MANAGER_ALIASES = {
+    'Anuraj T. R': 'Anuraj T',
+    'Subrahmanyam Somagani': 'S.Somagani',
+    'Vivek Singh Chauhan': 'Vivek Chauhan',
+    'Tousif Rauf Baig Mirza': 'Tausif Mirza',
+}
+
+# Per-stage timings of the last sync in this process, for /stats
+last_timings = None
+
+
+def _newest_first(rows):
+    # The ERP's default list order
+    return sorted(rows, key=lambda row: (row.get('modified') or '', row.get('name') or ''), reverse=True)
+
+
+def manager_rows(employees, service_persons):
+    # (zonal_manager, parent_territory) pairs in the order of the Employee x Service Person
+    # left merge this map was first built from, followed by the manual assignments
+    by_employee = defaultdict(list)
+    for person in _newest_first(service_persons.values()):
+        by_employee[person.get('employee')].append(person)
+    rows = []
+    for employee in _newest_first(employees.values()):
+        for person in by_employee.get(employee['name'], ()):
+            rows.append((person.get('name'), person.get('territory')))
+    rows.extend(MANUAL_MANAGERS)
+    return [(MANAGER_ALIASES.get(manager, manager), territory) for manager, territory in rows]
+
+
+def manager_tables(rows):
+    # A customer's own parent territory takes the last manager listed for it and
+    # territories further up take the first.
+    direct = {}
+    inherited = {}
+    for manager, territory in rows:
+        if manager is None or territory is None:
+            continue
+        direct[territory] = manager
+        inherited.setdefault(territory, manager)
+    return direct, inherited
+
+
+def is_zonal_manager(employee):
+    return employee.get('designation') == ZONAL_MANAGER_DESIGNATION and employee.get('status') == 'Active'
+
+
+class ZonalMapSync(DeltaBuilder):
+    # Builds customer -> zonal manager from Service Person, Employee, Customer and Territory.
+    # The tables stay in memory between runs; a delta run pulls only rows modified since
+    # the last one and re-resolves just the customers they can affect:
+    #   - a customer that was added or moved,
+    #   - every customer at or below a territory whose parent changed,
+    #   - every customer below a territory whose manager changed.
+
+    def __init__(self, full_interval=ZONAL_MAP_FULL_INTERVAL, max_depth=ZONAL_MAP_MAX_DEPTH):
+        super().__init__(full_interval)
+        self.max_depth = max_depth
+        self.sources = {
+            'Service Person': DeltaSource('Service Person', ['name', 'employee', 'territory']),
+            # Pulled unfiltered so an employee who stops being a manager shows up as a change
+            'Employee': DeltaSource('Employee', ['name', 'employee_name', 'designation', 'status']),
+            'Customer': DeltaSource('Customer', ['name', 'territory']),
+            'Territory': DeltaSource('Territory', ['territory_name', 'parent_territory']),
+        }
+        self.service_persons = {}
+        self.employees = {}
+        self.customers = {}
+        self.parent = {}
+        self.children = defaultdict(set)
+        self.by_territory = defaultdict(set)
+        self.direct = {}
+        self.inherited = {}
+        self.result = {}
+
+    def _pull(self, pull, apply):
+        # None of the four tables depends on another, so pull them side by side
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix='zonal-fetch') as pool:
+            futures = {
+                doctype: pool.submit(apply[doctype], pull(source))
+                for doctype, source in self.sources.items()
+            }
+            return {doctype: future.result() for doctype, future in futures.items()}
+
+    def full(self):
+        # pandas is only needed for this bulk rebuild, so keep it out of worker startup
+        import pandas as pd
+
+        started = time.perf_counter()
+        service_persons = {}
+        employees = {}
+        customers = {}
+        parent = {}
+
+        def keep_service_persons(rows):
+            for row in rows:
+                service_persons[row['name']] = row
+            return len(service_persons)
+
+        def keep_employees(rows):
+            count = 0
+            for row in rows:
+                count += 1
+                if is_zonal_manager(row):
+                    employees[row['name']] = row
+            return count
+
+        def keep_customers(rows):
+            for row in rows:
+                customers[row.get('name')] = row.get('territory')
+            return len(customers)
+
+        def keep_territories(rows):
+            for row in rows:
+                if row.get('territory_name') is not None:
+                    parent.setdefault(row['territory_name'], row.get('parent_territory'))
+            return len(parent)
+
+        counts = self._pull(lambda source: source.pull_all(), {
+            'Service Person': keep_service_persons,
+            'Employee': keep_employees,
+            'Customer': keep_customers,
+            'Territory': keep_territories,
+        })
+        fetched = time.perf_counter()
+
+        rows = manager_rows(employees, service_persons)
+        managers_df = pd.DataFrame(rows, columns=['zonal_manager', 'parent_territory'])
+        customer_df = pd.DataFrame({'name': list(customers), 'territory': list(customers.values())})
+        territory_df = pd.DataFrame({'territory': list(parent), 'parent_territory': list(parent.values())})
+        merged = time.perf_counter()
+
+        resolved = resolve_zonal_managers(managers_df, customer_df, territory_df, self.max_depth)
+        result = {name: manager for name, manager in resolved.items() if isinstance(manager, str)}
+
+        self.service_persons = service_persons
+        self.employees = employees
+        self.customers = customers
+        self.parent = parent
+        self.children = defaultdict(set)
+        for territory, up in parent.items():
+            self.children[up].add(territory)
+        self.by_territory = defaultdict(set)
+        for name, territory in customers.items():
+            self.by_territory[territory].add(name)
+        self.direct, self.inherited = manager_tables(rows)
+        self.result = result
+        for source in self.sources.values():
+            source.commit()
+        done = time.perf_counter()
+
+        self._report('full', counts, {
+            'fetch': fetched - started,
+            'decode': self._decode_seconds(),
+            'merge': merged - fetched,
+            'resolve': done - merged,
+            'total': done - started,
+        }, len(result))
+        return result
+
+    def delta(self):
+        started = time.perf_counter()
+        changes = self._pull(lambda source: source.pull_changes(), dict.fromkeys(self.sources, list))
+        fetched = time.perf_counter()
+
+        affected = set()
+        for row in changes['Territory']:
+            territory = row.get('territory_name')
+            up = row.get('parent_territory')
+            if territory is None or (territory in self.parent and self.parent[territory] == up):
+                continue
+            if territory in self.parent:
+                self.children[self.parent[territory]].discard(territory)
+            self.parent[territory] = up
+            self.children[up].add(territory)
+            affected.update(self._customers_below(territory, include_self=True))
+
+        for row in changes['Customer']:
+            name = row.get('name')
+            territory = row.get('territory')
+            if name in self.customers:
+                if self.customers[name] == territory:
+                    continue
+                self.by_territory[self.customers[name]].discard(name)
+            self.customers[name] = territory
+            self.by_territory[territory].add(name)
+            affected.add(name)
+
+        if changes['Service Person'] or changes['Employee']:
+            for row in changes['Service Person']:
+                self.service_persons[row['name']] = row
+            for row in changes['Employee']:
+                if is_zonal_manager(row):
+                    self.employees[row['name']] = row
+                else:
+                    self.employees.pop(row['name'], None)
+            direct, inherited = manager_tables(manager_rows(self.employees, self.service_persons))
+            moved = {t for t in direct.keys() | self.direct.keys() if direct.get(t) != self.direct.get(t)}
+            moved |= {t for t in inherited.keys() | self.inherited.keys() if inherited.get(t) != self.inherited.get(t)}
+            self.direct, self.inherited = direct, inherited
+            for territory in moved:
+                affected.update(self._customers_below(territory, include_self=False))
+        applied = time.perf_counter()
+
+        changed = 0
+        for name in affected:
+            manager = self.resolve_customer(self.customers.get(name))
+            if self.result.get(name) != manager:
+                changed += 1
+                if manager is None:
+                    self.result.pop(name, None)
+                else:
+                    self.result[name] = manager
+        for source in self.sources.values():
+            source.commit()
+        done = time.perf_counter()
+
+        self._report('delta', {doctype: len(rows) for doctype, rows in changes.items()}, {
+            'fetch': fetched - started,
+            'decode': self._decode_seconds(),
+            'merge': applied - fetched,
+            'resolve': done - applied,
+            'total': done - started,
+        }, changed, affected=len(affected))
+        return self.result if changed else UNCHANGED
+
+    def resolve_customer(self, territory):
+        # The same walk as resolve_zonal_managers, for one customer
+        ancestor = self.parent.get(territory)
+        manager = self.direct.get(ancestor)
+        for _ in range(self.max_depth - 1):
+            if manager is not None or ancestor is None:
+                break
+            ancestor = self.parent.get(ancestor)
+            manager = self.inherited.get(ancestor)
+        return manager
+
+    def _decode_seconds(self):
+        # Decoding overlaps the downloads, so this is part of `fetch`, not added to it
+        return sum(source.last_pull.decode_seconds for source in self.sources.values())
+
+    def _customers_below(self, territory, include_self):
+        found = set(self.by_territory.get(territory, ())) if include_self else set()
+        seen = {territory}
+        stack = list(self.children.get(territory, ()))
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            found.update(self.by_territory.get(current, ()))
+            stack.extend(self.children.get(current, ()))
+        return found
+
+    def _report(self, mode, rows, seconds, changed, **extra):
+        global last_timings
+        last_timings = dict(
+            {stage: round(value, 3) for stage, value in seconds.items()},
+            mode=mode, rows=rows, changed=changed, **extra
+        )
+        logger.info('zonal_map_synced', **last_timings)
+
+
+def resolve_zonal_managers(managers_df, customer_df, territory_df, max_depth=ZONAL_MAP_MAX_DEPTH):
+    # Walks each customer up the territory tree, starting at its territory's parent, until
+    # a territory with an Area Service Manager is found. Every level is one vectorized
+    # lookup over the customers still unresolved, so the cost is O(customers x depth).
+    managers = managers_df.dropna(subset=['parent_territory', 'zonal_manager'])
+    # The customer's own parent territory takes the last manager listed for it and
+    # territories further up take the first, matching the earlier merge/groupby result.
+    direct = managers.drop_duplicates('parent_territory', keep='last').set_index('parent_territory')['zonal_manager']
+    inherited = managers.drop_duplicates('parent_territory', keep='first').set_index('parent_territory')['zonal_manager']
+    parent = territory_df.dropna(subset=['territory']).drop_duplicates('territory').set_index('territory')['parent_territory']
+
+    customers = customer_df.reset_index(drop=True)
+    ancestor = customers['territory'].map(parent)
+    zonal_manager = ancestor.map(direct).astype(object)
+    pending = ancestor[zonal_manager.isna() & ancestor.notna()]
+    for _ in range(max_depth - 1):
+        if pending.empty:
+            break
+        pending = pending.map(parent).dropna()
+        found = pending.map(inherited)
+        hit = found.notna()
+        zonal_manager.loc[found.index[hit]] = found[hit]
+        pending = pending[~hit]
+
+    return dict(zip(customers['name'], zonal_manager))